@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AppsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shapeblock.apps"
+
+    def ready(self):
+        from . import signals  # noqa: F401
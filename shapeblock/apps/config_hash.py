@@ -0,0 +1,109 @@
+"""
+Fingerprint of the config a deployment of an app is built with.
+
+`App.config_hash` is an HMAC of the app's env vars, secrets, build vars and
+volumes in a canonical, order independent form. It is refreshed whenever one of
+those rows is saved or deleted (see `signals`), and after the bulk writes of the
+config endpoints, so whether the config changed since a deployment is a single
+comparison with `Deployment.config_hash`. Writes which bypass both, e.g. from a
+shell, are corrected by `manage.py refresh_config_hashes`.
+
+The HMAC is keyed with `SECRET_KEY`, so the hash doesn't allow guessing secret
+values, and only secret keys are kept in `Deployment.params`.
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import App, BuildVar, EnvVar, Secret, Volume
+
+_local = threading.local()
+
+
+def get_config(app_id, secret_values: bool = True) -> Dict:
+    """
+    The config of an app, with only the sorted secret keys unless
+    `secret_values`, so the secrets aren't read and decrypted.
+    """
+    volumes = Volume.objects.filter(app_id=app_id).values_list(
+        "name", "mount_path", "size"
+    )
+    secrets = Secret.objects.filter(app_id=app_id)
+    return {
+        "env_vars": dict(
+            EnvVar.objects.filter(app_id=app_id).values_list("key", "value")
+        ),
+        "secrets": (
+            dict(secrets.values_list("key", "value"))
+            if secret_values
+            else sorted(secrets.values_list("key", flat=True))
+        ),
+        "build_vars": dict(
+            BuildVar.objects.filter(app_id=app_id).values_list("key", "value")
+        ),
+        "volumes": [
+            {"name": name, "mount_path": mount_path, "size": size}
+            for name, mount_path, size in sorted(volumes)
+        ],
+    }
+
+
+def config_hash(config: Dict) -> str:
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hmac.new(
+        settings.SECRET_KEY.encode("utf-8"),
+        canonical.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def get_params(app_id) -> Dict:
+    """
+    The params to record on a deployment, without secret values.
+    """
+    return get_config(app_id, secret_values=False)
+
+
+def refresh_config_hash(app_id) -> bool:
+    """
+    Recompute the app's hash. Returns whether the stored one was stale.
+    """
+    value = config_hash(get_config(app_id))
+    return bool(
+        App.objects.filter(pk=app_id)
+        .exclude(config_hash=value)
+        .update(config_hash=value)
+    )
+
+
+def schedule_config_hash_refresh(app_id):
+    """
+    Refresh the hash once the current transaction commits, so it is computed
+    from the committed rows.
+    """
+    transaction.on_commit(lambda: refresh_config_hash(app_id))
+
+
+def refresh_deferred() -> bool:
+    return getattr(_local, "deferred", False)
+
+
+@contextmanager
+def defer_config_hash_refresh():
+    """
+    Skip the refresh the signals schedule for every saved or deleted row, for
+    bulk writes which schedule a single one for the app themselves.
+    """
+    previous = refresh_deferred()
+    _local.deferred = True
+    try:
+        yield
+    finally:
+        _local.deferred = previous
@@ -1,88 +1,154 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 
 from shapeblock.apps.models import App
+from shapeblock.projects.models import Project
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
-import threading
-from kubernetes import client, config, watch
+from .pod_logs import list_app_pods, pod_log_hub
+from .status import app_status_snapshot, project_group, user_group
 
 
 class AppStatusConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes status changes of the user's apps, or of one project's apps with
+    `?project=<uuid>`. A snapshot of all those apps is sent on connect, and again
+    on `{"type": "snapshot"}`. Updates arriving within
+    APP_STATUS_COALESCE_WINDOW seconds are sent as one frame, with the latest
+    status of each app.
+    """
+
+    group_name = None
+    flush_task = None
+
     async def connect(self):
-        self.group_name = "apps"
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=4001)
+            return
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.project_uuid = (query.get("project") or [None])[-1]
+        if self.project_uuid is not None:
+            if not await self.owns_project(user, self.project_uuid):
+                await self.close(code=4004)
+                return
+            self.group_name = project_group(self.project_uuid)
+        else:
+            self.group_name = user_group(user.pk)
+        self.pending = {}
 
         await self.channel_layer.group_add(self.group_name, self.channel_name)
 
         await self.accept()
+        await self.send_snapshot()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if data.get("type") == "snapshot":
+            await self.send_snapshot()
 
-        await self.channel_layer.group_send(
-            self.group_name, {"type": "app_status_message", "data": data}
+    async def send_snapshot(self):
+        apps = await database_sync_to_async(app_status_snapshot)(
+            self.scope["user"], self.project_uuid
         )
+        await self.send(text_data=json.dumps({"type": "snapshot", "apps": apps}))
 
     async def app_status_message(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        data = event["data"]
+        self.pending[data["uuid"]] = data
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        await asyncio.sleep(settings.APP_STATUS_COALESCE_WINDOW)
+        apps, self.pending = list(self.pending.values()), {}
+        self.flush_task = None
+        await self.send(text_data=json.dumps({"type": "status", "apps": apps}))
+
+    @database_sync_to_async
+    def owns_project(self, user, project_uuid):
+        try:
+            return Project.objects.filter(uuid=project_uuid, user=user).exists()
+        except ValidationError:
+            return False
 
 
 class PodLogConsumer(AsyncWebsocketConsumer):
+    """
+    Streams the logs of an app's pods. The pods of the app are sent on connect,
+    and the logs of the first one (or those given with `?pod=`) are followed.
+    Send `{"pods": [...]}` to follow other pods. Log lines are sent in batches
+    as `{"pod": ..., "message": ...}`.
+    """
+
     async def connect(self):
         self.app_uuid = self.scope["url_route"]["kwargs"]["app_uuid"]
-        self.channel_layer = get_channel_layer()
+        self.streams = {}
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=4001)
+            return
+        self.namespace = await self.get_app_details(user)
+        if self.namespace is None:
+            await self.close(code=4004)
+            return
 
         # Accept the WebSocket connection
         await self.accept()
 
-        # Load kubeconfig and set up Kubernetes client
-        self.namespace = await self.get_app_details()
-        config.load_incluster_config()
+        self.pods = await list_app_pods(self.namespace, self.app_uuid)
+        await self.send(text_data=json.dumps({"pods": self.pods}))
 
-        # Start streaming logs in a separate thread
-        thread = threading.Thread(target=self.stream_logs)
-        thread.start()
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        await self.follow(query.get("pod") or self.pods[:1])
 
-    def stream_logs(self):
-        v1 = client.CoreV1Api()
-        w = watch.Watch()
-
-        pods = v1.list_namespaced_pod(
-            namespace=self.namespace, label_selector=f"appUuid={self.app_uuid}"
-        )
-        pod = pods.items[0]
-        self.pod_name = pod.metadata.name
-        for line in w.stream(
-            v1.read_namespaced_pod_log,
-            name=self.pod_name,
-            namespace=self.namespace,
-            since_seconds=300,
-        ):
-            formatted_line = f"{line}\n"
-            # Send message to the channel layer from the thread
-            async_to_sync(self.channel_layer.send)(
-                self.channel_name,
-                {
-                    "type": "websocket.send",
-                    "text": json.dumps({"message": formatted_line}),
-                },
-            )
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        if "pods" in data:
+            # pods come and go, e.g. when the app is scaled or redeployed
+            self.pods = await list_app_pods(self.namespace, self.app_uuid)
+            await self.follow(data["pods"])
+
+    async def follow(self, pods):
+        pods = {pod for pod in pods if pod in self.pods}
+        for pod in set(self.streams) - pods:
+            self.streams.pop(pod).cancel()
+        for pod in pods - set(self.streams):
+            self.streams[pod] = asyncio.create_task(self.stream_logs(pod))
+
+    async def stream_logs(self, pod):
+        async with pod_log_hub.subscribe(self.namespace, pod) as frames:
+            while (lines := await frames.get()) is not None:
+                message = "".join(f"{line}\n" for line in lines)
+                await self.send(text_data=json.dumps({"pod": pod, "message": message}))
+        await self.send(text_data=json.dumps({"pod": pod, "ended": True}))
+        self.streams.pop(pod, None)
 
     async def disconnect(self, close_code):
-        # Handle disconnection
-        pass
+        for task in self.streams.values():
+            task.cancel()
+        self.streams = {}
 
     @database_sync_to_async
-    def get_app_details(self):
-        app = App.objects.get(uuid=self.app_uuid)
-        return app.project.name
-
-    async def websocket_send(self, event):
-        # Send the message to the WebSocket
-        await self.send(text_data=event["text"])
+    def get_app_details(self, user):
+        try:
+            app = (
+                App.objects.select_related("project")
+                .filter(uuid=self.app_uuid, user=user)
+                .first()
+            )
+        except ValidationError:
+            return None
+        return app.project.name if app is not None else None
@@ -1,32 +1,74 @@
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from github import Github
+from django.conf import settings
+from github import GithubException
 from shapeblock.utils.users import get_user_connected_accounts
 
+from .github_client import PER_PAGE, always_revalidate, get_client
+
 logger = logging.getLogger("django")
 
 
 def get_default_branch(token, repo_id):
-    gh = Github(token) if token else Github()
+    gh = get_client(token)
     repo = gh.get_repo(repo_id)
     return repo.default_branch
 
 
 def get_head_commit(token, full_name, branch):
-    gh = Github(token) if token else Github()
-    branch = gh.get_repo(full_name).get_branch(branch)
+    gh = get_client(token)
+    repo = gh.get_repo(full_name)
+    # the head moves on every push, never serve it from the cache unchecked
+    with always_revalidate():
+        branch = repo.get_branch(branch)
     return branch.commit.sha
 
 
 # TODO: sort by time
-def get_branches(token, repo_id):
-    gh = Github(token) if token else Github()
-    repo = gh.get_repo(repo_id)
+def get_branches(token, repo_id, prefix="", page=1):
+    """
+    One page of up to PER_PAGE branch names, only those starting with `prefix`
+    when given, and whether there is a next page.
+    """
+    repo = get_client(token).get_repo(repo_id, lazy=True)
+    if prefix:
+        # the matching refs aren't paginated, all of them come in one
+        # (cached) response
+        names = [
+            ref.ref[len("refs/heads/") :]
+            for ref in repo.get_git_matching_refs(f"heads/{prefix}")
+        ]
+        return (
+            names[(page - 1) * PER_PAGE : page * PER_PAGE],
+            len(names) > page * PER_PAGE,
+        )
+    names = [branch.name for branch in repo.get_branches().get_page(page - 1)]
+    return names, len(names) == PER_PAGE
+
+
+def get_all_branches(token, repo_id):
+    """
+    Every branch name of the repo, following the pages.
+    """
+    repo = get_client(token).get_repo(repo_id, lazy=True)
     return [branch.name for branch in repo.get_branches()]
 
 
+def branch_exists(repo, branch):
+    try:
+        repo.get_branch(branch)
+    except GithubException as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
 def get_repo(token, full_name):
-    gh = Github(token) if token else Github()
+    gh = get_client(token)
     return gh.get_repo(full_name)
 
 
@@ -35,42 +77,67 @@ def add_deploy_key(repo, name, public_key):
     return key.id
 
 
-def get_user_repos(token, query, owner=None):
-    gh = Github(token)
+def _search_repos(gh, query, results, stop):
+    try:
+        for repo in gh.search_repositories(query=query):
+            if stop.is_set():
+                break
+            results.put(
+                {"id": repo.id, "url": repo.ssh_url, "full_name": repo.full_name}
+            )
+    except Exception as e:
+        results.put(e)
+    finally:
+        results.put(None)
+
+
+def iter_user_repos(token, query, owner=None, limit=None):
+    """
+    Yield the repos matching `query` of the user (or `owner`) and of each of the
+    user's orgs, as the searches return them. The searches run concurrently, on
+    up to GITHUB_SEARCH_WORKERS threads, and stop early once `limit` repos have
+    been yielded.
+    """
+    gh = get_client(token)
     # Github search is little weird. It does not search across orgs.
-    # We create a list of orgs, seach in each org and append it to search results.
+    # We search in each org and merge the results.
     user = gh.get_user()
-    login = user.login
-    if owner:
-        login = owner
-    orgs = user.get_orgs()
-    user_search_results = gh.search_repositories(
-        query=f"{query} user:{login} fork:true"
-    )
-    org_search_results = [
-        gh.search_repositories(query=f"{query} user:{login} org:{org.login} fork:true")
-        for org in orgs
-    ]
-    search_results = [user_search_results] + org_search_results
-    results = []
-    [
-        results.extend(
-            [
-                {"id": repo.id, "url": repo.ssh_url, "full_name": repo.full_name}
-                for repo in search_result
-            ]
-        )
-        for search_result in search_results
-    ]
-    # make results unique
-    unique_ids = []
-    new_results = []
-    for result in results:
-        id = result["id"]
-        if id not in unique_ids:
-            new_results.append(result)
-            unique_ids.append(id)
-    return new_results
+    login = owner or user.login
+    results = queue.Queue()
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=settings.GITHUB_SEARCH_WORKERS)
+    try:
+        searches = 1
+        pool.submit(_search_repos, gh, f"{query} user:{login} fork:true", results, stop)
+        for org in user.get_orgs():
+            searches += 1
+            pool.submit(
+                _search_repos,
+                gh,
+                f"{query} user:{login} org:{org.login} fork:true",
+                results,
+                stop,
+            )
+
+        seen = set()
+        while searches:
+            result = results.get()
+            if result is None:
+                searches -= 1
+            elif isinstance(result, Exception):
+                raise result
+            elif result["id"] not in seen:
+                seen.add(result["id"])
+                yield result
+                if limit is not None and len(seen) >= limit:
+                    return
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_user_repos(token, query, owner=None, limit=None):
+    return list(iter_user_repos(token, query, owner, limit))
 
 
 # TODO: delete github key
@@ -86,18 +153,20 @@ def get_git_refs(user, git_path):
     if not connected_accounts:
         repo = get_repo(None, git_path)
         return (
-            get_branches(None, repo.id),
+            get_all_branches(None, repo.id),
             get_default_branch(None, repo.id),
         )
 
     account = [ac for ac in connected_accounts if ac["name"].startswith("github")]
     token = account[0]["id"]
-    repo = [r for r in get_user_repos(token, name, owner) if r["full_name"] == git_path]
-    if not repo:
+    repos = iter_user_repos(token, name, owner)
+    repo = next((r for r in repos if r["full_name"] == git_path), None)
+    repos.close()
+    if repo is None:
         return ["master"], "master"
-    repo_id = repo[0]["id"]
+    repo_id = repo["id"]
     return (
-        get_branches(token, repo_id),
+        get_all_branches(token, repo_id),
         get_default_branch(token, repo_id),
     )
 
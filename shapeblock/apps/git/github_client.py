@@ -0,0 +1,242 @@
+"""
+Pooled GitHub clients sharing a conditional response cache.
+
+The requests sessions of the clients built by `get_client` send GitHub API
+requests through one `CachingAdapter`, so they also share its kept alive
+connections. GET responses are kept in an LRU cache keyed by a hash of the
+token and the URL:
+
+- within `GITHUB_CACHE_TTL` seconds they are served without a request,
+- after that they are revalidated with `If-None-Match`, and a 304 answer, which
+  doesn't count against the rate limit, serves the cached body again.
+
+Wrap calls which must see the latest state, e.g. branch heads, in
+`always_revalidate()`.
+"""
+
+import contextlib
+import contextvars
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from github import Auth, Github
+from github.GithubRetry import GithubRetry
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# items per page of list endpoints
+PER_PAGE = 100
+
+_revalidate = contextvars.ContextVar("github_cache_revalidate", default=False)
+
+
+def token_hash(token: Optional[str]) -> str:
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()
+
+
+def _resource(url: str):
+    parts = urlsplit(url)
+    return parts.netloc, parts.path
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, response: requests.Response):
+        headers = dict(response.headers.lower_items())
+        entry = {
+            "expires": time.monotonic() + settings.GITHUB_CACHE_TTL,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "status": response.status_code,
+            "headers": headers,
+            "content": response.content,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.GITHUB_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        return entry
+
+    def refresh(self, entry):
+        entry["expires"] = time.monotonic() + settings.GITHUB_CACHE_TTL
+
+    def invalidate(self, url: str):
+        resource = _resource(url)
+        with self._lock:
+            for key in list(self._entries):
+                if _resource(key[1]) == resource:
+                    del self._entries[key]
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.revalidated = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _cached_response(request, entry, headers=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(headers or entry["headers"])
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.raw = io.BytesIO(entry["content"])
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter serving GET requests from `response_cache`, and
+    invalidating the URL of any other request.
+    """
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            # a write may change what the URL returns
+            response_cache.invalidate(request.url)
+            return super().send(request, **kwargs)
+
+        key = (token_hash(request.headers.get("Authorization")), request.url)
+        entry = response_cache.get(key)
+        if entry is not None and not _revalidate.get():
+            if time.monotonic() < entry["expires"]:
+                response_cache.count("hits")
+                return _cached_response(request, entry)
+        if entry is not None:
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            response_cache.count("revalidated")
+            response_cache.refresh(entry)
+            # fresh rate limit headers with the cached body
+            headers = {**entry["headers"], **dict(response.headers.lower_items())}
+            # read to the end, so the connection goes back to the pool
+            response.content
+            response.close()
+            return _cached_response(request, entry, headers)
+        response_cache.count("misses")
+        if response.status_code == 200:
+            response_cache.set(key, response)
+        return response
+
+    def close(self):
+        # shared by every pooled client, closed by `reset()`
+        pass
+
+
+_adapter = None
+
+
+def _session(client: Github) -> requests.Session:
+    # PyGithub has no public accessor for the requests session of a client, its
+    # requester keeps one connection (and session) for the client's lifetime
+    requester = client._Github__requester
+    return requester._Requester__createConnection().session
+
+
+@contextlib.contextmanager
+def always_revalidate():
+    """
+    Revalidate cached responses within the block, even when still fresh.
+    """
+    token = _revalidate.set(True)
+    try:
+        yield
+    finally:
+        _revalidate.reset(token)
+
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(token: Optional[str] = None) -> Github:
+    """
+    Return the pooled client for `token`, so its connections are reused.
+    """
+    global _adapter
+    key = token_hash(token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            retry = GithubRetry()
+            client = Github(
+                auth=Auth.Token(token) if token else None,
+                base_url=settings.GITHUB_API_URL,
+                per_page=PER_PAGE,
+                retry=retry,
+                # cache hits don't need spacing out, writes still are
+                seconds_between_requests=None,
+            )
+            if _adapter is None:
+                # connections kept alive for concurrent searches
+                pool_size = max(DEFAULT_POOLSIZE, settings.GITHUB_SEARCH_WORKERS)
+                _adapter = CachingAdapter(
+                    max_retries=retry,
+                    pool_connections=pool_size,
+                    pool_maxsize=pool_size,
+                )
+            _session(client).mount(settings.GITHUB_API_URL, _adapter)
+            _clients[key] = client
+            while len(_clients) > settings.GITHUB_CLIENT_POOL_SIZE:
+                _clients.popitem(last=False)[1].close()
+        _clients.move_to_end(key)
+    return client
+
+
+def reset():
+    global _adapter
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        if _adapter is not None:
+            HTTPAdapter.close(_adapter)
+            _adapter = None
+    response_cache.clear()
+
+
+def cache_stats() -> Dict:
+    return response_cache.stats()
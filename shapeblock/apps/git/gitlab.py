@@ -9,6 +9,9 @@ from shapeblock.utils.users import get_user_connected_accounts
 
 logger = logging.getLogger("django")
 
+# items per page of list endpoints
+PER_PAGE = 100
+
 
 def gitlab_handle(token):
     if token:
@@ -38,11 +41,15 @@ def get_default_branch(token, repo_id):
 
 
 # TODO: sort by time
-def get_branches(token, repo_id):
+def get_all_branches(token, repo_id):
+    """
+    Every branch name of the project, following the pages.
+    """
     gl = gitlab_handle(token)
     gl.auth()
     project = gl.projects.get(repo_id, lazy=True)
-    return [branch.name for branch in project.branches.list(all=True)]
+    branches = project.branches.list(iterator=True, per_page=PER_PAGE)
+    return [branch.name for branch in branches]
 
 
 def add_public_key(token, name, public_key):
@@ -86,7 +93,7 @@ def get_git_refs(user, git_path):
         return ["master"], "master"
     repo_id = repo[0]["id"]
     return (
-        get_branches(token, repo_id),
+        get_all_branches(token, repo_id),
         get_default_branch(token, repo_id),
     )
 
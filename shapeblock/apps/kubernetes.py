@@ -1,32 +1,36 @@
+import hashlib
+import json
 import logging
-import yaml
+from typing import Dict, Optional
 
-from kubernetes import client, config
+from kubernetes import client
 from kubernetes.client.rest import ApiException
 
-from django.template.loader import render_to_string
 from django.conf import settings
 
-from .models import (
-    App,
-    EnvVar,
-    Secret,
-    Volume,
-    BuildVar,
-    InitProcess,
-    WorkerProcess,
-    CustomDomain,
-)
+from .models import App
+from shapeblock.deployments.logs import append_log
 from shapeblock.deployments.models import Deployment
+from shapeblock.utils import watch_cache
+from shapeblock.utils.kubernetes import (
+    core_v1_api,
+    custom_objects_api,
+    get_api_client,
+)
+from .manifest import build_application, plain_key
+from .snapshot import AppSnapshot, load_app_snapshot
 from .mapper.validator import version_enum
 
 logger = logging.getLogger("django")
 
 
 def get_app_pod(app: App):
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
     namespace = app.project.name
+    informer = watch_cache.get_informer("pods")
+    if informer is not None:
+        pods = informer.by_app(namespace, str(app.uuid))
+        return pods[0]["metadata"]["name"] if pods else None
+    v1 = core_v1_api()
     label_selector = f"appUuid={str(app.uuid)}"
     pods = v1.list_namespaced_pod(namespace, label_selector=label_selector)
     if pods.items:
@@ -41,8 +45,7 @@ def create_app_secret(app: App):
         logger.debug("--- TEST RUN ---")
         return
     # TODO: handle unhappy paths
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
+    v1 = core_v1_api()
     namespace = app.project.name
     if not app.key_config:
         return
@@ -72,38 +75,32 @@ def create_app_secret(app: App):
         return
 
 
-def run_deploy_pipeline(deployment: Deployment):
-    logger.info("Creating deployment.")
-    config.load_incluster_config()
-    app = deployment.app
-    config.load_incluster_config()
-    # create secret if not already created
-    api = client.CustomObjectsApi()
+def get_sb_config(snapshot: AppSnapshot, deployment: Deployment) -> Dict:
     sb_config = {
-        "app_uuid": str(app.uuid),
+        "app_uuid": str(snapshot.uuid),
         "deployment_uuid": str(deployment.uuid),
         "deployment_type": deployment.type,
-        "name": app.name,
+        "name": snapshot.name,
         "cluster_domain": settings.CLUSTER_DOMAIN,
-        "namespace": app.project.name,
+        "namespace": snapshot.namespace,
         # TODO: should this change on a per deployment basis?
         "chart_version": settings.CHART_VERSION,
-        "replicas": app.replicas,
-        "type": app.stack,
-        "env_vars": EnvVar.objects.filter(app=app),
-        "secrets": Secret.objects.filter(app=app),
-        "volumes": Volume.objects.filter(app=app),
-        "build_vars": BuildVar.objects.filter(app=app),
-        "init_processes": InitProcess.objects.filter(app=app),
-        "custom_domains": CustomDomain.objects.filter(app=app),
-        "workers": WorkerProcess.objects.filter(app=app),
-        "has_liveness_probe": app.has_liveness_probe,
+        "replicas": snapshot.replicas,
+        "type": snapshot.stack,
+        "env_vars": snapshot.env_vars,
+        "secrets": snapshot.secrets,
+        "volumes": snapshot.volumes,
+        "build_vars": snapshot.build_vars,
+        "init_processes": snapshot.init_processes,
+        "custom_domains": snapshot.custom_domains,
+        "workers": snapshot.workers,
+        "has_liveness_probe": snapshot.has_liveness_probe,
     }
     if deployment.type == "code":
         sb_config["git"] = {
-            "url": app.repo,
+            "url": snapshot.repo,
             "revision": deployment.ref,
-            "sub_path": app.sub_path,
+            "sub_path": snapshot.sub_path,
         }
 
     # TODO: derive other parameters from deployment. envs, docroot,
@@ -112,37 +109,279 @@ def run_deploy_pipeline(deployment: Deployment):
         if stack != "nginx":
             # get latest version if not already there
             sb_config["version"] = version_enum[stack][-1]
-    deploy_app = render_to_string(f"app.yaml", sb_config)
-    payload = yaml.load(deploy_app, Loader=yaml.FullLoader)
+    return sb_config
+
+
+APPLICATION_GROUP = "dev.shapeblock.com"
+APPLICATION_VERSION = "v1alpha1"
+APPLICATION_PLURAL = "applications"
+MANIFEST_HASH_ANNOTATION = "shapeblock.com/manifest-hash"
+FIELD_MANAGER = "shapeblock"
+
+
+def _without(value, excluded):
+    if isinstance(value, dict):
+        return {key: _without(item, excluded) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_without(item, excluded) for item in value]
+    return "" if value == excluded else value
+
+
+def manifest_hash(payload: Dict, deployment_uuid: str) -> str:
+    """
+    Hash of the Application's spec, leaving out the deployment's uuid, which
+    is different on every deployment.
+    """
+    spec = _without(payload["spec"], deployment_uuid)
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_application(namespace: str, name: str) -> Optional[Dict]:
+    """
+    The app's Application, from the watch cache when it is in sync. None if
+    there is none.
+    """
+    informer = watch_cache.get_informer("applications")
+    if informer is not None:
+        return informer.get(namespace, name)
+    try:
+        return custom_objects_api().get_namespaced_custom_object(
+            APPLICATION_GROUP,
+            APPLICATION_VERSION,
+            namespace,
+            APPLICATION_PLURAL,
+            name,
+        )
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+def is_unchanged(current: Optional[Dict], digest: str) -> bool:
+    """
+    Whether `current` already has the manifest hashed to `digest`, from a
+    deployment which succeeded. A failed or unfinished one is deployed again.
+    """
+    if current is None:
+        return False
+    metadata = current["metadata"]
+    if (metadata.get("annotations") or {}).get(MANIFEST_HASH_ANNOTATION) != digest:
+        return False
+    deployment_uuid = (metadata.get("labels") or {}).get(
+        "shapeblock.com/deployment-uuid"
+    )
+    return Deployment.objects.filter(uuid=deployment_uuid, status="success").exists()
+
+
+def apply_application(payload: Dict) -> Dict:
+    """
+    Server-side apply of the Application, the API server works out what changed.
+    """
+    metadata = payload["metadata"]
+    return get_api_client().call_api(
+        "/apis/{group}/{version}/namespaces/{namespace}/{plural}/{name}",
+        "PATCH",
+        path_params={
+            "group": APPLICATION_GROUP,
+            "version": APPLICATION_VERSION,
+            "namespace": metadata["namespace"],
+            "plural": APPLICATION_PLURAL,
+            "name": metadata["name"],
+        },
+        query_params=[("fieldManager", FIELD_MANAGER), ("force", "true")],
+        header_params={
+            "Accept": "application/json",
+            "Content-Type": "application/apply-patch+yaml",
+        },
+        body=payload,
+        auth_settings=["BearerToken"],
+        response_type="object",
+        _return_http_data_only=True,
+    )
+
+
+def run_deploy_pipeline(deployment: Deployment) -> Optional[Dict]:
+    """
+    Create or update the app's Application. Returns None, without writing
+    anything, when it already has the same manifest.
+    """
+    logger.info("Creating deployment.")
+    app = load_app_snapshot(deployment.app_id)
+    # create secret if not already created
+    api = custom_objects_api()
+    sb_config = get_sb_config(app, deployment)
+    payload = build_application(sb_config)
+    digest = manifest_hash(payload, str(deployment.uuid))
+    payload["metadata"]["annotations"] = {MANIFEST_HASH_ANNOTATION: digest}
     logger.debug(payload)
+
+    current = get_application(app.namespace, app.name)
+    if is_unchanged(current, digest):
+        logger.info(f"Application {app.name} is unchanged, not updating it.")
+        return None
+    if settings.KUBE_SERVER_SIDE_APPLY:
+        response = apply_application(payload)
+    elif current is None:
+        response = create_application(api, app.namespace, payload)
+    else:
+        response = patch_application(api, app.namespace, app.name, payload)
+    logger.debug(response)
+    logger.info("Deployment created.")
+    return response
+
+
+def create_application(api, namespace: str, payload: Dict) -> Dict:
     try:
-        response = api.patch_namespaced_custom_object(
-            group="dev.shapeblock.com",
-            version="v1alpha1",
-            namespace=app.project.name,
-            plural="applications",
-            name=app.name,
+        return api.create_namespaced_custom_object(
+            group=APPLICATION_GROUP,
+            version=APPLICATION_VERSION,
+            namespace=namespace,
+            plural=APPLICATION_PLURAL,
             body=payload,
         )
     except ApiException as e:
-        # first deployment
-        # TODO: handle exception, 401
-        response = api.create_namespaced_custom_object(
-            group="dev.shapeblock.com",
-            version="v1alpha1",
-            namespace=app.project.name,
-            plural="applications",
+        if e.status != 409:
+            raise
+        # created since the lookup
+        return patch_application(api, namespace, payload["metadata"]["name"], payload)
+
+
+def patch_application(api, namespace: str, name: str, payload: Dict) -> Dict:
+    try:
+        return api.patch_namespaced_custom_object(
+            group=APPLICATION_GROUP,
+            version=APPLICATION_VERSION,
+            namespace=namespace,
+            plural=APPLICATION_PLURAL,
+            name=name,
             body=payload,
         )
-    logger.debug(response)
-    logger.info("Deployment created.")
-    return response
+    except ApiException as e:
+        if e.status != 404:
+            raise
+        # deleted since the lookup
+        return api.create_namespaced_custom_object(
+            group=APPLICATION_GROUP,
+            version=APPLICATION_VERSION,
+            namespace=namespace,
+            plural=APPLICATION_PLURAL,
+            body=payload,
+        )
+
+
+def _only(values: Dict, stack_key, field: str) -> Dict:
+    return {
+        "deployments": {stack_key: {field: values["deployments"][stack_key][field]}}
+    }
+
+
+def _containers(values: Dict, current: Dict, stack_key) -> Optional[Dict]:
+    """
+    The deployed containers with only their liveness probe changed, so config
+    changes which haven't been deployed yet aren't sent along.
+    """
+    deployment = (current.get("deployments") or {}).get(stack_key) or {}
+    if not deployment.get("containers"):
+        return None
+    rendered = {
+        container["name"]: container
+        for container in values["deployments"][stack_key]["containers"]
+    }
+    containers = []
+    for container in deployment["containers"]:
+        container = dict(container)
+        probe = rendered.get(container.get("name"), {}).get("livenessProbe")
+        if probe:
+            container["livenessProbe"] = probe
+        else:
+            container.pop("livenessProbe", None)
+        containers.append(container)
+    # a list, which a merge patch replaces as a whole
+    return {"deployments": {stack_key: {"containers": containers}}}
+
+
+def _replicas(values: Dict, current: Dict, stack_key) -> Dict:
+    return _only(values, stack_key, "replicas")
+
+
+def _ingresses(values: Dict, current: Dict, stack_key) -> Dict:
+    ingresses = dict(values["ingresses"])
+    # a merge patch removes keys set to null
+    for name in current.get("ingresses") or {}:
+        ingresses.setdefault(name, None)
+    return {"ingresses": ingresses}
+
+
+# the chart values each change touches, from the rendered and current values
+PATCHES = {
+    "scale": _replicas,
+    "liveness_probe": _containers,
+    "custom_domains": _ingresses,
+}
+
+
+def patch_app(app: App, user, change: str, params: Dict) -> Optional[Deployment]:
+    """
+    Apply `change`, one of `PATCHES`, to the app's Application with a merge
+    patch of only the values it touches, instead of queueing a deployment.
+    It is recorded as a finished "patch" deployment with `params`.
+
+    Returns None if there is no Application to patch, the change can't be
+    applied to its values or the patch failed, and a full deployment is needed.
+    """
+    snapshot = load_app_snapshot(app.pk)
+    current = get_application(snapshot.namespace, snapshot.name)
+    if current is None:
+        return None
+    deployment = Deployment(
+        user=user,
+        app=app,
+        type="patch",
+        status="success",
+        params=params,
+        config_hash=app.config_hash,
+    )
+    payload = build_application(get_sb_config(snapshot, deployment))
+    values = payload["spec"]["chart"]["values"]["universal-chart"]
+    current_values = (
+        ((current.get("spec") or {}).get("chart") or {}).get("values") or {}
+    ).get("universal-chart") or {}
+    changed = PATCHES[change](values, current_values, plain_key(snapshot.stack))
+    if changed is None:
+        logger.info(f"Unable to patch {change} of app {app.name} in place.")
+        return None
+    body = {
+        # the Application doesn't match a rendered manifest anymore, the next
+        # deployment is sent in full
+        "metadata": {"annotations": {MANIFEST_HASH_ANNOTATION: None}},
+        "spec": {"chart": {"values": {"universal-chart": changed}}},
+    }
+    logger.debug(body)
+    try:
+        custom_objects_api().patch_namespaced_custom_object(
+            group=APPLICATION_GROUP,
+            version=APPLICATION_VERSION,
+            namespace=snapshot.namespace,
+            plural=APPLICATION_PLURAL,
+            name=snapshot.name,
+            body=body,
+        )
+    except ApiException as e:
+        logger.warning(f"Unable to patch {change} of app {app.name}: {e.reason}")
+        return None
+    deployment.save()
+    append_log(
+        deployment, f"Patched {change.replace('_', ' ')}: {json.dumps(params)}\n"
+    )
+    logger.info(f"Patched {change} of app {app.name}.")
+    return deployment
 
 
 def delete_app_task(app: App):
     logger.info("Deleting app.")
-    config.load_incluster_config()
-    api = client.CustomObjectsApi()
+    api = custom_objects_api()
     try:
         response = api.delete_namespaced_custom_object(
             group="dev.shapeblock.com",
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shapeblock.apps.config_hash import refresh_config_hash
+from shapeblock.apps.models import App
+
+
+class Command(BaseCommand):
+    help = "Recompute the config hash of every app and fix the stale ones"
+
+    def handle(self, *args, **options):
+        checked = fixed = 0
+        for pk in App.objects.values_list("pk", flat=True).iterator():
+            checked += 1
+            if refresh_config_hash(pk):
+                fixed += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} apps, fixed {fixed} config hashes.")
+        )
@@ -0,0 +1,386 @@
+"""
+Builds the `Application` custom resource for an app directly as a dict.
+
+The output is identical to rendering `templates/app.yaml` and loading the result
+with PyYAML, including the template's quirks: values are HTML escaped by the
+template engine, and unquoted values are typed the way YAML types plain scalars.
+"""
+
+import copy
+import html
+import re
+from functools import lru_cache
+from typing import Dict
+
+import yaml
+
+_resolver = yaml.resolver.Resolver()
+
+_STR_TAG = "tag:yaml.org,2002:str"
+
+# plain scalars which can be inlined into a block mapping as is
+_SIMPLE_PLAIN = re.compile(r"[A-Za-z0-9_./][A-Za-z0-9_./@:+-]*(?<!:)")
+
+
+def _text(value) -> str:
+    # what `{{ value }}` renders to, Django escapes with `html.escape`
+    return html.escape(str(value))
+
+
+def _lookup(obj, name):
+    # missing variables render as an empty string in templates
+    if isinstance(obj, dict):
+        return obj.get(name, "")
+    return getattr(obj, name, "")
+
+
+@lru_cache(maxsize=4096)
+def _plain(text: str):
+    """
+    Value of `text` when written unquoted as a mapping value or sequence item.
+    """
+    if _SIMPLE_PLAIN.fullmatch(text):
+        tag = _resolver.resolve(yaml.ScalarNode, text, (True, False))
+        if tag == _STR_TAG:
+            return text
+        return yaml.load(text, Loader=yaml.FullLoader)
+    return yaml.load(f"_: {text}", Loader=yaml.FullLoader)["_"]
+
+
+@lru_cache(maxsize=4096)
+def _plain_key(text: str):
+    """
+    Value of `text` when written unquoted as a mapping key.
+    """
+    if _SIMPLE_PLAIN.fullmatch(text):
+        return _plain(text)
+    (key,) = yaml.load(f"{text}: _", Loader=yaml.FullLoader).keys()
+    return key
+
+
+def _quoted(text: str) -> str:
+    """
+    Value of `text` when written between double quotes.
+    """
+    if "\\" in text or not text.isprintable():
+        try:
+            return yaml.load(f'"{text}"', Loader=yaml.FullLoader)
+        except yaml.YAMLError:
+            # e.g. a trailing backslash, which broke out of the quotes in the
+            # template and corrupted the rest of the manifest
+            return text
+    return text
+
+
+def plain(value):
+    value = _plain(_text(value))
+    # flow collections come back from the shared cache, don't hand them out
+    return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+
+def plain_key(value):
+    return _plain_key(_text(value))
+
+
+def quoted(value):
+    return _quoted(_text(value))
+
+
+@lru_cache(maxsize=16)
+def _chart_invariants(chart_version) -> Dict:
+    """
+    Parts of the manifest which only depend on the chart version.
+    """
+    ingress_defaults = {
+        "ingressClassName": "nginx",
+        "annotations": {
+            "nginx.ingress.kubernetes.io/proxy-body-size": "50m",
+            "nginx.ingress.kubernetes.io/ssl-redirect": "true",
+        },
+        "certManager": {
+            "issuerType": "cluster-issuer",
+            "issuerName": "letsencrypt-prod",
+        },
+    }
+    return {
+        "chart": {
+            "repo": "https://shapeblock.github.io",
+            "name": "shapeblock",
+            "version": quoted(chart_version),
+        },
+        "generic": {
+            "usePredefinedAffinity": False,
+            "extraImagePullSecrets": [{"name": "registry-creds"}],
+        },
+        "requests": {"cpu": "5m", "memory": "128M"},
+        "ingress": ingress_defaults,
+    }
+
+
+def _invariant(chart_version, name):
+    return copy.deepcopy(_chart_invariants(chart_version)[name])
+
+
+def _ingress(chart_version, name, service_name):
+    defaults = _invariant(chart_version, "ingress")
+    return {
+        "name": name,
+        "ingressClassName": defaults["ingressClassName"],
+        "annotations": defaults["annotations"],
+        "certManager": defaults["certManager"],
+        "hosts": [{"paths": [{"serviceName": service_name, "servicePort": 8080}]}],
+    }
+
+
+def build_application(sb_config: Dict) -> Dict:
+    """
+    Build the Application custom resource from the same context the `app.yaml`
+    template is rendered with.
+    """
+    chart_version = _lookup(sb_config, "chart_version")
+    name_text = _text(_lookup(sb_config, "name"))
+    namespace_text = _text(_lookup(sb_config, "namespace"))
+    domain_text = _text(_lookup(sb_config, "cluster_domain"))
+    app_uuid = plain(_lookup(sb_config, "app_uuid"))
+    deployment_uuid = plain(_lookup(sb_config, "deployment_uuid"))
+    stack = plain(_lookup(sb_config, "type"))
+    stack_key = plain_key(_lookup(sb_config, "type"))
+    release = _plain(name_text)
+    image = _plain(f"registry.{domain_text}/{namespace_text}/{name_text}")
+
+    # every collection is iterated exactly once
+    env_vars = list(_lookup(sb_config, "env_vars") or [])
+    secrets = list(_lookup(sb_config, "secrets") or [])
+    volumes = list(_lookup(sb_config, "volumes") or [])
+    build_vars = list(_lookup(sb_config, "build_vars") or [])
+    init_processes = list(_lookup(sb_config, "init_processes") or [])
+    custom_domains = list(_lookup(sb_config, "custom_domains") or [])
+    workers = list(_lookup(sb_config, "workers") or [])
+    resources = _lookup(sb_config, "resources") or {}
+
+    def requests():
+        return _invariant(chart_version, "requests")
+
+    def volume_mounts():
+        return [
+            {
+                "name": plain(_lookup(volume, "name")),
+                "mountPath": plain(_lookup(volume, "mount_path")),
+            }
+            for volume in volumes
+        ]
+
+    def pvc_volumes():
+        return [
+            {"name": plain(_lookup(volume, "name")), "type": "pvc"}
+            for volume in volumes
+        ]
+
+    def process_container(process):
+        container = {"name": plain(_lookup(process, "key"))}
+        if secrets:
+            container["envSecrets"] = ["secret-envs"]
+        container["envConfigmaps"] = ["envs"]
+        container["command"] = [quoted(_lookup(process, "key"))]
+        if volumes:
+            container["volumeMounts"] = volume_mounts()
+        container["resources"] = {
+            "limits": {
+                "cpu": quoted(_lookup(process, "cpu")),
+                "memory": quoted(_lookup(process, "memory")),
+            },
+            "requests": requests(),
+        }
+        return container
+
+    git = _lookup(sb_config, "git") or {}
+    git_spec = {
+        "repo": plain(_lookup(git, "url")),
+        "ref": quoted(_lookup(git, "revision")),
+    }
+    if _lookup(git, "sub_path"):
+        git_spec["subPath"] = quoted(_lookup(git, "sub_path"))
+
+    chart = _invariant(chart_version, "chart")
+    chart["build"] = [
+        {
+            "name": quoted(_lookup(build_var, "key")),
+            "value": quoted(_lookup(build_var, "value")),
+        }
+        for build_var in build_vars
+    ] or None
+
+    values = {
+        "enabled": True,
+        "releasePrefix": _quoted(name_text),
+        "envs": {"PORT": 8080},
+    }
+    for env_var in env_vars:
+        values["envs"][plain_key(_lookup(env_var, "key"))] = quoted(
+            _lookup(env_var, "value")
+        )
+    if secrets:
+        values["secretEnvs"] = {
+            plain_key(_lookup(secret, "key")): quoted(_lookup(secret, "value"))
+            for secret in secrets
+        }
+    generic = _invariant(chart_version, "generic")
+    values["generic"] = {
+        "labels": {
+            "app": stack,
+            "release": release,
+            "appUuid": app_uuid,
+            "deployUuid": deployment_uuid,
+        },
+        **generic,
+    }
+    values["defaultImage"] = image
+    values["defaultImageTag"] = "AUTO"
+
+    deployment = {
+        "podLabels": {
+            "app": stack,
+            "release": release,
+            "appUuid": app_uuid,
+            "deployment": stack,
+            "deployUuid": deployment_uuid,
+        },
+        "replicas": plain(_lookup(sb_config, "replicas")),
+    }
+    if init_processes:
+        deployment["initContainers"] = [
+            process_container(process) for process in init_processes
+        ]
+    container = {"name": stack}
+    if secrets:
+        container["envSecrets"] = ["secret-envs"]
+    container["envConfigmaps"] = ["envs"]
+    if volumes:
+        container["volumeMounts"] = volume_mounts()
+    container["ports"] = [{"containerPort": 8080, "name": "app"}]
+    container["resources"] = {
+        "limits": {
+            "cpu": quoted(_lookup(resources, "cpu") or "1"),
+            "memory": quoted(_lookup(resources, "memory") or "2Gi"),
+        },
+        "requests": requests(),
+    }
+    if _lookup(sb_config, "has_liveness_probe"):
+        container["livenessProbe"] = {"tcpSocket": {"port": 8080}}
+    deployment["containers"] = [container]
+    if volumes:
+        deployment["volumes"] = pvc_volumes()
+    deployments = {stack_key: deployment}
+
+    for worker in workers:
+        worker_deployment = {
+            "podLabels": {
+                "app": stack,
+                "release": release,
+                "appUuid": app_uuid,
+                "deployUuid": deployment_uuid,
+                # the template refers to an undefined `worker_key`
+                "worker": plain(_lookup(sb_config, "worker_key")),
+            },
+            "replicas": 1,
+            "containers": [process_container(worker)],
+        }
+        if volumes:
+            worker_deployment["volumes"] = pvc_volumes()
+        deployments[plain_key(_lookup(worker, "key"))] = worker_deployment
+    values["deployments"] = deployments
+
+    values["services"] = {
+        stack_key: {
+            "type": "NodePort",
+            "ports": [{"port": 8080}],
+            "extraSelectorLabels": {
+                "app": stack,
+                "release": release,
+                "appUuid": app_uuid,
+                "deployment": stack,
+            },
+        }
+    }
+
+    ingresses = {
+        _plain_key(f"{namespace_text}-{name_text}.{domain_text}"): _ingress(
+            chart_version, _plain(namespace_text), stack
+        )
+    }
+    for custom_domain in custom_domains:
+        domain = _lookup(custom_domain, "domain")
+        ingresses[plain_key(domain)] = _ingress(chart_version, plain(domain), stack)
+    values["ingresses"] = ingresses
+
+    if volumes:
+        values["pvcs"] = {
+            plain_key(_lookup(volume, "name")): {
+                "storageClassName": "nfs",
+                "accessModes": ["ReadWriteMany"],
+                "size": plain(_lookup(volume, "size")),
+            }
+            for volume in volumes
+        }
+    if _lookup(sb_config, "post_deploy"):
+        values["hooks"] = _post_release_hook(sb_config, volumes, requests())
+
+    chart["values"] = {"universal-chart": values}
+
+    return {
+        "apiVersion": "dev.shapeblock.com/v1alpha1",
+        "kind": "Application",
+        "metadata": {
+            "name": release,
+            "namespace": _plain(namespace_text),
+            "labels": {
+                "shapeblock.com/app-uuid": app_uuid,
+                "shapeblock.com/deployment-uuid": deployment_uuid,
+                "shapeblock.com/deployment-type": plain(
+                    _lookup(sb_config, "deployment_type")
+                ),
+            },
+        },
+        "spec": {
+            "stack": stack,
+            "tag": image,
+            "git": git_spec,
+            "chart": chart,
+        },
+    }
+
+
+def _post_release_hook(sb_config, volumes, requests):
+    container = {
+        "name": "post-release",
+        "envSecrets": ["secret-envs"],
+        "envConfigmaps": ["envs"],
+    }
+    mounts = _lookup(sb_config, "mounts") or {}
+    if mounts:
+        container["volumeMounts"] = [
+            {"name": plain(key), "mountPath": plain(_lookup(mount, "mountPath"))}
+            for key, mount in mounts.items()
+        ]
+    container["ports"] = [{"containerPort": 8080, "name": "app"}]
+    container["resources"] = {
+        "limits": {"cpu": "1000m", "memory": "256M"},
+        "requests": requests,
+    }
+    container["command"] = ["launcher", "/bin/bash", "-c"]
+    container["args"] = [
+        "if [ -f /workspace/post-deploy.sh ]; then ./post-deploy.sh; "
+        'else echo "No post-deploy.sh script found."; fi'
+    ]
+    hook = {
+        "kind": "post-install,post-upgrade",
+        "backoffLimit": 0,
+        "weight": "-5",
+        "containers": [container],
+    }
+    if volumes:
+        hook["volumes"] = [
+            {"name": plain(_lookup(volume, "name")), "type": "pvc"}
+            for volume in volumes
+        ]
+    return {"post-release": hook}
@@ -1,5 +1,16 @@
+import os
+import tempfile
+import time
 import unittest
-from apps.mapper.validator import validate_yaml
+from pathlib import Path
+
+from jsonschema.validators import Draft202012Validator
+
+from shapeblock.apps.mapper import validator
+from shapeblock.apps.mapper.validator import validate_many, validate_yaml
+
+VALID = "name: 'test-123'\ntype: 'php'\nversion: '8.1'\n"
+INVALID = "name: 'test-123'\ntype: 'php'\nversion: '9.0'\nsecrets: 1\n"
 
 
 class TestYAMLValidation(unittest.TestCase):
@@ -16,7 +27,7 @@ class TestYAMLValidation(unittest.TestCase):
 
     def test_invalid_yaml(self):
         yaml_string = """
-        invalid_yaml: true
+        - name: 'test-123'
         """
         validated_data, validation_errors = validate_yaml(yaml_string)
         self.assertIsNone(validated_data)
@@ -33,7 +44,105 @@ class TestYAMLValidation(unittest.TestCase):
         self.assertIsNone(validated_data)
         self.assertIsNotNone(validation_errors)
 
-    # Add more test cases as needed...
+    def test_versions_match_exactly(self):
+        for version in ("8", "8.", "0, 8", "8.11"):
+            _, errors = validate_yaml(f"name: a\ntype: php\nversion: '{version}'")
+            self.assertTrue(errors, version)
+        for stack, version in (("python", "'3.10'"), ("go", "'1.20'"), ("node", 18)):
+            data, errors = validate_yaml(f"name: a\ntype: {stack}\nversion: {version}")
+            self.assertIsNone(errors, version)
+
+    def test_unquoted_versions(self):
+        for stack, version, expected in (
+            ("python", "3.10", "3.10"),
+            ("go", "1.20", "1.20"),
+            ("ruby", "3.1", "3.1"),
+            ("node", "18", "18"),
+            ("php", "8.0", "8.0"),
+        ):
+            data, errors = validate_yaml(f"name: a\ntype: {stack}\nversion: {version}")
+            self.assertIsNone(errors, version)
+            self.assertEqual(data["version"], expected)
+        _, errors = validate_yaml("name: a\ntype: python\nversion: 3.12")
+        self.assertTrue(errors)
+
+    def test_unquoted_version_is_taken_as_written(self):
+        # 3.1 has the value of 3.10, but isn't a supported python version
+        _, errors = validate_yaml("name: a\ntype: python\nversion: 3.1")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Quote the version, e.g. version: '3.11'", errors[0])
+        _, errors = validate_yaml("name: a\ntype: go\nversion: 1.2")
+        self.assertTrue(errors)
+        # parsed elsewhere, a number is taken by its value
+        self.assertTrue(validator.validate_data({"type": "python", "version": 3.10}))
+        self.assertEqual(validator.validate_data({"type": "ruby", "version": 3.1}), [])
+
+    def test_name_and_type_are_optional(self):
+        data, errors = validate_yaml("env_vars:\n  DEBUG: '1'\n")
+        self.assertIsNone(errors)
+        self.assertEqual(data, {"env_vars": {"DEBUG": "1"}})
+
+    def test_all_errors(self):
+        _, errors = validate_yaml("secrets: 1\nresources: []")
+        self.assertEqual(len(errors), 2)
+        _, errors = validate_yaml("name: [")
+        self.assertTrue(errors[0].startswith("YAML parsing error"))
+        _, errors = validate_yaml("")
+        self.assertEqual(errors, ["None is not of type 'object'"])
+
+    def test_validate_many(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(40):
+                path = Path(directory, f"app-{i}", ".sb.yml")
+                path.parent.mkdir()
+                path.write_text(INVALID if i % 10 == 0 else VALID)
+            Path(directory, "README.md").write_text("not sb.yml")
+            results = validate_many(directory, max_workers=2)
+            self.assertEqual(len(results), 40)
+            invalid = sorted(
+                Path(path).parent.name
+                for path, (data, errors) in results.items()
+                if errors
+            )
+            self.assertEqual(invalid, ["app-0", "app-10", "app-20", "app-30"])
+            # the same results without a pool
+            self.assertEqual(validate_many(list(results), max_workers=1), results)
+
+
+@unittest.skipUnless(os.environ.get("SB_BENCHMARK"), "set SB_BENCHMARK=1 to run")
+class ValidationBenchmark(unittest.TestCase):
+    documents = 2000
+
+    def test_validate_yaml(self):
+        import yaml
+
+        data = [yaml.safe_load(VALID if i % 2 else INVALID) for i in range(500)]
+        start = time.perf_counter()
+        for document in data:
+            list(Draft202012Validator(validator.schema).iter_errors(document))
+        rebuilt = time.perf_counter() - start
+        start = time.perf_counter()
+        for document in data:
+            validator.validate_data(document)
+        compiled = time.perf_counter() - start
+        print(
+            f"\n{len(data)} documents: {rebuilt * 1000:.0f}ms with a validator per "
+            f"call, {compiled * 1000:.0f}ms with the compiled one"
+        )
+
+    def test_validate_many(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(self.documents):
+                Path(directory, f"{i}.yml").write_text(VALID if i % 2 else INVALID)
+            for workers in (1, os.cpu_count()):
+                start = time.perf_counter()
+                results = validate_many(directory, max_workers=workers)
+                elapsed = time.perf_counter() - start
+                self.assertEqual(len(results), self.documents)
+                print(
+                    f"\n{self.documents} files, {workers} workers: "
+                    f"{elapsed * 1000:.0f}ms"
+                )
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 import os
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import yaml
-from jsonschema.validators import exceptions, Draft202012Validator
+from jsonschema.validators import Draft202012Validator
 
 from django.template.loader import render_to_string
 
@@ -10,34 +12,118 @@ schema_yaml = os.path.join(os.path.dirname(__file__), "schema.yaml")
 
 schema = yaml.safe_load(open(schema_yaml).read())
 
+# compiled once, validators are stateless and can be shared
+validator = Draft202012Validator(schema)
+
 versions_yaml = os.path.join(os.path.dirname(__file__), "versions.yaml")
 
 version_enum = yaml.safe_load(open(versions_yaml).read())
 
-
-def validate_yaml(yaml_str):
-    validation_errors = []
+supported_versions = {
+    stack: frozenset(str(version) for version in versions)
+    for stack, versions in version_enum.items()
+}
+
+# below this many files the pool costs more than it saves
+POOL_MIN_FILES = 32
+
+
+class SbYmlLoader(yaml.SafeLoader):
+    """
+    Keeps the text of an unquoted top level `version`, as YAML reads 3.10 as
+    the number 3.1.
+    """
+
+    version_text = None
+
+    def construct_document(self, node):
+        if isinstance(node, yaml.MappingNode):
+            for key, value in node.value:
+                if (
+                    key.value == "version"
+                    and isinstance(value, yaml.ScalarNode)
+                    and not value.style
+                ):
+                    self.version_text = value.value
+        return super().construct_document(node)
+
+
+def normalize_version(stack: str, version, text: Optional[str] = None) -> str:
+    """
+    `version` as a string. A number is taken as written (`text`) when known,
+    and by its value otherwise, so 3.1 is never turned into a supported 3.10.
+    """
+    if isinstance(version, (int, float)) and not isinstance(version, bool):
+        return text or str(version)
+    return str(version)
+
+
+def validate_data(yaml_data, version_text: Optional[str] = None) -> List[str]:
+    """
+    All the problems with a parsed sb.yml, in one pass. A numeric version is
+    replaced with its string, `version_text` when it was read from YAML.
+    """
+    errors = [error.message for error in validator.iter_errors(yaml_data)]
+    if errors:
+        return errors
+    stack = yaml_data.get("type")
+    if stack in supported_versions and "version" in yaml_data:
+        version = yaml_data["version"]
+        yaml_data["version"] = normalize_version(stack, version, version_text)
+        if yaml_data["version"] not in supported_versions[stack]:
+            error = (
+                f"Invalid version for {stack}. Only the following versions are "
+                f"supported: {', '.join(version_enum[stack])}"
+            )
+            if not isinstance(version, str):
+                error += (
+                    f". Quote the version, e.g. version: '{version_enum[stack][-1]}'"
+                )
+            errors.append(error)
+    return errors
+
+
+def validate_yaml(yaml_str) -> Tuple[Optional[Dict], Optional[List[str]]]:
+    loader = SbYmlLoader(yaml_str)
     try:
-        yaml_data = yaml.safe_load(yaml_str)
-        validator = Draft202012Validator(schema)
-        validator.validate(yaml_data)
-        if (
-            "type" in yaml_data
-            and "version" in yaml_data
-            and yaml_data["type"] in version_enum.keys()
-        ):
-            if yaml_data["version"] not in str(version_enum[yaml_data["type"]]):
-                version_mismatch_error = f"Invalid version for {yaml_data['type']}. Only the following versions are supported: {version_enum[yaml_data['type']]}"
-                validation_errors.append(version_mismatch_error)
-                raise exceptions.ValidationError(version_mismatch_error)
-
-        return yaml_data, None
-    except exceptions.ValidationError as e:
-        for error in validator.iter_errors(yaml_data):
-            validation_errors.append(error.message)
-        return None, validation_errors
+        yaml_data = loader.get_single_data()
     except yaml.YAMLError as e:
         return None, ["YAML parsing error: " + str(e)]
+    finally:
+        loader.dispose()
+    validation_errors = validate_data(yaml_data, loader.version_text)
+    if validation_errors:
+        return None, validation_errors
+    return yaml_data, None
+
+
+def validate_file(path: Union[str, Path]):
+    return validate_yaml(Path(path).read_text())
+
+
+def validate_many(
+    paths: Union[str, Path, Iterable[Union[str, Path]]],
+    max_workers: Optional[int] = None,
+) -> Dict[str, Tuple[Optional[Dict], Optional[List[str]]]]:
+    """
+    Validate many sb.yml files, or every `.yml`/`.yaml` file under a directory,
+    across a process pool. Returns the result of `validate_yaml` per path.
+    """
+    if isinstance(paths, (str, Path)) and Path(paths).is_dir():
+        paths = sorted(
+            path
+            for path in Path(paths).rglob("*")
+            if path.suffix in (".yml", ".yaml") and path.is_file()
+        )
+    paths = [str(path) for path in paths]
+    max_workers = max_workers or os.cpu_count() or 1
+    if len(paths) < POOL_MIN_FILES or max_workers == 1:
+        return {path: validate_file(path) for path in paths}
+    # a few chunks per worker keeps them busy without a round trip per file
+    chunksize = max(1, len(paths) // (4 * max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(validate_file, paths, chunksize=chunksize)
+        return dict(zip(paths, results))
 
 
 def generate_helm_values(sb_yml: Dict) -> str:
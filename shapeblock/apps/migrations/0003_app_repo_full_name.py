@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:50
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+GIT_REGEX = r"^(?P<protocol>https|git)(:\/\/|@)(?P<domain>[^\/:]+)[\/:](?P<org>[^\/:]+)\/(?P<repo>.+?)(.git)*$"
+
+
+def fill_repo_full_name(apps, schema_editor):
+    App = apps.get_model("apps", "App")
+    for app in App.objects.only("pk", "repo").iterator(chunk_size=100):
+        match = re.match(GIT_REGEX, app.repo)
+        if match:
+            full_name = f"{match['org']}/{match['repo']}".lower()
+            App.objects.filter(pk=app.pk).update(repo_full_name=full_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0002_initial"),
+        ("projects", "0002_alter_project_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="app",
+            name="repo_full_name",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=256
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="app",
+            index=models.Index(
+                fields=["repo_full_name", "ref"], name="apps_app_repo_fu_665792_idx"
+            ),
+        ),
+        migrations.RunPython(fill_repo_full_name, migrations.RunPython.noop),
+    ]
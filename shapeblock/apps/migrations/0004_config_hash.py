@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:53
+
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def config_hash(config):
+    # frozen copy of `shapeblock.apps.config_hash.config_hash`
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hmac.new(
+        settings.SECRET_KEY.encode("utf-8"),
+        canonical.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def fill_config_hash(apps, schema_editor):
+    App = apps.get_model("apps", "App")
+    for app in App.objects.only("pk").iterator(chunk_size=100):
+        volumes = app.volumes.values_list("name", "mount_path", "size")
+        config = {
+            "env_vars": dict(app.env_vars.values_list("key", "value")),
+            "secrets": dict(app.secrets.values_list("key", "value")),
+            "build_vars": dict(app.build_vars.values_list("key", "value")),
+            "volumes": [
+                {"name": name, "mount_path": mount_path, "size": size}
+                for name, mount_path, size in sorted(volumes)
+            ],
+        }
+        App.objects.filter(pk=app.pk).update(config_hash=config_hash(config))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0003_app_repo_full_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="app",
+            name="config_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.RunPython(fill_config_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_names(apps, schema_editor):
+    App = apps.get_model("apps", "App")
+    duplicates = (
+        App.objects.values("project_id", "name")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+    )
+    if duplicates:
+        names = ", ".join(
+            f"{row['name']} (project {row['project_id']})" for row in duplicates
+        )
+        raise RuntimeError(
+            f"Rename or delete apps with duplicate names before migrating: {names}."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0004_config_hash"),
+        ("projects", "0002_alter_project_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="app",
+            index=models.Index(
+                condition=models.Q(("webhook_id__isnull", False)),
+                fields=["webhook_id"],
+                name="app_webhook_id_idx",
+            ),
+        ),
+        migrations.RunPython(check_duplicate_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="app",
+            constraint=models.UniqueConstraint(
+                fields=("project", "name"), name="app_unique_name_per_project"
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:27
+
+import fernet_fields.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0005_hot_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="app",
+            name="webhook_secret",
+            field=fernet_fields.fields.EncryptedCharField(
+                blank=True, default="", editable=False, max_length=100
+            ),
+        ),
+    ]
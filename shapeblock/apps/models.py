@@ -6,9 +6,7 @@ from django.db import models
 from django.urls import reverse
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.conf import settings
-from github.GithubException import UnknownObjectException
-from .mapper.validator import validate_yaml
-from .git import github
+from .sb_yml import load_sb_yml
 from shapeblock.utils.models import BaseModel, OwnedModel
 from shapeblock.projects.models import Project
 from .git import GIT_REGEX
@@ -68,6 +66,10 @@ class App(BaseModel, OwnedModel):
     repo = models.CharField(null=False, max_length=256)
     ref = models.CharField(null=False, default="main", max_length=256)
     sub_path = models.CharField(null=True, blank=True, max_length=256)
+    # `org/repo` of `repo`, lowercased, to find the apps a push is for
+    repo_full_name = models.CharField(
+        max_length=256, blank=True, default="", editable=False
+    )
     # TODO: should we add version
     # version is dependent on stack
 
@@ -78,6 +80,15 @@ class App(BaseModel, OwnedModel):
     autodeploy = models.BooleanField(default=False)
 
     webhook_id = models.BigIntegerField(null=True)
+    # signs the deliveries of `webhook_id`, empty for hooks created without one
+    webhook_secret = EncryptedCharField(
+        max_length=100, blank=True, default="", editable=False
+    )
+
+    # see `shapeblock.apps.config_hash`
+    config_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False, db_index=True
+    )
 
     has_liveness_probe = models.BooleanField(default=True)
 
@@ -85,6 +96,22 @@ class App(BaseModel, OwnedModel):
         default=1, validators=[MaxValueValidator(6)], null=False
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["repo_full_name", "ref"]),
+            # webhook lookups, most apps have no webhook
+            models.Index(
+                fields=["webhook_id"],
+                condition=models.Q(webhook_id__isnull=False),
+                name="app_webhook_id_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "name"], name="app_unique_name_per_project"
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -112,6 +139,7 @@ class App(BaseModel, OwnedModel):
         """
         Fetch the file `.sb.yml` or `.sb.yaml` from the top level folder in the git repo.
         Shapeblock won't build your app if this file isn't present.
+        Results are cached per commit, see `shapeblock.apps.sb_yml`.
         """
         _, repo_fullname = self.get_repo_details()
 
@@ -123,27 +151,11 @@ class App(BaseModel, OwnedModel):
             if self.is_private:
                 raise Exception(f"No token found for {self.name}.")
             token = settings.GITHUB_TOKEN
-        repo = github.get_repo(token, repo_fullname)
-        try:
-            if self.sub_path:
-                filename = f"{self.sub_path}/.sb.yml"
-            else:
-                filename = ".sb.yml"
-            sb_yml = repo.get_contents(filename, ref=self.ref)
-        except UnknownObjectException:
-            try:
-                if self.sub_path:
-                    filename = f"{self.sub_path}/.sb.yaml"
-                else:
-                    filename = ".sb.yaml"
-                sb_yml = repo.get_contents(filename, ref=self.ref)
-            except UnknownObjectException:
-                # TODO: log saying that sb.yml not found
-                return {}
         # TODO: add gitlab support
-        sb_yml_str = sb_yml.decoded_content.decode("utf-8")
-        sb_yml_dict, validation_errors = validate_yaml(sb_yml_str)
-        if not sb_yml_dict:
+        sb_yml_dict, validation_errors = load_sb_yml(
+            token, repo_fullname, self.ref, self.sub_path
+        )
+        if sb_yml_dict is None:
             raise InvalidSBYml(validation_errors)
         return sb_yml_dict
 
@@ -152,6 +164,8 @@ class App(BaseModel, OwnedModel):
             # get sb yml config merge with config
             sb_yml_config = self.get_sb_yml()
             self.sb_yml = sb_yml_config
+        match = re.match(GIT_REGEX, self.repo)
+        self.repo_full_name = f"{match['org']}/{match['repo']}".lower() if match else ""
         super().save(*args, **kwargs)
 
 
@@ -0,0 +1,198 @@
+"""
+Asyncio streaming of pod logs, shared between all viewers of a pod.
+
+The Kubernetes client is synchronous, so a followed log is read on a thread of
+its own and its lines are handed to the event loop. Closing the response when
+the last viewer leaves ends the read.
+"""
+
+import asyncio
+import contextlib
+import logging
+import socket
+import threading
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from kubernetes.client.rest import ApiException
+
+from shapeblock.utils import watch_cache
+from shapeblock.utils.kubernetes import core_v1_api
+
+logger = logging.getLogger("django")
+
+_END = object()
+
+
+class PodLogError(Exception):
+    pass
+
+
+def _close(response):
+    # wakes the thread blocked reading it, closing alone doesn't
+    sock = getattr(response.connection, "sock", None)
+    if sock is not None:
+        with contextlib.suppress(OSError):
+            sock.shutdown(socket.SHUT_RDWR)
+    response.close()
+
+
+async def follow_pod_log(
+    namespace: str, pod: str, since_seconds: int = 300
+) -> AsyncIterator[str]:
+    """
+    Yield the lines of a pod's log as they are written.
+    """
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    lock = threading.Lock()
+    state = {"response": None, "closed": False}
+
+    def put(item):
+        with contextlib.suppress(RuntimeError):
+            # the loop is gone
+            loop.call_soon_threadsafe(lines.put_nowait, item)
+
+    def read():
+        try:
+            try:
+                response = core_v1_api().read_namespaced_pod_log(
+                    name=pod,
+                    namespace=namespace,
+                    follow=True,
+                    since_seconds=since_seconds,
+                    _preload_content=False,
+                )
+            except ApiException as e:
+                raise PodLogError(
+                    f"Unable to read logs of pod {pod}: {e.status} {e.reason}"
+                )
+            with lock:
+                state["response"] = response
+                closed = state["closed"]
+            if closed:
+                _close(response)
+                return
+            pending = b""
+            for data in response.stream(65536):
+                *complete, pending = (pending + data).split(b"\n")
+                for line in complete:
+                    put(line.decode("utf-8", "replace"))
+            if pending:
+                put(pending.decode("utf-8", "replace"))
+        except Exception as e:
+            with lock:
+                closed = state["closed"]
+            if not closed:
+                put(e)
+        finally:
+            put(_END)
+
+    threading.Thread(target=read, name=f"pod-log-{pod}", daemon=True).start()
+    try:
+        while (item := await lines.get()) is not _END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        with lock:
+            state["closed"] = True
+            response = state["response"]
+        if response is not None:
+            _close(response)
+
+
+async def list_app_pods(namespace: str, app_uuid: str) -> List[str]:
+    informer = watch_cache.get_informer("pods")
+    if informer is not None:
+        return [pod["metadata"]["name"] for pod in informer.by_app(namespace, app_uuid)]
+
+    def list_pods():
+        pods = core_v1_api().list_namespaced_pod(
+            namespace=namespace, label_selector=f"appUuid={app_uuid}"
+        )
+        return sorted(pod.metadata.name for pod in pods.items)
+
+    return await sync_to_async(list_pods, thread_sensitive=False)()
+
+
+class PodLogHub:
+    """
+    Shares one upstream log stream per pod between all of its viewers.
+
+    Every viewer gets its own queue of frames, a frame being a list of lines, or
+    None once the stream has ended. The upstream stream is started by the first
+    viewer and cancelled when the last one leaves.
+    """
+
+    def __init__(self):
+        self._viewers: Dict[Tuple[str, str], Set[asyncio.Queue]] = {}
+        self._streams: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, namespace: str, pod: str):
+        key = (namespace, pod)
+        queue = asyncio.Queue(maxsize=settings.POD_LOG_VIEWER_QUEUE_SIZE)
+        self._viewers.setdefault(key, set()).add(queue)
+        if key not in self._streams:
+            self._streams[key] = asyncio.create_task(self._pump(key))
+        try:
+            yield queue
+        finally:
+            viewers = self._viewers.get(key, set())
+            viewers.discard(queue)
+            if not viewers:
+                self._viewers.pop(key, None)
+                task = self._streams.pop(key, None)
+                if task is not None:
+                    task.cancel()
+
+    def viewer_count(self, namespace: str, pod: str) -> int:
+        return len(self._viewers.get((namespace, pod), ()))
+
+    def _publish(self, key, frame: Optional[List[str]]):
+        for queue in list(self._viewers.get(key, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    async def _pump(self, key):
+        lines = asyncio.Queue()
+        reader = asyncio.create_task(self._read(key, lines))
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    return
+                # let more lines arrive and send them together
+                await asyncio.sleep(settings.POD_LOG_BATCH_INTERVAL)
+                frame = [line]
+                while (
+                    len(frame) < settings.POD_LOG_BATCH_MAX_LINES and not lines.empty()
+                ):
+                    line = lines.get_nowait()
+                    if line is None:
+                        self._publish(key, frame)
+                        return
+                    frame.append(line)
+                self._publish(key, frame)
+        finally:
+            reader.cancel()
+            self._publish(key, None)
+            if self._streams.get(key) is asyncio.current_task():
+                del self._streams[key]
+
+    async def _read(self, key, lines: asyncio.Queue):
+        namespace, pod = key
+        try:
+            async for line in follow_pod_log(namespace, pod):
+                lines.put_nowait(line)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Log stream of pod {pod} in {namespace} failed: {e}")
+        lines.put_nowait(None)
+
+
+pod_log_hub = PodLogHub()
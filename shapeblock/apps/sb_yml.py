@@ -0,0 +1,90 @@
+"""
+Loading of an app's `.sb.yml`, cached by commit.
+
+The branch is resolved to a commit SHA, and the parsed and validated file is
+cached under the repo, that SHA and the sub path. A commit never changes, so
+the result (including "no file") is reused until it is evicted, and repeated
+saves or redeploys of the same commit don't fetch or validate it again.
+"""
+
+import base64
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from github import GithubException
+
+from .git.github_client import always_revalidate, get_client
+from .mapper.validator import schema, validate_yaml, version_enum
+
+SB_YML_NAMES = (".sb.yml", ".sb.yaml")
+
+SHA_REGEX = re.compile(r"^[0-9a-f]{40}$")
+
+# cached results are dropped whenever the schema or supported versions change
+SCHEMA_DIGEST = hashlib.sha256(
+    json.dumps([schema, version_enum], sort_keys=True, default=str).encode()
+).hexdigest()[:12]
+
+
+def cache_key(repo_fullname: str, sha: str, sub_path: Optional[str]) -> str:
+    digest = hashlib.sha256(f"{repo_fullname}\0{sha}\0{sub_path or ''}".encode())
+    return f"sb-yml:{SCHEMA_DIGEST}:{digest.hexdigest()}"
+
+
+def resolve_ref(repo, ref: str) -> str:
+    if SHA_REGEX.match(ref):
+        return ref
+    # the head moves on every push, a 304 still saves the rate limit
+    with always_revalidate():
+        return repo.get_branch(ref).commit.sha
+
+
+def fetch_sb_yml(repo, sha: str, sub_path: Optional[str]) -> Optional[str]:
+    """
+    The contents of `.sb.yml` (or else `.sb.yaml`) in `sub_path` at commit `sha`,
+    found with a single directory listing. None if there is neither.
+    """
+    try:
+        entries = repo.get_contents(sub_path or "", ref=sha)
+    except GithubException as e:
+        if e.status == 404:
+            return None
+        raise
+    if not isinstance(entries, list):
+        # `sub_path` is a file
+        return None
+    files = {entry.name: entry for entry in entries if entry.type == "file"}
+    for name in SB_YML_NAMES:
+        if name in files:
+            blob = repo.get_git_blob(files[name].sha)
+            return base64.b64decode(blob.content).decode("utf-8")
+    return None
+
+
+def load_sb_yml(
+    token: Optional[str], repo_fullname: str, ref: str, sub_path: Optional[str]
+) -> Tuple[Optional[Dict], Optional[List[str]]]:
+    """
+    The validated `.sb.yml` of the repo at `ref`, as returned by `validate_yaml`:
+    `(data, None)` or `(None, errors)`. `({}, None)` if the repo has none.
+    """
+    repo = get_client(token).get_repo(repo_fullname, lazy=True)
+    sha = resolve_ref(repo, ref)
+    key = cache_key(repo_fullname, sha, sub_path)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["data"], cached["errors"]
+
+    content = fetch_sb_yml(repo, sha, sub_path)
+    if content is None:
+        data, errors = {}, None
+    else:
+        data, errors = validate_yaml(content)
+    cache.set(
+        key, {"data": data, "errors": errors}, timeout=settings.SB_YML_CACHE_TIMEOUT
+    )
+    return data, errors
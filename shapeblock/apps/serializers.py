@@ -1,9 +1,11 @@
 import logging
-from github import Github, GithubException, UnknownObjectException
+from github import GithubException, UnknownObjectException
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from urllib.parse import urlparse
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from .models import (
     App,
@@ -15,6 +17,8 @@ from .models import (
     InitProcess,
     WorkerProcess,
 )
+from .git.github import branch_exists
+from .git.github_client import get_client
 from shapeblock.projects.models import Project
 from shapeblock.services.models import Service
 
@@ -47,12 +51,8 @@ def extract_github_org_repo(url):
 
 def validate_github_repo_and_branch(url, branch, user_github_token):
     repo_path = extract_github_org_repo(url)
-    if user_github_token:
-        gh = Github(user_github_token)
-    else:
-        gh = Github(
-            settings.GITHUB_TOKEN
-        )  # Fallback to settings token for public repos only
+    # Fallback to settings token for public repos only
+    gh = get_client(user_github_token or settings.GITHUB_TOKEN)
 
     try:
         logger.info(repo_path)
@@ -66,7 +66,7 @@ def validate_github_repo_and_branch(url, branch, user_github_token):
             else:
                 raise ValidationError(f"The repo {url} could not be found.")
 
-        if branch not in [b.name for b in repo.get_branches()]:
+        if not branch_exists(repo, branch):
             raise ValidationError(
                 f'The branch "{branch}" does not exist in the repository.'
             )
@@ -110,6 +110,8 @@ class AppSerializer(serializers.ModelSerializer):
             "sub_path",
             "user",
         ]
+        # duplicate names are caught by the constraint on insert, in `create`
+        validators = []
 
     user = serializers.PrimaryKeyRelatedField(
         read_only=True, default=serializers.CurrentUserDefault()
@@ -128,18 +130,22 @@ class AppSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data["user"] = self.context["request"].user
-        return super().create(validated_data)
-
-    def validate(self, attrs):
-        name = attrs.get("name")
-        project = attrs.get("project")
-
-        # Check for uniqueness manually
-        if App.objects.filter(name=name, project=project).exists():
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            # names are unique per project, see `App.Meta.constraints`
+            name = validated_data["name"]
+            project = validated_data["project"]
             raise serializers.ValidationError(
-                f"An app with the name {name} already exists in project {project}."
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        f"An app with the name {name} already exists in project {project}."
+                    ]
+                }
             )
 
+    def validate(self, attrs):
         repo = attrs.get("repo")
         ref = attrs.get("ref")
         user_github_token = self.context["request"].user.github_token
@@ -247,6 +253,35 @@ class AppReadSerializer(serializers.ModelSerializer):
 
     workers = WorkerProcessSerializer(many=True)
 
+    # nested collections, loaded with one extra query each when listing apps
+    PREFETCH_FIELDS = (
+        "env_vars",
+        "build_vars",
+        "volumes",
+        "secrets",
+        "services",
+        "custom_domains",
+        "init_processes",
+        "workers",
+    )
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None):
+        """
+        Load the project and the nested collections in `fields` (all of them
+        by default) up front, so the query count doesn't grow with the number of apps.
+        """
+        prefetch = [
+            name for name in cls.PREFETCH_FIELDS if fields is None or name in fields
+        ]
+        return queryset.select_related("project").prefetch_related(*prefetch)
+
     def get_domain(self, obj):
         return obj.domain
 
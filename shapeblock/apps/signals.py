@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .config_hash import refresh_deferred, schedule_config_hash_refresh
+from .models import BuildVar, EnvVar, Secret, Volume
+
+
+@receiver(post_save, sender=EnvVar)
+@receiver(post_save, sender=Secret)
+@receiver(post_save, sender=BuildVar)
+@receiver(post_save, sender=Volume)
+@receiver(post_delete, sender=EnvVar)
+@receiver(post_delete, sender=Secret)
+@receiver(post_delete, sender=BuildVar)
+@receiver(post_delete, sender=Volume)
+def config_changed(sender, instance, **kwargs):
+    if not refresh_deferred():
+        schedule_config_hash_refresh(instance.app_id)
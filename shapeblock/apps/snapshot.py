@@ -0,0 +1,99 @@
+"""
+Immutable snapshots of an app and its sub-resources, as used by the deploy pipeline.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from uuid import UUID
+
+from .models import (
+    App,
+    EnvVar,
+    Secret,
+    Volume,
+    BuildVar,
+    InitProcess,
+    WorkerProcess,
+    CustomDomain,
+)
+
+
+@dataclass(frozen=True)
+class KeyValue:
+    key: str
+    value: str
+
+
+@dataclass(frozen=True)
+class VolumeSnapshot:
+    name: str
+    mount_path: str
+    size: int
+
+
+@dataclass(frozen=True)
+class ProcessSnapshot:
+    key: str
+    memory: str
+    cpu: str
+
+
+@dataclass(frozen=True)
+class CustomDomainSnapshot:
+    domain: str
+
+
+@dataclass(frozen=True)
+class AppSnapshot:
+    uuid: UUID
+    name: str
+    namespace: str
+    stack: str
+    repo: str
+    ref: str
+    sub_path: Optional[str]
+    replicas: int
+    has_liveness_probe: bool
+    env_vars: Tuple[KeyValue, ...]
+    secrets: Tuple[KeyValue, ...]
+    volumes: Tuple[VolumeSnapshot, ...]
+    build_vars: Tuple[KeyValue, ...]
+    init_processes: Tuple[ProcessSnapshot, ...]
+    custom_domains: Tuple[CustomDomainSnapshot, ...]
+    workers: Tuple[ProcessSnapshot, ...]
+
+
+def _rows(model, snapshot_class, fields, app_uuid):
+    rows = model.objects.filter(app_id=app_uuid).order_by("pk").values_list(*fields)
+    return tuple(snapshot_class(*row) for row in rows)
+
+
+def load_app_snapshot(app_uuid) -> AppSnapshot:
+    """
+    Load an app with all of its sub-resources in a fixed number of queries,
+    one for the app and its project and one per sub-resource, however many rows
+    there are. Secret values are decrypted once, while loading.
+    """
+    app = App.objects.select_related("project").get(uuid=app_uuid)
+    return AppSnapshot(
+        uuid=app.uuid,
+        name=app.name,
+        namespace=app.project.name,
+        stack=app.stack,
+        repo=app.repo,
+        ref=app.ref,
+        sub_path=app.sub_path,
+        replicas=app.replicas,
+        has_liveness_probe=app.has_liveness_probe,
+        env_vars=_rows(EnvVar, KeyValue, ("key", "value"), app.uuid),
+        secrets=_rows(Secret, KeyValue, ("key", "value"), app.uuid),
+        volumes=_rows(Volume, VolumeSnapshot, ("name", "mount_path", "size"), app.uuid),
+        build_vars=_rows(BuildVar, KeyValue, ("key", "value"), app.uuid),
+        init_processes=_rows(
+            InitProcess, ProcessSnapshot, ("key", "memory", "cpu"), app.uuid
+        ),
+        custom_domains=_rows(CustomDomain, CustomDomainSnapshot, ("domain",), app.uuid),
+        workers=_rows(
+            WorkerProcess, ProcessSnapshot, ("key", "memory", "cpu"), app.uuid
+        ),
+    )
@@ -0,0 +1,54 @@
+"""
+App status updates pushed to websocket clients.
+
+Updates go to a group per owner and a group per project, never to everybody.
+"""
+
+import logging
+from typing import Dict, List
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .models import App
+
+logger = logging.getLogger("django")
+
+
+def user_group(user_id) -> str:
+    return f"apps_user_{user_id}"
+
+
+def project_group(project_uuid) -> str:
+    return f"apps_project_{project_uuid}"
+
+
+def app_status(app: App) -> Dict:
+    return {
+        "uuid": str(app.uuid),
+        "status": app.status,
+        "project": str(app.project_id),
+    }
+
+
+def broadcast_app_status(app: App):
+    channel_layer = get_channel_layer()
+    event = {"type": "app_status_message", "data": app_status(app)}
+    try:
+        for group in (user_group(app.user_id), project_group(app.project_id)):
+            async_to_sync(channel_layer.group_send)(group, event)
+    except Exception as e:
+        # clients fall back to the snapshot they get when reconnecting
+        logger.warning(f"Unable to push status of app {app.name}: {e}")
+
+
+def app_status_snapshot(user, project_uuid=None) -> List[Dict]:
+    apps = App.objects.filter(user=user)
+    if project_uuid is not None:
+        apps = apps.filter(project_id=project_uuid)
+    return [
+        {"uuid": str(uuid), "name": name, "status": status, "project": str(project)}
+        for uuid, name, status, project in apps.order_by("created_at").values_list(
+            "uuid", "name", "status", "project_id"
+        )
+    ]
@@ -0,0 +1,100 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from shapeblock.apps.config_hash import config_hash, get_config
+from shapeblock.apps.models import App, EnvVar, Secret, Volume
+from shapeblock.deployments.models import Deployment
+from shapeblock.utils.testing import make_app
+
+
+class ConfigHashTestCase(TestCase):
+    def setUp(self):
+        self.app = make_app("web")
+
+    def current(self):
+        return App.objects.values_list("config_hash", flat=True).get(pk=self.app.pk)
+
+    def test_order_independent(self):
+        first = {"env_vars": {"A": "1", "B": "2"}, "volumes": []}
+        second = {"volumes": [], "env_vars": {"B": "2", "A": "1"}}
+        self.assertEqual(config_hash(first), config_hash(second))
+        self.assertNotEqual(
+            config_hash(first), config_hash({**first, "env_vars": {"A": "1"}})
+        )
+
+    def test_kept_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            env_var = EnvVar.objects.create(app=self.app, key="A", value="1")
+        after_create = self.current()
+        self.assertEqual(after_create, config_hash(get_config(self.app.pk)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Secret.objects.create(app=self.app, key="TOKEN", value="hunter2")
+        self.assertNotEqual(self.current(), after_create)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Volume.objects.create(app=self.app, name="data", mount_path="/workspace/d")
+            Volume.objects.filter(app=self.app).delete()
+            Secret.objects.filter(app=self.app).delete()
+        self.assertEqual(self.current(), after_create)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            env_var.value = "2"
+            env_var.save()
+        self.assertNotEqual(self.current(), after_create)
+
+    def test_secret_values_not_readable(self):
+        self.assertNotIn("hunter2", config_hash({"secrets": {"TOKEN": "hunter2"}}))
+
+
+@mock.patch("shapeblock.deployments.serializers.get_commit_sha", return_value="a" * 40)
+@mock.patch("shapeblock.deployments.views.enqueue_deployment")
+class ConfigChangeTestCase(APITestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.client.force_authenticate(self.app.user)
+
+    def deploy(self):
+        url = reverse("deployment-list-create", kwargs={"app_uuid": self.app.uuid})
+        return self.client.post(url, {}, format="json")
+
+    def test_unchanged_config_is_not_redeployed(self, enqueue, get_commit_sha):
+        with self.captureOnCommitCallbacks(execute=True):
+            Secret.objects.create(app=self.app, key="TOKEN", value="hunter2")
+        self.app.refresh_from_db()
+        # app, user, last deployment, params (secret keys only), insert, app status
+        with self.assertNumQueries(9):
+            self.assertEqual(self.deploy().status_code, 202)
+        deployment = Deployment.objects.get()
+        self.assertEqual(
+            deployment.params,
+            {"env_vars": {}, "secrets": ["TOKEN"], "build_vars": {}, "volumes": []},
+        )
+        self.app.refresh_from_db()
+        self.assertEqual(deployment.config_hash, self.app.config_hash)
+        # the stored hashes are compared, the config isn't read
+        with self.assertNumQueries(3):
+            self.assertEqual(self.deploy().status_code, 400)
+
+        url = reverse("app-secrets", kwargs={"uuid": self.app.uuid})
+        payload = {"secrets": [{"key": "TOKEN", "value": "hunter3"}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, payload, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.app.refresh_from_db()
+        self.assertNotEqual(self.app.config_hash, deployment.config_hash)
+        self.assertEqual(self.deploy().status_code, 202)
+
+    def test_refresh_command(self, enqueue, get_commit_sha):
+        # written without the signals
+        Secret.objects.bulk_create([Secret(app=self.app, key="TOKEN", value="x")])
+        out = StringIO()
+        call_command("refresh_config_hashes", stdout=out)
+        self.assertIn("Checked 1 apps, fixed 1 config hashes.", out.getvalue())
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.config_hash, config_hash(get_config(self.app.pk)))
@@ -0,0 +1,253 @@
+import os
+import re
+import time
+import unittest
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from shapeblock.apps.git import github, github_client
+from shapeblock.apps.serializers import validate_github_repo_and_branch
+from .test_github_client import FakeGithubMixin
+
+
+class FakeSearchMixin(FakeGithubMixin):
+    """
+    Fake repository search for a user in `orgs` orgs, owning `repos_per_org`
+    repos in each of them. Every page takes `page_delay` seconds.
+    """
+
+    orgs = 5
+    repos_per_org = 10
+    page_delay = 0
+
+    def setUp(self):
+        super().setUp()
+        user = {"login": "alice", "url": f"{self.server.url}/users/alice"}
+        self.server.route("GET", r"/user", (200, user))
+        self.server.route(
+            "GET",
+            r"/user/orgs",
+            (200, [{"login": f"org-{i}"} for i in range(self.orgs)]),
+        )
+        self.server.route("GET", r"/search/repositories", self.search)
+
+    def search(self, request):
+        time.sleep(self.page_delay)
+        org = re.search(r"org:(\S+)", request.query["q"])
+        orgs = [org.group(1)] if org else [f"org-{i}" for i in range(self.orgs)]
+        # the user search finds the repos of all orgs, org searches their own
+        repos = [
+            {
+                "id": int(org.split("-")[1]) * self.repos_per_org + i,
+                "full_name": f"{org}/repo-{i}",
+                "ssh_url": f"git@github.com:{org}/repo-{i}.git",
+            }
+            for org in orgs
+            for i in range(self.repos_per_org)
+        ]
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        items = repos[(page - 1) * per_page : page * per_page]
+        headers = {}
+        if page * per_page < len(repos):
+            query = {**request.query, "page": page + 1}
+            headers["Link"] = (
+                f'<{self.server.url}/search/repositories?{urlencode(query)}>; rel="next"'
+            )
+        body = {"total_count": len(repos), "incomplete_results": False, "items": items}
+        return 200, body, headers
+
+    def searches(self):
+        return [r for r in self.server.requests if r.path == "/search/repositories"]
+
+
+class UserReposTestCase(FakeSearchMixin, SimpleTestCase):
+    def test_dedup(self):
+        repos = github.get_user_repos("token", "repo")
+        self.assertEqual(len(repos), self.orgs * self.repos_per_org)
+        self.assertEqual(
+            sorted(r["id"] for r in repos), list(range(self.orgs * self.repos_per_org))
+        )
+        self.assertEqual(repos[0].keys(), {"id", "url", "full_name"})
+        queries = {r.query["q"] for r in self.searches()}
+        self.assertEqual(
+            queries,
+            {"repo user:alice fork:true"}
+            | {f"repo user:alice org:org-{i} fork:true" for i in range(self.orgs)},
+        )
+
+    def test_owner(self):
+        github.get_user_repos("token", "repo", owner="shapeblock")
+        self.assertIn(
+            "repo user:shapeblock fork:true", [r.query["q"] for r in self.searches()]
+        )
+
+    @override_settings(GITHUB_SEARCH_WORKERS=1)
+    def test_limit_stops_searching(self):
+        self.repos_per_org = 100
+        repos = github.get_user_repos("token", "repo", limit=5)
+        self.assertEqual(len(repos), 5)
+        # the first page was enough, later pages and org searches aren't fetched
+        time.sleep(0.2)
+        self.assertLess(len(self.searches()), 3)
+
+    def test_errors_are_raised(self):
+        self.server.route(
+            "GET",
+            r"/search/repositories",
+            (422, {"message": "Validation Failed"}),
+        )
+        with self.assertRaises(Exception):
+            github.get_user_repos("token", "repo")
+
+    def test_git_refs(self):
+        user = type("User", (), {})()
+        self.server.route(
+            "GET",
+            r"/repositories/(?P<id>\d+)",
+            lambda request, id: (
+                200,
+                {
+                    "id": int(id),
+                    "default_branch": "main",
+                    "url": f"{self.server.url}/repositories/{id}",
+                },
+            ),
+        )
+        self.server.route(
+            "GET",
+            r"/repositories/13/branches",
+            (200, [{"name": "main", "commit": {"sha": "a" * 40}}]),
+        )
+        accounts = [{"name": "github", "id": "token"}]
+        with mock.patch.object(
+            github, "get_user_connected_accounts", return_value=accounts
+        ):
+            self.assertEqual(
+                github.get_git_refs(user, "org-1/repo-3"), (["main"], "main")
+            )
+            self.assertEqual(
+                github.get_git_refs(user, "org-1/missing"), (["master"], "master")
+            )
+
+
+@unittest.skipUnless(os.environ.get("SB_BENCHMARK"), "set SB_BENCHMARK=1 to run")
+class UserReposBenchmark(FakeSearchMixin, SimpleTestCase):
+    orgs = 40
+    repos_per_org = 150
+    page_delay = 0.02
+
+    def test_search(self):
+        for workers in (1, 4, 16):
+            github_client.reset()
+            with override_settings(GITHUB_SEARCH_WORKERS=workers):
+                start = time.perf_counter()
+                repos = github.get_user_repos("token", "repo")
+                elapsed = time.perf_counter() - start
+            self.assertEqual(len(repos), self.orgs * self.repos_per_org)
+            print(
+                f"\n{workers} workers: {len(repos)} repos from {self.orgs} orgs "
+                f"in {elapsed:.2f}s"
+            )
+        github_client.reset()
+        start = time.perf_counter()
+        repos = github.get_user_repos("token", "repo", limit=50)
+        print(f"first 50 repos in {time.perf_counter() - start:.2f}s")
+
+
+class BranchesTestCase(FakeGithubMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.branches = [f"branch-{i:03}" for i in range(250)]
+        self.server.route("GET", r"/repos/shapeblock/web/branches", self.list_branches)
+        self.server.route(
+            "GET",
+            r"/repos/shapeblock/web/git/matching-refs/heads/(?P<prefix>.*)",
+            lambda request, prefix: (
+                200,
+                [
+                    {"ref": f"refs/heads/{name}", "object": {"sha": "a" * 40}}
+                    for name in self.branches
+                    if name.startswith(prefix)
+                ],
+            ),
+        )
+
+    def list_branches(self, request):
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        names = self.branches[(page - 1) * per_page : page * per_page]
+        headers = {}
+        if page * per_page < len(self.branches):
+            url = f"{self.server.url}/repos/shapeblock/web/branches"
+            headers["Link"] = f'<{url}?per_page={per_page}&page={page + 1}>; rel="next"'
+        body = [{"name": name, "commit": {"sha": "a" * 40}} for name in names]
+        return 200, body, headers
+
+    def test_pages(self):
+        self.assertEqual(
+            github.get_branches("token", "shapeblock/web"),
+            (self.branches[:100], True),
+        )
+        self.assertEqual(
+            github.get_branches("token", "shapeblock/web", page=3),
+            (self.branches[200:], False),
+        )
+        # the repo itself isn't fetched
+        self.assertEqual(
+            [r.query.get("page") for r in self.server.requests], [None, "3"]
+        )
+
+    def test_all_branches(self):
+        # the branch picker lists every branch
+        self.assertEqual(
+            github.get_all_branches("token", "shapeblock/web"), self.branches
+        )
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_prefix(self):
+        self.assertEqual(
+            github.get_branches("token", "shapeblock/web", prefix="branch-24"),
+            ([f"branch-24{i}" for i in range(10)], False),
+        )
+        self.assertEqual(
+            self.server.requests[0].path,
+            "/repos/shapeblock/web/git/matching-refs/heads/branch-24",
+        )
+
+    def test_prefix_pages(self):
+        # the matching refs come in one response, paged here
+        self.assertEqual(
+            github.get_branches("token", "shapeblock/web", prefix="branch-", page=2),
+            (self.branches[100:200], True),
+        )
+        self.assertEqual(
+            github.get_branches("token", "shapeblock/web", prefix="branch-", page=3),
+            (self.branches[200:], False),
+        )
+        self.assertNotIn("page", self.server.requests[0].query)
+
+    def test_branch_exists(self):
+        repo = github.get_repo("token", "shapeblock/web")
+        self.assertTrue(github.branch_exists(repo, "main"))
+        self.assertFalse(github.branch_exists(repo, "nope"))
+
+    def test_validation_looks_up_one_branch(self):
+        url = "https://github.com/shapeblock/web.git"
+        self.assertEqual(
+            validate_github_repo_and_branch(url, "main", "token"),
+            "https://github.com/shapeblock/web.git",
+        )
+        with self.assertRaises(ValidationError):
+            validate_github_repo_and_branch(url, "nope", "token")
+        self.assertEqual(
+            [r.path for r in self.server.requests],
+            [
+                "/repos/shapeblock/web",
+                "/repos/shapeblock/web/branches/main",
+                "/repos/shapeblock/web/branches/nope",
+            ],
+        )
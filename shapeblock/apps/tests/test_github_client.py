@@ -0,0 +1,173 @@
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from github import Github, UnknownObjectException
+from rest_framework.test import APIClient
+
+from shapeblock.apps.git import github, github_client
+from shapeblock.apps.serializers import validate_github_repo_and_branch
+from shapeblock.utils.testing import FakeAPIServer
+
+REPO = {
+    "id": 1,
+    "name": "web",
+    "full_name": "shapeblock/web",
+    "default_branch": "main",
+    "private": False,
+}
+
+
+class FakeGithubMixin:
+    def setUp(self):
+        super().setUp()
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            GITHUB_API_URL=self.server.url, GITHUB_TOKEN="app-token"
+        )
+        self.settings_override.enable()
+        github_client.reset()
+        self.head = "a" * 40
+        repo = {**REPO, "url": f"{self.server.url}/repos/shapeblock/web"}
+        self.server.route("GET", r"/repos/shapeblock/web", self.conditional(repo))
+        self.server.route(
+            "GET",
+            r"/repos/shapeblock/web/branches",
+            self.conditional([{"name": "main", "commit": {"sha": self.head}}]),
+        )
+        self.server.route("GET", r"/repos/shapeblock/web/branches/main", self.branch)
+
+    def tearDown(self):
+        github_client.reset()
+        self.settings_override.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def conditional(self, body, etag='"v1"'):
+        def respond(request):
+            if request.headers.get("If-None-Match") == etag:
+                return 304, b"", {"ETag": etag}
+            return 200, body, {"ETag": etag}
+
+        return respond
+
+    def branch(self, request):
+        # the head commit doubles as the ETag
+        body = {"name": "main", "commit": {"sha": self.head}}
+        return self.conditional(body, etag=self.head)(request)
+
+    def github_requests(self, path):
+        return [r for r in self.server.requests if r.path == path]
+
+
+class GithubClientTestCase(FakeGithubMixin, SimpleTestCase):
+    def test_app_creation_fetches_repo_once(self):
+        validate_github_repo_and_branch(
+            "https://github.com/shapeblock/web.git", "main", "user-token"
+        )
+        github.get_repo("user-token", "shapeblock/web")
+        github.get_repo("user-token", "shapeblock/web")
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/web")), 1)
+        self.assertEqual(
+            self.server.requests[0].headers["Authorization"], "token user-token"
+        )
+        self.assertEqual(
+            github_client.cache_stats(),
+            {"entries": 2, "hits": 2, "misses": 2, "revalidated": 0},
+        )
+
+    def test_tokens_are_cached_separately(self):
+        self.assertIs(github_client.get_client("one"), github_client.get_client("one"))
+        github.get_repo("one", "shapeblock/web")
+        github.get_repo("two", "shapeblock/web")
+        github.get_repo(None, "shapeblock/web")
+        requests = self.github_requests("/repos/shapeblock/web")
+        self.assertEqual(
+            [r.headers.get("Authorization") for r in requests],
+            ["token one", "token two", None],
+        )
+
+    @override_settings(GITHUB_CACHE_TTL=0)
+    def test_expired_entries_are_revalidated(self):
+        self.assertEqual(github.get_default_branch("token", "shapeblock/web"), "main")
+        self.assertEqual(github.get_default_branch("token", "shapeblock/web"), "main")
+        first, second = self.github_requests("/repos/shapeblock/web")
+        self.assertIsNone(first.headers.get("If-None-Match"))
+        self.assertEqual(second.headers["If-None-Match"], '"v1"')
+        self.assertEqual(github_client.cache_stats()["revalidated"], 1)
+
+    def test_head_commit_is_always_revalidated(self):
+        self.assertEqual(
+            github.get_head_commit("token", "shapeblock/web", "main"), "a" * 40
+        )
+        self.assertEqual(
+            github.get_head_commit("token", "shapeblock/web", "main"), "a" * 40
+        )
+        self.head = "b" * 40
+        self.assertEqual(
+            github.get_head_commit("token", "shapeblock/web", "main"), "b" * 40
+        )
+        requests = self.github_requests("/repos/shapeblock/web/branches/main")
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(requests[1].headers["If-None-Match"], "a" * 40)
+        # the repo itself was fresh
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/web")), 1)
+
+    def test_writes_invalidate_the_url(self):
+        keys = [{"id": 1, "key": "ssh-rsa AAA", "title": "old"}]
+        self.server.route("GET", r"/repos/shapeblock/web/keys", lambda r: (200, keys))
+        self.server.route(
+            "POST",
+            r"/repos/shapeblock/web/keys",
+            (201, {"id": 2, "key": "ssh-rsa BBB", "title": "new"}),
+        )
+        repo = github.get_repo("token", "shapeblock/web")
+        self.assertEqual(len(list(repo.get_keys())), 1)
+        self.assertEqual(github.add_deploy_key(repo, "new", "ssh-rsa BBB"), 2)
+        keys.append({"id": 2, "key": "ssh-rsa BBB", "title": "new"})
+        self.assertEqual(len(list(repo.get_keys())), 2)
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/web/keys")), 3)
+
+    @override_settings(GITHUB_CACHE_MAX_ENTRIES=1)
+    def test_lru_eviction(self):
+        github.get_repo("token", "shapeblock/web")
+        github.get_branches("token", "shapeblock/web")
+        github.get_repo("token", "shapeblock/web")
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/web")), 2)
+        self.assertEqual(github_client.cache_stats()["entries"], 1)
+
+    @override_settings(GITHUB_CACHE_TTL=0)
+    def test_connections_are_kept_alive(self):
+        for token in ("one", "one", "two"):
+            github.get_repo(token, "shapeblock/web")
+        # one TCP connection for every request and client
+        self.assertEqual(len({r.client_address for r in self.server.requests}), 1)
+
+    def test_other_clients_are_not_cached(self):
+        gh = Github(base_url=self.server.url)
+        for _ in range(2):
+            gh.get_repo("shapeblock/web")
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/web")), 2)
+        self.assertEqual(github_client.cache_stats()["misses"], 0)
+
+    def test_errors_are_not_cached(self):
+        self.server.route(
+            "GET", r"/repos/shapeblock/missing", (404, {"message": "Not Found"})
+        )
+        for _ in range(2):
+            with self.assertRaises(UnknownObjectException):
+                github.get_repo("token", "shapeblock/missing")
+        self.assertEqual(len(self.github_requests("/repos/shapeblock/missing")), 2)
+
+
+class GithubCacheViewTestCase(FakeGithubMixin, TestCase):
+    def test_admin_only(self):
+        github.get_repo("token", "shapeblock/web")
+        client = APIClient()
+        user = get_user_model().objects.create_user(username="user", password="pw")
+        client.force_authenticate(user)
+        self.assertEqual(client.get(reverse("github-cache")).status_code, 403)
+        user.is_staff = True
+        user.save()
+        response = client.get(reverse("github-cache"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["misses"], 1)
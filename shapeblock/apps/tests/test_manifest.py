@@ -0,0 +1,142 @@
+import json
+import os
+import time
+import unittest
+from types import SimpleNamespace
+
+import yaml
+from django.template.loader import render_to_string
+
+from shapeblock.apps.manifest import build_application
+
+
+def row(**fields):
+    return SimpleNamespace(**fields)
+
+
+def sb_config(**overrides):
+    config = {
+        "app_uuid": "97b350a1-d27d-4a0a-883c-bc4bd01c934c",
+        "deployment_uuid": "1f0c3e2a-5d4b-4a8e-9c1d-2b3a4c5d6e7f",
+        "deployment_type": "code",
+        "name": "drupal",
+        "cluster_domain": "royal-thunder-445b.shapeblock.xyz",
+        "namespace": "drupal-10",
+        "chart_version": "0.2.0",
+        "replicas": 2,
+        "type": "php",
+        "env_vars": [],
+        "secrets": [],
+        "volumes": [],
+        "build_vars": [],
+        "init_processes": [],
+        "custom_domains": [],
+        "workers": [],
+        "has_liveness_probe": True,
+        "git": {
+            "url": "git@github.com:shapeblock/drupal-10.git",
+            "revision": "0a1b2c3d4e5f",
+            "sub_path": None,
+        },
+        "version": "8.2",
+    }
+    config.update(overrides)
+    return config
+
+
+def full_sb_config(size=3):
+    return sb_config(
+        env_vars=[row(key=f"ENV_{i}", value=f"value {i}") for i in range(size)]
+        + [
+            row(key="PORT", value="9000"),
+            row(key="YES", value="it's <b>&amp</b>"),
+            row(key="123", value='say "hi"'),
+            row(key="null", value="back\\\\slash \\t tab"),
+            row(key="FLOAT", value="1.0"),
+            row(key="UNICODE", value="héllo wörld"),
+        ],
+        secrets=[row(key=f"SECRET_{i}", value=f"s3cr3t&{i}") for i in range(size)],
+        volumes=[
+            row(name="uploads", mount_path="/workspace/web/files", size=2),
+            row(name="cache", mount_path="/workspace/cache", size=5),
+        ],
+        build_vars=[row(key="BP_PHP_VERSION", value="8.2"), row(key="A", value="")],
+        init_processes=[row(key="migrate", cpu="500m", memory="512Mi")],
+        custom_domains=[row(domain="www.example.com"), row(domain="example.org")],
+        workers=[
+            row(key="celery", cpu="1000m", memory="1Gi"),
+            row(key="beat", cpu="100m", memory="128Mi"),
+        ],
+        git={
+            "url": "https://github.com/shapeblock/drupal-10.git",
+            "revision": "main",
+            "sub_path": "apps/web",
+        },
+    )
+
+
+def render_template(config):
+    return yaml.load(render_to_string("app.yaml", config), Loader=yaml.FullLoader)
+
+
+class ApplicationManifestTestCase(unittest.TestCase):
+    def assertSameManifest(self, config):
+        expected = render_template(config)
+        manifest = build_application(config)
+        self.assertEqual(manifest, expected)
+        # key order matters too, the payload is sent as serialised
+        self.assertEqual(json.dumps(manifest), json.dumps(expected))
+
+    def test_minimal_app(self):
+        self.assertSameManifest(sb_config())
+
+    def test_config_deployment_without_git(self):
+        config = sb_config(deployment_type="config", has_liveness_probe=False)
+        del config["git"]
+        self.assertSameManifest(config)
+
+    def test_app_with_all_resources(self):
+        self.assertSameManifest(full_sb_config())
+
+    def test_secrets_without_volumes(self):
+        self.assertSameManifest(
+            sb_config(
+                secrets=[row(key="API_KEY", value="x")],
+                init_processes=[row(key="migrate", cpu="1", memory="1Gi")],
+                workers=[row(key="php", cpu="1", memory="1Gi")],
+                custom_domains=[
+                    row(domain="drupal-10-drupal.royal-thunder-445b.shapeblock.xyz")
+                ],
+            )
+        )
+
+    def test_post_deploy_hook(self):
+        self.assertSameManifest(
+            sb_config(
+                post_deploy="./post-deploy.sh",
+                mounts={"uploads": {"mountPath": "/workspace/files"}},
+                volumes=[row(name="uploads", mount_path="/workspace/files", size=1)],
+                secrets=[row(key="API_KEY", value="x")],
+            )
+        )
+
+
+@unittest.skipUnless(os.environ.get("SB_BENCHMARK"), "set SB_BENCHMARK=1 to run")
+class ApplicationManifestBenchmark(unittest.TestCase):
+    rounds = 20
+
+    def measure(self, func, config):
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            func(config)
+        return (time.perf_counter() - start) / self.rounds * 1000
+
+    def test_builder_against_template(self):
+        for size in (10, 100, 500):
+            config = full_sb_config(size)
+            template_ms = self.measure(render_template, config)
+            builder_ms = self.measure(build_application, config)
+            print(
+                f"\n{size} env vars/secrets: template + yaml {template_ms:.2f}ms, "
+                f"builder {builder_ms:.2f}ms ({template_ms / builder_ms:.1f}x)"
+            )
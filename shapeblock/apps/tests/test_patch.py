@@ -0,0 +1,160 @@
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from shapeblock.apps.kubernetes import MANIFEST_HASH_ANNOTATION
+from shapeblock.apps.models import CustomDomain, Secret, Volume
+from shapeblock.deployments.logs import get_log
+from shapeblock.deployments.models import Deployment, DeploymentJob
+from shapeblock.utils import kubernetes
+from shapeblock.utils.testing import FakeAPIServer, make_app
+
+APPLICATION = (
+    "/apis/dev.shapeblock.com/v1alpha1/namespaces/project-web/applications/web"
+)
+
+
+class PatchAppTestCase(APITestCase):
+    """
+    Single field changes of a deployed app, against a fake API server.
+    """
+
+    def setUp(self):
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url, KUBE_TOKEN="fake-token"
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+        self.application = {
+            "metadata": {
+                "name": "web",
+                "annotations": {MANIFEST_HASH_ANNOTATION: "digest"},
+            },
+            "spec": {
+                "chart": {
+                    "values": {
+                        "universal-chart": {
+                            "ingresses": {"old.example.com": {"name": "old"}}
+                        }
+                    }
+                }
+            },
+        }
+        self.server.route("GET", APPLICATION, lambda request: (200, self.application))
+        self.server.route("PATCH", APPLICATION, lambda request: (200, request.json()))
+        self.app = make_app("web", status="ready", replicas=1)
+        self.client.force_authenticate(self.app.user)
+
+    def tearDown(self):
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+
+    def patches(self):
+        return [r.json() for r in self.server.requests if r.method == "PATCH"]
+
+    def values(self, patch):
+        return patch["spec"]["chart"]["values"]["universal-chart"]
+
+    def test_scale(self):
+        url = reverse("scale", kwargs={"uuid": self.app.uuid})
+        response = self.client.patch(url, {"replicas": 3}, format="json")
+        self.assertEqual(response.status_code, 200)
+        (patch,) = self.patches()
+        self.assertEqual(self.values(patch), {"deployments": {"php": {"replicas": 3}}})
+        # the next deployment is sent in full
+        self.assertEqual(
+            patch["metadata"], {"annotations": {MANIFEST_HASH_ANNOTATION: None}}
+        )
+
+        deployment = Deployment.objects.get()
+        self.assertEqual(
+            (deployment.type, deployment.status, deployment.params),
+            ("patch", "success", {"replicas": 3}),
+        )
+        self.assertEqual(get_log(deployment), 'Patched scale: {"replicas": 3}\n')
+        self.assertFalse(DeploymentJob.objects.exists())
+        self.app.refresh_from_db()
+        self.assertEqual((self.app.replicas, self.app.status), (3, "ready"))
+
+    def test_scale_without_application(self):
+        self.server.route("GET", APPLICATION, (404, {"kind": "Status", "code": 404}))
+        url = reverse("scale", kwargs={"uuid": self.app.uuid})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"replicas": 3}, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.patches(), [])
+        self.assertEqual(DeploymentJob.objects.get().deployment.type, "config")
+
+    def test_liveness_probe(self):
+        deployed = {
+            "name": "php",
+            "envConfigmaps": ["envs"],
+            "livenessProbe": {"tcpSocket": {"port": 8080}},
+        }
+        self.application["spec"]["chart"]["values"]["universal-chart"][
+            "deployments"
+        ] = {"php": {"containers": [deployed]}}
+        # changes which haven't been deployed yet
+        Volume.objects.create(app=self.app, name="data", mount_path="/workspace/data")
+        Secret.objects.create(app=self.app, key="TOKEN", value="secret")
+
+        url = reverse("liveness-probe", kwargs={"uuid": self.app.uuid})
+        response = self.client.patch(url, {"liveness_probe": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+        (patch,) = self.patches()
+        self.assertEqual(
+            self.values(patch),
+            {
+                "deployments": {
+                    "php": {"containers": [{"name": "php", "envConfigmaps": ["envs"]}]}
+                }
+            },
+        )
+
+        del deployed["livenessProbe"]
+        self.app.refresh_from_db()
+        self.client.patch(url, {"liveness_probe": True}, format="json")
+        (container,) = self.values(self.patches()[1])["deployments"]["php"][
+            "containers"
+        ]
+        self.assertEqual(
+            container, {**deployed, "livenessProbe": {"tcpSocket": {"port": 8080}}}
+        )
+
+    def test_liveness_probe_without_containers(self):
+        url = reverse("liveness-probe", kwargs={"uuid": self.app.uuid})
+        response = self.client.patch(url, {"liveness_probe": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+        # applied with the next deployment
+        self.assertEqual(self.patches(), [])
+        self.assertFalse(Deployment.objects.exists())
+
+    def test_custom_domains(self):
+        url = reverse("custom-domain", kwargs={"app_uuid": self.app.uuid})
+        payload = {"custom_domains": [{"domain": "www.example.com"}]}
+        response = self.client.post(url, payload, format="json")
+        self.assertEqual(response.status_code, 200)
+        (patch,) = self.patches()
+        ingresses = self.values(patch)["ingresses"]
+        self.assertEqual(
+            set(ingresses),
+            {"project-web-web.example.com", "www.example.com", "old.example.com"},
+        )
+        self.assertIsNone(ingresses["old.example.com"])
+        self.assertEqual(ingresses["www.example.com"]["name"], "www.example.com")
+        self.assertEqual(
+            Deployment.objects.get().params, {"custom_domains": ["www.example.com"]}
+        )
+
+    def test_app_not_ready(self):
+        self.app.status = "created"
+        self.app.save()
+        CustomDomain.objects.create(app=self.app, domain="www.example.com")
+        url = reverse("custom-domain", kwargs={"app_uuid": self.app.uuid})
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        url = reverse("liveness-probe", kwargs={"uuid": self.app.uuid})
+        self.client.patch(url, {"liveness_probe": False}, format="json")
+        self.assertEqual(self.server.requests, [])
+        self.assertFalse(Deployment.objects.exists())
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import threading
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from shapeblock.apps import pod_logs
+from shapeblock.apps.consumers import PodLogConsumer
+from shapeblock.apps.pod_logs import PodLogHub, follow_pod_log
+from shapeblock.utils import kubernetes
+from shapeblock.utils.testing import FakeAPIServer, make_app
+
+LOG_PATH = r"/api/v1/namespaces/(?P<ns>[^/]+)/pods/(?P<pod>[^/]+)/log"
+
+
+class FakeClusterMixin:
+    def setUp(self):
+        super().setUp()
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url, KUBE_TOKEN="fake-token"
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+
+    def tearDown(self):
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def serve_logs(self, release=None):
+        def logs(request, ns, pod):
+            if release is not None:
+                release.wait(5)
+            return 200, "".join(f"{pod} line {i}\n" for i in range(3))
+
+        self.server.route("GET", LOG_PATH, logs)
+
+
+class FollowPodLogTestCase(FakeClusterMixin, SimpleTestCase):
+    async def test_follow(self):
+        self.serve_logs()
+        lines = [line async for line in follow_pod_log("demo", "web-0")]
+        self.assertEqual(lines, ["web-0 line 0", "web-0 line 1", "web-0 line 2"])
+        request = self.server.requests[0]
+        self.assertEqual(request.path, "/api/v1/namespaces/demo/pods/web-0/log")
+        self.assertEqual(request.query, {"follow": "True", "sinceSeconds": "300"})
+        self.assertEqual(request.headers["Authorization"], "Bearer fake-token")
+
+    async def test_error_status(self):
+        with self.assertRaises(pod_logs.PodLogError):
+            async for _ in follow_pod_log("demo", "missing"):
+                pass
+
+
+class PodLogHubTestCase(FakeClusterMixin, SimpleTestCase):
+    async def test_fan_out(self):
+        release = threading.Event()
+        self.serve_logs(release)
+        hub = PodLogHub()
+        async with hub.subscribe("demo", "web-0") as first:
+            async with hub.subscribe("demo", "web-0") as second:
+                self.assertEqual(hub.viewer_count("demo", "web-0"), 2)
+                release.set()
+                for frames in (first, second):
+                    # all three lines arrive in a single frame
+                    self.assertEqual(
+                        await asyncio.wait_for(frames.get(), 5),
+                        ["web-0 line 0", "web-0 line 1", "web-0 line 2"],
+                    )
+                    self.assertIsNone(await asyncio.wait_for(frames.get(), 5))
+        # one upstream request served both viewers
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(hub.viewer_count("demo", "web-0"), 0)
+
+    async def test_last_viewer_cancels_stream(self):
+        release = threading.Event()
+        self.serve_logs(release)
+        hub = PodLogHub()
+        async with hub.subscribe("demo", "web-0"):
+            await asyncio.sleep(0.05)
+            stream = hub._streams[("demo", "web-0")]
+        await asyncio.sleep(0)
+        self.assertTrue(stream.cancelled() or stream.done())
+        self.assertEqual(hub._streams, {})
+        release.set()
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class PodLogConsumerTestCase(FakeClusterMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = make_app("web")
+        pods = {
+            "kind": "PodList",
+            "apiVersion": "v1",
+            "metadata": {},
+            "items": [
+                {"metadata": {"name": name, "namespace": "project-web"}}
+                for name in ("web-b", "web-a")
+            ],
+        }
+        self.server.route("GET", r"/api/v1/namespaces/project-web/pods", (200, pods))
+        self.serve_logs()
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from(timeout=5))
+
+    def communicator(self, query="", user=None):
+        communicator = WebsocketCommunicator(
+            PodLogConsumer.as_asgi(), f"/ws/pod-logs/{self.app.uuid}/{query}"
+        )
+        communicator.scope["url_route"] = {"kwargs": {"app_uuid": str(self.app.uuid)}}
+        communicator.scope["user"] = user or self.app.user
+        return communicator
+
+    async def test_anonymous_rejected(self):
+        communicator = self.communicator(user=AnonymousUser())
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+        self.assertEqual(self.server.requests, [])
+
+    async def test_other_users_app_rejected(self):
+        other = await database_sync_to_async(get_user_model().objects.create_user)(
+            username="other", password="secret"
+        )
+        connected, code = await self.communicator(user=other).connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4004)
+        self.assertEqual(self.server.requests, [])
+
+    async def test_pod_selection(self):
+        communicator = self.communicator("?pod=web-b")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await self.receive(communicator), {"pods": ["web-a", "web-b"]})
+        self.assertEqual(
+            await self.receive(communicator),
+            {"pod": "web-b", "message": "web-b line 0\nweb-b line 1\nweb-b line 2\n"},
+        )
+        self.assertEqual(
+            await self.receive(communicator), {"pod": "web-b", "ended": True}
+        )
+
+        await communicator.send_to(text_data=json.dumps({"pods": ["web-a", "nope"]}))
+        self.assertEqual((await self.receive(communicator))["pod"], "web-a")
+        await communicator.disconnect()
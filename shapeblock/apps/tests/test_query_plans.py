@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+
+from shapeblock.apps.models import App
+from shapeblock.apps.serializers import AppSerializer
+from shapeblock.deployments.models import Deployment
+from shapeblock.utils.testing import make_app
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    The hot lookups use an index on a realistically sized table.
+    """
+
+    apps = 100
+    deployments_per_app = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.app = make_app("web", webhook_id=42)
+        user, project = cls.app.user, cls.app.project
+        apps = App.objects.bulk_create(
+            App(
+                name=f"app-{i}",
+                user=user,
+                project=project,
+                stack="php",
+                repo=f"https://github.com/shapeblock/app-{i}.git",
+                sb_yml={},
+                webhook_id=i if i % 10 == 0 else None,
+            )
+            for i in range(cls.apps - 1)
+        )
+        statuses = ["success", "failed", "success", "success", "cancelled"]
+        Deployment.objects.bulk_create(
+            (
+                Deployment(
+                    user=user,
+                    app=app,
+                    status=statuses[i % len(statuses)],
+                    type="code" if i % 3 else "config",
+                    ref="a" * 40,
+                )
+                for app in [cls.app, *apps]
+                for i in range(cls.deployments_per_app)
+            ),
+            batch_size=5000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, *indexes):
+        plan = queryset.explain()
+        if connection.vendor == "sqlite":
+            self.assertNotRegex(plan, r"SCAN \w+$|SCAN \w+\n", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+        else:
+            self.assertNotIn("Seq Scan", plan)
+            self.assertNotRegex(plan, r"(?m)^\s*(->\s*)?Sort\b")
+        if indexes:
+            self.assertRegex(plan, "|".join(indexes))
+
+    def test_webhook_lookup(self):
+        self.assertUsesIndex(
+            App.objects.filter(webhook_id=42)[:1], "app_webhook_id_idx"
+        )
+
+    def test_name_lookup(self):
+        self.assertUsesIndex(App.objects.filter(project=self.app.project, name="web"))
+
+    def test_latest_deployment(self):
+        self.assertUsesIndex(
+            Deployment.objects.filter(app=self.app).order_by("-created_at")[:1],
+            "deployment_app_latest_idx",
+        )
+
+    def test_latest_successful_deployment(self):
+        queryset = Deployment.objects.filter(
+            app=self.app, type__in=["code", "config"], status="success"
+        ).order_by("-created_at")[:1]
+        self.assertUsesIndex(
+            queryset, "deployment_app_success_idx", "deployment_app_latest_idx"
+        )
+
+    def test_pushed_apps(self):
+        self.assertUsesIndex(
+            App.objects.filter(repo_full_name="shapeblock/app-1", ref="main")
+        )
+
+
+class AppNameConstraintTestCase(TestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        request = SimpleNamespace(user=self.app.user)
+        request.user.github_token = None
+        self.context = {"request": request}
+
+    @mock.patch(
+        "shapeblock.apps.serializers.validate_github_repo_and_branch",
+        side_effect=lambda repo, ref, token: repo,
+    )
+    def test_duplicate_name(self, validate_github_repo_and_branch):
+        data = {
+            "project": self.app.project.pk,
+            "name": "web",
+            "stack": "php",
+            "repo": "https://github.com/shapeblock/web.git",
+            "ref": "main",
+        }
+        serializer = AppSerializer(data=data, context=self.context)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with mock.patch.object(App, "get_sb_yml", return_value={"name": "web"}):
+            with self.assertRaisesMessage(Exception, "already exists in project"):
+                serializer.save()
+            self.assertEqual(App.objects.count(), 1)
+
+            serializer = AppSerializer(
+                data={**data, "name": "api"}, context=self.context
+            )
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(serializer.save().name, "api")
@@ -0,0 +1,116 @@
+import base64
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from shapeblock.apps.models import InvalidSBYml
+from shapeblock.apps.sb_yml import load_sb_yml
+from shapeblock.utils.testing import make_app
+from .test_github_client import FakeGithubMixin
+
+SB_YML = "name: web\ntype: php\nversion: '8.1'\n"
+
+
+class FakeRepoContentsMixin(FakeGithubMixin):
+    """
+    Serves `self.files`, a dict of path to content, as the repo's tree at
+    every commit.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.files = {".sb.yaml": SB_YML, "app/.sb.yml": SB_YML}
+        self.server.route(
+            "GET", r"/repos/shapeblock/web/contents/(?P<path>.*)", self.contents
+        )
+        self.server.route(
+            "GET", r"/repos/shapeblock/web/git/blobs/(?P<sha>.+)", self.blob
+        )
+
+    def tearDown(self):
+        cache.clear()
+        super().tearDown()
+
+    def contents(self, request, path):
+        prefix = f"{path}/" if path else ""
+        entries = [
+            {"name": name[len(prefix) :], "path": name, "type": "file", "sha": name}
+            for name in self.files
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]
+        ]
+        if not entries:
+            return 404, {"message": "Not Found"}
+        return 200, entries
+
+    def blob(self, request, sha):
+        content = base64.b64encode(self.files[sha].encode()).decode()
+        return 200, {"sha": sha, "content": content, "encoding": "base64"}
+
+    def fetches(self):
+        return [r for r in self.server.requests if "/branches/" not in r.path]
+
+
+class LoadSbYmlTestCase(FakeRepoContentsMixin, SimpleTestCase):
+    def test_cached_per_commit(self):
+        expected = ({"name": "web", "type": "php", "version": "8.1"}, None)
+        self.assertEqual(load_sb_yml("token", "shapeblock/web", "main", ""), expected)
+        # one listing and one blob, both at the resolved commit
+        listing, blob = self.fetches()
+        self.assertEqual(listing.query, {"ref": "a" * 40})
+        self.assertEqual(blob.path, "/repos/shapeblock/web/git/blobs/.sb.yaml")
+
+        self.assertEqual(load_sb_yml("token", "shapeblock/web", "main", ""), expected)
+        self.assertEqual(len(self.fetches()), 2)
+        # the branch is revalidated
+        branch = self.github_requests("/repos/shapeblock/web/branches/main")
+        self.assertEqual(len(branch), 2)
+        self.assertEqual(branch[1].headers["If-None-Match"], "a" * 40)
+
+        # a push is seen at once, and its commit fetched
+        self.head = "b" * 40
+        self.files[".sb.yml"] = SB_YML.replace("8.1", "8.2")
+        data, _ = load_sb_yml("token", "shapeblock/web", "main", "")
+        self.assertEqual(data["version"], "8.2")
+
+    def test_sub_path_and_sha(self):
+        data, errors = load_sb_yml("token", "shapeblock/web", "c" * 40, "app")
+        self.assertEqual(data["name"], "web")
+        self.assertEqual(self.fetches()[0].path, "/repos/shapeblock/web/contents/app")
+        # a SHA needs no resolving
+        self.assertEqual(len(self.fetches()), len(self.server.requests))
+
+    def test_not_found_is_cached(self):
+        for _ in range(2):
+            self.assertEqual(
+                load_sb_yml("token", "shapeblock/web", "main", "missing"), ({}, None)
+            )
+        self.files = {"README.md": "hi"}
+        self.assertEqual(load_sb_yml("token", "shapeblock/web", "main", ""), ({}, None))
+        self.assertEqual(len(self.fetches()), 2)
+
+    def test_invalid_is_cached(self):
+        self.files = {".sb.yml": "name: web\ntype: php\nversion: '5.6'\n"}
+        for _ in range(2):
+            data, errors = load_sb_yml("token", "shapeblock/web", "main", "")
+            self.assertIsNone(data)
+            self.assertTrue(errors)
+        self.assertEqual(len(self.fetches()), 2)
+
+
+class AppSbYmlTestCase(FakeRepoContentsMixin, TestCase):
+    def test_repeated_saves(self):
+        app = make_app("web", sb_yml={})
+        self.assertEqual(app.sb_yml["type"], "php")
+        fetches = len(self.fetches())
+        app.sb_yml = {}
+        app.save()
+        app.save()
+        # only the branch is revalidated
+        self.assertEqual(len(self.fetches()), fetches)
+        self.assertEqual(self.github_requests("/repos/shapeblock/web")[1:], [])
+
+    def test_invalid(self):
+        self.files = {".sb.yml": "name: web\ntype: php\nversion: '5.6'\n"}
+        with self.assertRaises(InvalidSBYml):
+            make_app("web", sb_yml={})
@@ -0,0 +1,57 @@
+from dataclasses import FrozenInstanceError
+
+from django.test import TestCase
+
+from shapeblock.apps.models import (
+    EnvVar,
+    Secret,
+    Volume,
+    BuildVar,
+    InitProcess,
+    WorkerProcess,
+    CustomDomain,
+)
+from shapeblock.apps.snapshot import load_app_snapshot
+from shapeblock.utils.testing import make_app
+
+
+class AppSnapshotTestCase(TestCase):
+    def setUp(self):
+        self.app = make_app("web")
+
+    def add_rows(self, count):
+        start = EnvVar.objects.filter(app=self.app).count()
+        for i in range(start, start + count):
+            EnvVar.objects.create(app=self.app, key=f"ENV_{i}", value=str(i))
+            Secret.objects.create(app=self.app, key=f"SECRET_{i}", value=f"s{i}")
+            BuildVar.objects.create(app=self.app, key=f"BUILD_{i}", value=str(i))
+            Volume.objects.create(
+                app=self.app, name=f"vol-{i}", mount_path=f"/workspace/{i}"
+            )
+            InitProcess.objects.create(app=self.app, key=f"init-{i}")
+            WorkerProcess.objects.create(app=self.app, key=f"worker-{i}")
+            CustomDomain.objects.create(app=self.app, domain=f"d{i}.example.com")
+
+    def test_query_count_is_constant(self):
+        self.add_rows(1)
+        with self.assertNumQueries(8):
+            snapshot = load_app_snapshot(self.app.uuid)
+        self.assertEqual(len(snapshot.secrets), 1)
+
+        self.add_rows(50)
+        with self.assertNumQueries(8):
+            snapshot = load_app_snapshot(self.app.uuid)
+        self.assertEqual(len(snapshot.env_vars), 51)
+        self.assertEqual(len(snapshot.workers), 51)
+
+    def test_snapshot_contents(self):
+        self.add_rows(2)
+        snapshot = load_app_snapshot(self.app.uuid)
+        self.assertEqual(snapshot.namespace, self.app.project.name)
+        # secrets are decrypted while loading
+        self.assertEqual([s.value for s in snapshot.secrets], ["s0", "s1"])
+        self.assertEqual(snapshot.volumes[1].mount_path, "/workspace/1")
+        self.assertEqual(snapshot.workers[0].memory, "1Gi")
+        self.assertIsInstance(snapshot.custom_domains, tuple)
+        with self.assertRaises(FrozenInstanceError):
+            snapshot.replicas = 3
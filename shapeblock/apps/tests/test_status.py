@@ -0,0 +1,169 @@
+import json
+import os
+import time
+import unittest
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
+from django.urls import path
+from rest_framework.authtoken.models import Token
+
+from shapeblock.apps.consumers import AppStatusConsumer
+from shapeblock.apps.status import broadcast_app_status, user_group
+from shapeblock.authentication.middleware import TokenAuthMiddleware
+from shapeblock.utils.testing import make_app
+
+application = TokenAuthMiddleware(
+    URLRouter([path("ws/apps/", AppStatusConsumer.as_asgi())])
+)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    APP_STATUS_COALESCE_WINDOW=0.05,
+)
+class AppStatusConsumerTestCase(TestCase):
+    def setUp(self):
+        self.web = make_app("web")
+        self.api = make_app("api", user=self.web.user, project=self.web.project)
+        self.other = make_app("other")
+        self.token = Token.objects.create(user=self.web.user)
+
+    async def connect(self, query="", token=None):
+        token = token or self.token.key
+        communicator = WebsocketCommunicator(
+            application, f"/ws/apps/?token={token}{query}"
+        )
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from(timeout=5))
+
+    async def set_status(self, app, status):
+        app.status = status
+        await database_sync_to_async(app.save)()
+        await sync_to_async(broadcast_app_status)(app)
+
+    async def test_requires_authentication(self):
+        communicator, connected, code = await self.connect(token="invalid")
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+
+    async def test_snapshot_and_coalescing(self):
+        communicator, connected, _ = await self.connect()
+        self.assertTrue(connected)
+        snapshot = await self.receive(communicator)
+        self.assertEqual(snapshot["type"], "snapshot")
+        self.assertEqual([app["name"] for app in snapshot["apps"]], ["web", "api"])
+
+        await self.set_status(self.web, "building")
+        await self.set_status(self.api, "building")
+        await self.set_status(self.web, "ready")
+        await self.set_status(self.other, "ready")
+        frame = await self.receive(communicator)
+        self.assertEqual(frame["type"], "status")
+        self.assertEqual(
+            {app["uuid"]: app["status"] for app in frame["apps"]},
+            {str(self.web.uuid): "ready", str(self.api.uuid): "building"},
+        )
+        # nothing about other users' apps
+        self.assertTrue(await communicator.receive_nothing(0.2))
+
+        await communicator.send_to(text_data=json.dumps({"type": "snapshot"}))
+        snapshot = await self.receive(communicator)
+        self.assertEqual(
+            {app["name"]: app["status"] for app in snapshot["apps"]},
+            {"web": "ready", "api": "building"},
+        )
+        await communicator.disconnect()
+
+    async def test_project_group(self):
+        communicator, connected, _ = await self.connect(
+            f"&project={self.web.project_id}"
+        )
+        self.assertTrue(connected)
+        await self.receive(communicator)
+        await self.set_status(self.api, "ready")
+        frame = await self.receive(communicator)
+        self.assertEqual(frame["apps"][0]["uuid"], str(self.api.uuid))
+        await communicator.disconnect()
+
+        for project in (self.other.project_id, "not-a-uuid"):
+            communicator, connected, code = await self.connect(f"&project={project}")
+            self.assertFalse(connected)
+            self.assertEqual(code, 4004)
+
+    async def test_clients_cannot_broadcast(self):
+        first, _, _ = await self.connect()
+        second, _, _ = await self.connect()
+        await self.receive(first)
+        await self.receive(second)
+        await first.send_to(
+            text_data=json.dumps({"uuid": str(self.web.uuid), "status": "deleted"})
+        )
+        self.assertTrue(await second.receive_nothing(0.2))
+        await first.disconnect()
+        await second.disconnect()
+
+
+@unittest.skipUnless(os.environ.get("SB_BENCHMARK"), "set SB_BENCHMARK=1 to run")
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    APP_STATUS_COALESCE_WINDOW=0.05,
+)
+class AppStatusBroadcastBenchmark(TestCase):
+    users = 50
+    clients_per_user = 4
+    updates_per_user = 20
+
+    def setUp(self):
+        self.apps = [make_app(f"bench-{i}") for i in range(self.users)]
+        self.tokens = [Token.objects.create(user=app.user).key for app in self.apps]
+
+    async def test_throughput(self):
+        clients = []
+        for token in self.tokens:
+            for _ in range(self.clients_per_user):
+                communicator = WebsocketCommunicator(
+                    application, f"/ws/apps/?token={token}"
+                )
+                await communicator.connect()
+                await communicator.receive_from(timeout=10)
+                clients.append(communicator)
+
+        channel_layer = get_channel_layer()
+        start = time.perf_counter()
+        for app in self.apps:
+            for i in range(self.updates_per_user):
+                await channel_layer.group_send(
+                    user_group(app.user_id),
+                    {
+                        "type": "app_status_message",
+                        "data": {"uuid": str(app.uuid), "status": f"s{i}"},
+                    },
+                )
+        elapsed = time.perf_counter() - start
+        frames = 0
+        for communicator in clients:
+            frame = json.loads(await communicator.receive_from(timeout=10))
+            frames += 1
+            while not await communicator.receive_nothing(0.1):
+                frame = json.loads(await communicator.receive_from())
+                frames += 1
+            # the latest status always comes through
+            self.assertEqual(
+                frame["apps"][0]["status"], f"s{self.updates_per_user - 1}"
+            )
+        events = self.users * self.updates_per_user
+        print(
+            f"\n{len(clients)} clients, {events} updates: {frames} frames sent "
+            f"({events * self.clients_per_user / frames:.1f} updates per frame), "
+            f"{events / elapsed:.0f} updates/s published"
+        )
+        for communicator in clients:
+            await communicator.disconnect()
@@ -0,0 +1,243 @@
+import os
+import time
+import unittest
+
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from shapeblock.apps.models import App, EnvVar, Secret, Volume, WorkerProcess
+from shapeblock.utils.testing import make_app
+from .test_github_client import FakeGithubMixin
+
+
+class AppListTestCase(APITestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.user = self.app.user
+        self.client.force_authenticate(self.user)
+        self.url = reverse("app-list")
+
+    def add_apps(self, count):
+        # names are unique per project
+        start = App.objects.count() - 1
+        for i in range(start, start + count):
+            app = make_app(f"app-{i}", user=self.user, project=self.app.project)
+            EnvVar.objects.create(app=app, key="DEBUG", value="1")
+            Secret.objects.create(app=app, key="API_KEY", value=f"key-{i}")
+            Volume.objects.create(app=app, name="data", mount_path="/data")
+            WorkerProcess.objects.create(app=app, key="worker")
+
+    def test_query_count_is_constant(self):
+        self.add_apps(2)
+        with self.assertNumQueries(9):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 3)
+
+        self.add_apps(20)
+        with self.assertNumQueries(9):
+            response = self.client.get(self.url)
+        apps = response.json()
+        self.assertEqual(len(apps), 23)
+        app = next(app for app in apps if app["name"] == "app-0")
+        self.assertEqual(app["secrets"][0]["value"], "key-0")
+        self.assertEqual(app["project"]["uuid"], str(self.app.project.uuid))
+
+    def test_sparse_fieldset(self):
+        self.add_apps(5)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"fields": "uuid,name,status"})
+        self.assertEqual(set(response.json()[0]), {"uuid", "name", "status"})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"fields": "name,domain,workers"})
+        self.assertEqual(set(response.json()[0]), {"name", "domain", "workers"})
+
+    def test_unknown_field(self):
+        response = self.client.get(self.url, {"fields": "name,password"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        self.add_apps(4)
+        response = self.client.get(self.url, {"page_size": 2, "fields": "name"})
+        page = response.json()
+        self.assertEqual(len(page["results"]), 2)
+        names = [app["name"] for app in page["results"]]
+        while page["next"]:
+            page = self.client.get(page["next"]).json()
+            names += [app["name"] for app in page["results"]]
+        self.assertEqual(len(names), 5)
+        self.assertEqual(len(set(names)), 5)
+
+
+class KeyValPatchTestCase(APITestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.client.force_authenticate(self.app.user)
+
+    def url(self, name):
+        return reverse(name, kwargs={"uuid": self.app.uuid})
+
+    def test_upsert_and_delete(self):
+        old = EnvVar.objects.create(app=self.app, key="OLD", value="1")
+        kept = EnvVar.objects.create(app=self.app, key="KEPT", value="1")
+        renamed = EnvVar.objects.create(app=self.app, key="RENAME_ME", value="1")
+        payload = {
+            "env_vars": [
+                {"id": renamed.id, "key": "RENAMED", "value": "2"},
+                {"key": "KEPT", "value": "3"},
+                {"key": "NEW", "value": ""},
+            ],
+            "delete": ["OLD"],
+        }
+        response = self.client.patch(self.url("app-env-vars"), payload, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(env["key"], env["value"]) for env in response.json()],
+            [("KEPT", "3"), ("RENAMED", "2"), ("NEW", "")],
+        )
+        self.assertEqual(response.json()[0]["id"], kept.id)
+        self.assertIsNotNone(response.json()[2]["id"])
+        self.assertFalse(EnvVar.objects.filter(pk=old.pk).exists())
+        self.assertEqual(
+            dict(EnvVar.objects.filter(app=self.app).values_list("key", "value")),
+            {"KEPT": "3", "RENAMED": "2", "NEW": ""},
+        )
+
+    def test_query_count_is_constant(self):
+        payload = {
+            "secrets": [{"key": f"SECRET_{i}", "value": str(i)} for i in range(100)]
+        }
+        # app, savepoint, rows, insert, release
+        with self.assertNumQueries(5):
+            response = self.client.patch(
+                self.url("app-secrets"), payload, format="json"
+            )
+        self.assertEqual(len(response.json()), 100)
+
+        payload = {
+            "secrets": [
+                {"id": secret["id"], "key": secret["key"], "value": "changed"}
+                for secret in response.json()[:50]
+            ],
+            "delete": [f"SECRET_{i}" for i in range(50, 100)],
+        }
+        # app, savepoint, rows, rows to delete, delete, update, release
+        with self.assertNumQueries(7), self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(
+                self.url("app-secrets"), payload, format="json"
+            )
+        # one config hash refresh, not one per deleted row
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual({secret["value"] for secret in response.json()}, {"changed"})
+        self.assertEqual(Secret.objects.get(key="SECRET_0").value, "changed")
+        self.assertEqual(Secret.objects.filter(app=self.app).count(), 50)
+
+    def test_invalid_payload_changes_nothing(self):
+        EnvVar.objects.create(app=self.app, key="OLD", value="1")
+        payload = {
+            "env_vars": [
+                {"key": "GOOD", "value": "1"},
+                {"key": "not valid", "value": "1"},
+                {"key": "GOOD", "value": "2"},
+            ],
+            "delete": ["OLD"],
+        }
+        response = self.client.patch(self.url("app-env-vars"), payload, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()["errors"]), {"1", "2"})
+        self.assertEqual(
+            list(EnvVar.objects.filter(app=self.app).values_list("key", flat=True)),
+            ["OLD"],
+        )
+
+    def test_id_of_another_app(self):
+        other = make_app("other")
+        env_var = EnvVar.objects.create(app=other, key="OTHER", value="1")
+        payload = {"env_vars": [{"id": env_var.id, "key": "OTHER", "value": "2"}]}
+        response = self.client.patch(self.url("app-env-vars"), payload, format="json")
+        self.assertEqual(response.status_code, 400)
+        env_var.refresh_from_db()
+        self.assertEqual(env_var.value, "1")
+
+    def test_workers_and_volumes(self):
+        WorkerProcess.objects.create(app=self.app, key="queue", memory="2Gi")
+        payload = {"workers": [{"key": "queue", "cpu": "250m"}, {"key": "cron"}]}
+        response = self.client.patch(self.url("worker"), payload, format="json")
+        self.assertEqual(
+            [(w["key"], w["memory"], w["cpu"]) for w in response.json()],
+            [("queue", "2Gi", "250m"), ("cron", "1Gi", "1000m")],
+        )
+
+        payload = {"volumes": [{"name": "data", "mount_path": "/workspace/data"}]}
+        response = self.client.patch(self.url("app-volumes"), payload, format="json")
+        self.assertEqual(response.json()[0]["size"], 2)
+        volume_id = response.json()[0]["id"]
+
+        payload = {
+            "volumes": [
+                {"id": volume_id, "name": "data", "mount_path": "/tmp", "size": "9"}
+            ]
+        }
+        response = self.client.patch(self.url("app-volumes"), payload, format="json")
+        self.assertEqual(set(response.json()["errors"]["0"]), {"mount_path", "size"})
+
+        payload = {"delete": ["data"]}
+        response = self.client.patch(self.url("app-volumes"), payload, format="json")
+        self.assertEqual(response.json(), [])
+        self.assertFalse(Volume.objects.filter(app=self.app).exists())
+
+
+@unittest.skipUnless(os.environ.get("SB_BENCHMARK"), "set SB_BENCHMARK=1 to run")
+class KeyValPatchBenchmark(APITestCase):
+    def test_patch_latency(self):
+        for size in (10, 100, 300, 1000):
+            app = make_app(f"bench-{size}")
+            self.client.force_authenticate(app.user)
+            url = reverse("app-env-vars", kwargs={"uuid": app.uuid})
+            payload = {
+                "env_vars": [{"key": f"ENV_{i}", "value": str(i)} for i in range(size)]
+            }
+            start = time.perf_counter()
+            self.client.patch(url, payload, format="json")
+            create_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            self.client.patch(url, payload, format="json")
+            update_ms = (time.perf_counter() - start) * 1000
+            print(
+                f"\n{size} env vars: create {create_ms:.1f}ms, "
+                f"upsert {update_ms:.1f}ms"
+            )
+
+
+class RepoBranchesViewTestCase(FakeGithubMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = make_app("web")
+        self.client.force_authenticate(self.app.user)
+        self.url = reverse("repo-branches")
+
+    def test_branches(self):
+        response = self.client.get(
+            self.url, {"repo": "https://github.com/shapeblock/web.git"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"branches": ["main"], "next": None})
+        # the app token is used without a personal one
+        self.assertEqual(
+            self.server.requests[0].headers["Authorization"], "token app-token"
+        )
+
+    def test_errors(self):
+        repo = "https://github.com/shapeblock/web.git"
+        for params in (
+            {},
+            {"repo": "https://example.com/a/b"},
+            {"repo": repo, "page": "0"},
+            {"repo": repo, "page": "last"},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            self.url, {"repo": "https://github.com/shapeblock/missing"}
+        )
+        self.assertEqual(response.status_code, 404)
@@ -8,7 +8,10 @@ from shapeblock.apps.views import (
     LivenessProbeView,
     AppScaleView,
 )
-from shapeblock.deployments.views import DeploymentListCreateAPIView
+from shapeblock.deployments.views import (
+    DeploymentListCreateAPIView,
+    DeploymentLogView,
+)
 
 urlpatterns = [
     path(
@@ -21,6 +24,7 @@ urlpatterns = [
         ),
         name="app-list",
     ),
+    path("branches/", views.RepoBranchesView.as_view(), name="repo-branches"),
     path(
         "<uuid:uuid>/",
         views.AppViewSet.as_view(
@@ -46,6 +50,11 @@ urlpatterns = [
         DeploymentListCreateAPIView.as_view(),
         name="deployment-list-create",
     ),
+    path(
+        "<uuid:app_uuid>/deployments/<uuid:deployment_uuid>/log/",
+        DeploymentLogView.as_view(),
+        name="deployment-log",
+    ),
     path(
         "<uuid:app_uuid>/custom-domains/",
         CustomDomainView.as_view(),
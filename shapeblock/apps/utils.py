@@ -1,18 +1,24 @@
 import logging
 import base64
+import hashlib
+import hmac
+import secrets
 
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import serialization
 
 from shapeblock.apps.git import github
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from .models import EnvVar, App
-from shapeblock.deployments.models import Deployment
-
-from .kubernetes import run_deploy_pipeline
+from shapeblock.deployments.models import Deployment, WebhookDelivery
+from shapeblock.deployments.queue import enqueue_deployment, enqueue_push_deployment
 
 logger = logging.getLogger("django")
 
+# GitHub lists at most this many commits in a push payload
+GITHUB_PUSH_MAX_COMMITS = 2048
+
 
 def create_and_trigger_deployment(app, user, deployment_type="config"):
     # if app status is created and no last deployment exists
@@ -26,7 +32,7 @@ def create_and_trigger_deployment(app, user, deployment_type="config"):
     deployment = Deployment.objects.create(
         user=user, app=app, type=deployment_type, ref=last_deployment.ref
     )
-    run_deploy_pipeline(deployment)
+    enqueue_deployment(deployment)
     app.status = "building"
     app.save()
 
@@ -147,9 +153,11 @@ def add_github_webhook(app: App):
         return
     if protocol != "git":
         return
+    webhook_secret = secrets.token_hex(32)
     webhook_config = {
         "url": f"https://sb.{settings.CLUSTER_DOMAIN}/webhook/",
         "content_type": "json",
+        "secret": webhook_secret,
     }
     hook = repo.create_hook(
         name="web", config=webhook_config, events=["push"], active=True
@@ -158,40 +166,139 @@ def add_github_webhook(app: App):
     logger.info(f"Webhook created with id: {hook.id} for app {app.name}.")
     app.autodeploy = True
     app.webhook_id = hook.id
+    app.webhook_secret = webhook_secret
     app.save()
 
 
-def trigger_deploy_from_github_webhook(request_headers, body):
+def verify_webhook_signature(secret, raw_body, signature) -> bool:
+    """
+    Check a delivery's `X-Hub-Signature-256` header against the hook's secret.
+    """
+    if not signature or not signature.startswith("sha256="):
+        return False
+    digest = hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, f"sha256={digest}")
+
+
+def trigger_deploy_from_github_webhook(request_headers, body, raw_body=b""):
     github_hook_id = request_headers.get("X-GitHub-Hook-ID")
     if not github_hook_id:
         return
     webhook_event = request_headers.get("X-GitHub-Event")
     if webhook_event != "push":
         return
-    try:
-        app = App.objects.get(webhook_id=github_hook_id)
-    except App.DoesNotExist:
+    # unordered, so the lookup is served by `app_webhook_id_idx` alone
+    hook_apps = list(App.objects.filter(webhook_id=github_hook_id)[:1])
+    if not hook_apps:
         logger.error(f"App with {github_hook_id} doesn't exist.")
         return
-    if not app.autodeploy:
+    hook_app = hook_apps[0]
+    signed = bool(hook_app.webhook_secret)
+    if signed and not verify_webhook_signature(
+        hook_app.webhook_secret,
+        raw_body,
+        request_headers.get("X-Hub-Signature-256"),
+    ):
+        logger.warning(f"Invalid signature for webhook {github_hook_id}, dropping.")
         return
-    fullname_ref = body.get("ref")
-    ref = fullname_ref.split("/")[-1]
-    if app.ref != ref:
-        logger.info(
-            f"Webhook ref {ref} doesn't match the ref '{app.ref}' configured in app."
-        )
+    fullname_ref = body.get("ref") or ""
+    if not fullname_ref.startswith("refs/heads/"):
         return
+    ref = fullname_ref[len("refs/heads/") :]
     delivery_id = request_headers.get("X-GitHub-Delivery")
-    sha = body.get("after")
-    if sha:
+    # recorded with the deployments it queues, a failure rolls it back so
+    # GitHub's redelivery isn't dropped
+    with transaction.atomic():
+        if delivery_id and not record_webhook_delivery(delivery_id, hook_app):
+            logger.info(f"Dropping redelivered webhook {delivery_id}.")
+            return
+        sha = body.get("after")
+        # a deleted branch has no commit to deploy
+        if not sha or not sha.strip("0"):
+            return
+        # every app of the hook's owner built from its repo and branch, e.g. the
+        # services of a monorepo; the payload's repository isn't trusted
+        apps = App.objects.filter(
+            user_id=hook_app.user_id,
+            repo_full_name=hook_app.repo_full_name,
+            ref=ref,
+            autodeploy=True,
+        ).select_related("user")
+        if not signed:
+            # hooks created before deliveries were signed only deploy their own app
+            apps = apps.filter(pk=hook_app.pk)
+        changed_paths = get_changed_paths(body)
+        for app in apps:
+            if changed_paths is not None and not paths_under(
+                changed_paths, app.sub_path
+            ):
+                logger.info(f"Push {sha} doesn't change app {app.name}, skipping.")
+                continue
+            if deploy_pushed_commit(app, sha):
+                logger.info(
+                    f"Triggering deployment for webhook {delivery_id} in app {app.name}."
+                )
+
+
+def get_changed_paths(body):
+    """
+    The files changed by a push, or None when the payload doesn't list all of
+    them: a new branch, a force push or more commits than GitHub includes.
+    """
+    commits = body.get("commits") or []
+    if body.get("created") or body.get("forced") or not commits:
+        return None
+    if len(commits) >= GITHUB_PUSH_MAX_COMMITS:
+        return None
+    paths = set()
+    for commit in commits:
+        for key in ("added", "removed", "modified"):
+            paths.update(commit.get(key) or [])
+    return paths
+
+
+def paths_under(paths, sub_path) -> bool:
+    sub_path = (sub_path or "").strip("/")
+    if not sub_path:
+        return True
+    return any(path == sub_path or path.startswith(f"{sub_path}/") for path in paths)
+
+
+def deploy_pushed_commit(app, sha) -> bool:
+    """
+    Queue a deployment of `sha` unless one is already pending, as with several
+    apps sharing a repo every app's hook delivers the same push.
+    """
+    with transaction.atomic():
+        list(
+            App.objects.select_for_update()
+            .filter(pk=app.pk)
+            .values_list("pk", flat=True)
+        )
+        pending = Deployment.objects.filter(
+            app=app, type="code", ref=sha, status="running"
+        )
+        if pending.exists():
+            return False
         deployment = Deployment.objects.create(
             user=app.user, app=app, type="code", ref=sha
         )
-        run_deploy_pipeline(deployment)
-        app.status = "building"
-        app.save()
-    logger.info(f"Triggering deployment for webhook {delivery_id} in app {app.name}.")
+        enqueue_push_deployment(deployment)
+        App.objects.filter(pk=app.pk).update(status="building")
+    return True
+
+
+def record_webhook_delivery(delivery_id, app) -> bool:
+    """
+    Remember a webhook delivery. Returns False if it has been seen before.
+    Old deliveries are removed by `manage.py prune_webhook_deliveries`.
+    """
+    try:
+        with transaction.atomic():
+            WebhookDelivery.objects.create(delivery_id=delivery_id, app=app)
+    except IntegrityError:
+        return False
+    return True
 
 
 def get_kubeconfig():
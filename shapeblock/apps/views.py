@@ -6,10 +6,14 @@ from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponse
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.conf import settings
 
 from .models import (
     App,
@@ -22,6 +26,7 @@ from .models import (
     WorkerProcess,
 )
 from .serializers import (
+    extract_github_org_repo,
     AppSerializer,
     EnvVarSerializer,
     BuildVarSerializer,
@@ -32,20 +37,37 @@ from .serializers import (
     InitProcessSerializer,
     WorkerProcessSerializer,
 )
-from rest_framework.permissions import IsAuthenticated
-from .kubernetes import delete_app_task, create_app_secret, run_deploy_pipeline
-from .kubernetes import delete_app_task, get_app_pod
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from .kubernetes import delete_app_task, create_app_secret
+from .kubernetes import delete_app_task, get_app_pod, patch_app
 from .utils import (
     get_kubeconfig,
     add_github_deploy_key,
     add_github_webhook,
     trigger_deploy_from_github_webhook,
 )
+from .config_hash import defer_config_hash_refresh, schedule_config_hash_refresh
+from .git import github
+from .git.github_client import cache_stats
+from github import GithubException
 from shapeblock.deployments.models import Deployment
+from shapeblock.deployments.queue import enqueue_deployment
 
 logger = logging.getLogger("django")
 
 
+class AppCursorPagination(CursorPagination):
+    """
+    Opt-in pagination for the app list, e.g. `?page_size=100`.
+    Without a page size the full list is returned, as before.
+    """
+
+    page_size = None
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = "-created_at"
+
+
 class AppViewSet(viewsets.GenericViewSet):
     """
     A viewset that provides `create`, `retrieve`, and `delete` actions for all provider types.
@@ -53,6 +75,7 @@ class AppViewSet(viewsets.GenericViewSet):
 
     serializer_class = AppSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = AppCursorPagination
 
     def get_queryset(self):
         return App.objects.all()
@@ -81,8 +104,24 @@ class AppViewSet(viewsets.GenericViewSet):
         create_app_secret(app)
 
     def list(self, request, *args, **kwargs):
-        apps = App.objects.filter(user=request.user)
-        serializer = AppReadSerializer(apps, many=True)
+        fields = None
+        if request.query_params.get("fields"):
+            # sparse fieldset, e.g. `?fields=uuid,name,status`
+            fields = request.query_params["fields"].split(",")
+            unknown = set(fields) - set(AppReadSerializer.Meta.fields)
+            if unknown:
+                return Response(
+                    {"fields": f"Unknown fields: {', '.join(sorted(unknown))}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        apps = AppReadSerializer.setup_eager_loading(
+            App.objects.filter(user=request.user), fields
+        )
+        page = self.paginate_queryset(apps)
+        if page is not None:
+            serializer = AppReadSerializer(page, many=True, fields=fields)
+            return self.get_paginated_response(serializer.data)
+        serializer = AppReadSerializer(apps, many=True, fields=fields)
         return Response(serializer.data)
 
     def retrieve(self, request, uuid=None, *args, **kwargs):
@@ -110,18 +149,25 @@ class AppScaleView(APIView):
             return Response("app is building, cannot scale", status=400)
 
         replicas = request.data.get("replicas")
-        if replicas:
-            app.replicas = int(replicas)
-            deployment = Deployment.objects.create(
-                user=request.user,
-                app=app,
-                type="config",
-            )
-            app.status = "building"
-            app.save()
-            run_deploy_pipeline(deployment)
+        if not replicas:
+            serializer = AppReadSerializer(app)
+            return Response(serializer.data)
+        app.replicas = int(replicas)
+        if app.status == "ready":
+            app.save(update_fields=["replicas"])
+            if patch_app(app, request.user, "scale", {"replicas": app.replicas}):
+                serializer = AppReadSerializer(app)
+                return Response(serializer.data)
+        deployment = Deployment.objects.create(
+            user=request.user,
+            app=app,
+            type="config",
+        )
+        app.status = "building"
+        app.save()
+        enqueue_deployment(deployment)
         serializer = AppReadSerializer(app)
-        return Response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
 
 class LivenessProbeView(APIView):
@@ -145,6 +191,10 @@ class LivenessProbeView(APIView):
             )
         app.has_liveness_probe = has_liveness_probe
         app.save()
+        if app.status == "ready":
+            # otherwise applied with the next deployment
+            params = {"has_liveness_probe": has_liveness_probe}
+            patch_app(app, request.user, "liveness_probe", params)
         serializer = AppReadSerializer(app)
         return Response(serializer.data)
 
@@ -186,6 +236,10 @@ class KeyValAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     key_name = "key"
+    # fields taken from the payload besides the key
+    value_fields = ("value",)
+    # fields new rows are upserted on, None if rows with the same key can coexist
+    unique_fields = ("key", "app")
 
     def get(self, request, uuid):
         try:
@@ -222,8 +276,8 @@ class KeyValAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         # Validate that no key is found in both lists
-        update_keys = [kv[self.key_name] for kv in kvs_to_update]
-        if any(key in keys_to_delete for key in update_keys):
+        update_keys = {kv.get(self.key_name) for kv in kvs_to_update}
+        if update_keys.intersection(keys_to_delete):
             return Response(
                 {
                     "detail": "The same key cannot be present in both update and delete lists."
@@ -231,31 +285,148 @@ class KeyValAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        model_class = self.model_class
-        # Process deletions
-        for key in keys_to_delete:
-            model_class.objects.filter(app=app, key=key).delete()
+        # Validate every row before touching the database
+        cleaned, errors = self.validate(kvs_to_update)
+        if errors:
+            return Response(
+                {"detail": f"Invalid {entity_key}.", "errors": errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        # Process updates and creations
-        self.update(app, kvs_to_update)
+        try:
+            with transaction.atomic():
+                rows = self.apply(app, cleaned, keys_to_delete)
+                # bulk writes don't send the signals that keep the hash current
+                schedule_config_hash_refresh(app.pk)
+        except self.model_class.DoesNotExist as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError as e:
+            logger.info(f"Unable to update {entity_key} of app {app.name}: {e}")
+            return Response(
+                {"detail": f"Conflicting {entity_key} in payload."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        # Prepare the response
+        # Prepare the response from the rows we already hold
         serializer_class = self.serializer_class
-        updated_vars = model_class.objects.filter(app=app)
-        serializer = serializer_class(updated_vars, many=True)
+        serializer = serializer_class(rows, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    def update(self, app, kvs):
-        for kv in kvs:
-            if kv.get("id"):
-                self.model_class.objects.filter(id=kv["id"]).update(
-                    value=kv["value"], app=app, key=kv["key"]
-                )
+    def row_fields(self, kv):
+        fields = {self.key_name: kv.get(self.key_name)}
+        for name in self.value_fields:
+            if name in kv:
+                fields[name] = kv[name]
+        return fields
+
+    def validate(self, kvs):
+        """
+        Run the model field validators on every row. Returns the cleaned
+        `(id, fields)` of each row, and any errors by row index.
+        """
+        cleaned = []
+        errors = {}
+        seen = set()
+        for index, kv in enumerate(kvs):
+            row_errors = {}
+            fields = self.row_fields(kv)
+            key = fields[self.key_name]
+            if key in seen:
+                row_errors[self.key_name] = [f'Duplicate {self.key_name} "{key}".']
+            seen.add(key)
+            if kv.get("id") is not None and not str(kv["id"]).isdigit():
+                row_errors["id"] = ["A valid integer is required."]
+            for name in self.value_fields:
+                field = self.model_class._meta.get_field(name)
+                if name not in fields and not field.has_default():
+                    row_errors[name] = ["This field is required."]
+            row = self.model_class(**fields)
+            try:
+                row.clean_fields(exclude=["app"])
+            except ValidationError as e:
+                for name, field_errors in e.error_dict.items():
+                    # empty env var, secret and build var values have always
+                    # been accepted
+                    if name == "value":
+                        field_errors = [
+                            error for error in field_errors if error.code != "blank"
+                        ]
+                    messages = [m for error in field_errors for m in error.messages]
+                    if messages:
+                        row_errors.setdefault(name, []).extend(messages)
+            if row_errors:
+                errors[index] = row_errors
+                continue
+            row_id = int(kv["id"]) if kv.get("id") is not None else None
+            cleaned.append((row_id, {name: getattr(row, name) for name in fields}))
+        return cleaned, errors
+
+    def apply(self, app, cleaned, keys_to_delete):
+        """
+        Apply deletions, updates and creations in a fixed number of queries and
+        return the resulting rows of the app.
+        """
+        model_class = self.model_class
+        key_name = self.key_name
+        rows = {
+            row.pk: row
+            for row in model_class.objects.select_for_update().filter(app=app)
+        }
+
+        if keys_to_delete:
+            # the config hash is refreshed once by the caller, not per row
+            with defer_config_hash_refresh():
+                model_class.objects.filter(
+                    app=app, **{f"{key_name}__in": keys_to_delete}
+                ).delete()
+            rows = {
+                pk: row
+                for pk, row in rows.items()
+                if getattr(row, key_name) not in keys_to_delete
+            }
+
+        by_key = {getattr(row, key_name): row for row in rows.values()}
+        to_update = []
+        to_create = []
+        for row_id, fields in cleaned:
+            if row_id is not None:
+                row = rows.get(row_id)
+                if row is None:
+                    raise model_class.DoesNotExist(
+                        f"No {self.entity_key} with id {row_id} in this app."
+                    )
+            elif self.unique_fields:
+                row = by_key.get(fields[key_name])
             else:
-                self.model_class.objects.create(
-                    value=kv["value"], app=app, key=kv["key"]
-                )
+                row = None
+            if row is None:
+                to_create.append(model_class(app=app, **fields))
+                continue
+            for name, value in fields.items():
+                setattr(row, name, value)
+            to_update.append(row)
+
+        if to_update:
+            # An upsert on the primary key rather than `bulk_update`, whose CASE
+            # expression would get encrypted as is by encrypted fields.
+            model_class.objects.bulk_create(
+                to_update,
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=[key_name, *self.value_fields],
+            )
+        if to_create and self.unique_fields:
+            model_class.objects.bulk_create(
+                to_create,
+                update_conflicts=True,
+                unique_fields=self.unique_fields,
+                update_fields=self.value_fields or [key_name],
+            )
+        elif to_create:
+            model_class.objects.bulk_create(to_create)
+
+        return sorted([*rows.values(), *to_create], key=lambda row: row.pk)
 
 
 class AppEnvVarAPIView(KeyValAPIView):
@@ -281,21 +452,7 @@ class InitProcessView(KeyValAPIView):
     serializer_class = InitProcessSerializer
     entity_key = "init_processes"
     key_name = "key"
-
-    def update(self, app, kvs):
-        for kv in kvs:
-            process_id = kv.get("id")
-            key = kv.get("key")
-
-            if process_id:
-                self.model_class.objects.filter(id=process_id).update(
-                    key=key,
-                )
-            else:
-                self.model_class.objects.create(
-                    key=key,
-                    app=app,
-                )
+    value_fields = ()
 
 
 class WorkerProcessView(KeyValAPIView):
@@ -303,25 +460,7 @@ class WorkerProcessView(KeyValAPIView):
     serializer_class = WorkerProcessSerializer
     entity_key = "workers"
     key_name = "key"
-
-    def update(self, app, kvs):
-        for kv in kvs:
-            process_id = kv.get("id")
-            key = kv.get("key")
-            memory = kv.get("memory")
-            cpu = kv.get("cpu")
-
-            if process_id:
-                worker = self.model_class.objects.filter(id=process_id)
-            else:
-                worker = self.model_class()
-                worker.app = app
-            worker.key = key
-            if memory:
-                worker.memory = memory
-            if cpu:
-                worker.cpu = cpu
-            worker.save()
+    value_fields = ("memory", "cpu")
 
 
 class VolumesAPIView(KeyValAPIView):
@@ -329,22 +468,9 @@ class VolumesAPIView(KeyValAPIView):
     serializer_class = VolumeSerializer
     entity_key = "volumes"
     key_name = "name"
-
-    def update(self, app, kvs):
-        for kv in kvs:
-            volume_id = kv.get("id")
-            name = kv.get("name")
-            mount_path = kv.get("mount_path")
-            size = kv.get("size")
-
-            if volume_id:
-                self.model_class.objects.filter(id=volume_id).update(
-                    mount_path=mount_path, size=size, app=app, name=name
-                )
-            else:
-                self.model_class.objects.create(
-                    mount_path=mount_path, size=size, app=app, name=name
-                )
+    value_fields = ("mount_path", "size")
+    # several volumes may share a name, new ones are always created
+    unique_fields = None
 
 
 class ShellInfoView(APIView):
@@ -407,13 +533,69 @@ class CustomDomainView(APIView):
         # Serialize and return updated custom domains
         custom_domains = CustomDomain.objects.filter(app=app)
         serializer = CustomDomainSerializer(custom_domains, many=True)
+        if custom_domains_data or delete_domains_data:
+            self.patch_domains(request, app, [d["domain"] for d in serializer.data])
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def delete(self, request, app_uuid):
         app = get_object_or_404(App, uuid=app_uuid)
         CustomDomain.objects.filter(app=app).delete()
+        self.patch_domains(request, app, [])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def patch_domains(self, request, app, domains):
+        if app.status == "ready":
+            # otherwise applied with the next deployment
+            patch_app(app, request.user, "custom_domains", {"custom_domains": domains})
+
+
+class RepoBranchesView(APIView):
+    """
+    Branches of a GitHub repo for the branch picker, a page at a time,
+    e.g. `?repo=https://github.com/org/repo&prefix=feature/&page=2`.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            repo_path = extract_github_org_repo(request.query_params.get("repo", ""))
+            page = int(request.query_params.get("page", 1))
+        except (ValidationError, ValueError):
+            return Response(
+                {"detail": "A GitHub repo URL and a valid page are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if page < 1:
+            return Response(
+                {"detail": "page must be at least 1."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        token = request.user.github_token or settings.GITHUB_TOKEN
+        prefix = request.query_params.get("prefix", "")
+        try:
+            branches, has_next = github.get_branches(token, repo_path, prefix, page)
+        except GithubException as e:
+            if e.status == 404:
+                return Response({"detail": "Repo not found."}, status=404)
+            return Response(
+                {"detail": f"GitHub API Error: {e}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            {
+                "branches": branches,
+                "next": page + 1 if has_next else None,
+            }
+        )
+
+
+class GithubCacheView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache_stats())
+
 
 @require_POST
 @csrf_exempt
@@ -426,9 +608,9 @@ def webhook_view(request):
         # Log the payload
         logger.info("Webhook received: %s", delivery_id)
 
-        trigger_deploy_from_github_webhook(request.headers, payload)
-        # Return success response
-        return JsonResponse({"status": "success"})
+        trigger_deploy_from_github_webhook(request.headers, payload, request.body)
+        # Deployments run on the worker queue, nothing has been deployed yet.
+        return JsonResponse({"status": "accepted"}, status=202)
     except json.JSONDecodeError as e:
         # Log the error
         logger.error("Invalid JSON received: %s", e)
@@ -7,12 +7,16 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shapeblock.settings")
 django_asgi_app = get_asgi_application()
 
 import shapeblock.routing
+from shapeblock.authentication.middleware import TokenAuthMiddleware
+from shapeblock.utils import watch_cache
+
+watch_cache.start()
 
 application = ProtocolTypeRouter(
     {
         "http": django_asgi_app,
         "websocket": AuthMiddlewareStack(
-            URLRouter(shapeblock.routing.websocket_urlpatterns)
+            TokenAuthMiddleware(URLRouter(shapeblock.routing.websocket_urlpatterns))
         ),
     }
 )
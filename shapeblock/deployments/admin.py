@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Deployment
+from .models import Deployment, DeploymentJob, DeploymentLogChunk, WebhookDelivery
 
 
 @admin.register(Deployment)
@@ -10,3 +10,25 @@ class DeploymentAdmin(admin.ModelAdmin):
 
     def project(self, obj):
         return obj.app.project
+
+
+@admin.register(DeploymentJob)
+class DeploymentJobAdmin(admin.ModelAdmin):
+    list_display = ["created_at", "app", "status", "attempts", "run_after"]
+    list_filter = ["status"]
+
+    ordering = ("-created_at",)
+
+
+@admin.register(DeploymentLogChunk)
+class DeploymentLogChunkAdmin(admin.ModelAdmin):
+    list_display = ["deployment", "seq", "offset", "size", "created_at"]
+
+    ordering = ("-created_at",)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ["delivery_id", "app", "received_at"]
+
+    ordering = ("-received_at",)
@@ -0,0 +1,168 @@
+"""
+Status and log events reported by the operator while it runs a deployment.
+
+The operator can send the events of many deployments in one request. They are
+applied in one transaction: every deployment gets at most one new log chunk
+and one row update, and its websocket group one message with the merged log
+once the transaction commits.
+
+Events carrying a `seq`, increasing per deployment, are applied at most once:
+one whose `seq` isn't above the deployment's `callback_seq` is a redelivery and
+is skipped. Events without one are always applied. Once a deployment isn't
+running anymore, its later events are dropped.
+
+`finish_deployments` does the same for the results the status controller
+observes in the cluster.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from shapeblock.apps.models import App
+from shapeblock.apps.status import broadcast_app_status
+from .models import Deployment, DeploymentLogChunk
+
+logger = logging.getLogger("django")
+
+# the app's status once a deployment has finished
+FINISHED_APP_STATUS = {"success": "ready", "failed": "created"}
+
+
+def apply_events(events: List[Dict]) -> Dict[str, int]:
+    """
+    Apply events, dicts with `deployment_uuid`, `status` and `logs`, and
+    optionally `pod` and `seq`. Returns the numbers of applied and skipped
+    events.
+    """
+    by_deployment = defaultdict(list)
+    for event in events:
+        by_deployment[event["deployment_uuid"]].append(event)
+
+    applied = 0
+    updated, chunks, messages = [], [], []
+    with transaction.atomic():
+        deployments = (
+            Deployment.objects.select_for_update(of=("self",))
+            .select_related("app")
+            .filter(uuid__in=by_deployment)
+            # a fixed lock order, so concurrent batches can't deadlock
+            .order_by("uuid")
+        )
+        for deployment in deployments:
+            logs, count = [], 0
+            for event in sorted(
+                by_deployment[deployment.uuid], key=lambda e: e.get("seq") or 0
+            ):
+                if deployment.status != "running":
+                    break
+                seq = event.get("seq")
+                if seq is not None:
+                    if seq <= deployment.callback_seq:
+                        continue
+                    deployment.callback_seq = seq
+                deployment.status = event["status"]
+                if event.get("pod"):
+                    deployment.pod = event["pod"]
+                if event["logs"]:
+                    logs.append(event["logs"])
+                count += 1
+            if not count:
+                continue
+            applied += count
+            text = "".join(logs)
+            if text:
+                # the row is locked, so the counters can be used as they are
+                size = len(text.encode("utf-8"))
+                deployment.log_seq += 1
+                chunks.append(
+                    DeploymentLogChunk(
+                        deployment_id=deployment.pk,
+                        seq=deployment.log_seq,
+                        offset=deployment.log_size,
+                        size=size,
+                        data=text,
+                    )
+                )
+                deployment.log_size += size
+            updated.append(deployment)
+            messages.append(
+                (
+                    f"deployment_{deployment.uuid}",
+                    {"log": text, "status": deployment.status},
+                )
+            )
+
+        if updated:
+            Deployment.objects.bulk_update(
+                updated, ["status", "pod", "callback_seq", "log_seq", "log_size"]
+            )
+            DeploymentLogChunk.objects.bulk_create(chunks)
+        finished_apps = update_app_statuses(updated)
+        if messages:
+            transaction.on_commit(lambda: publish(messages, finished_apps))
+    return {"applied": applied, "skipped": len(events) - applied}
+
+
+def finish_deployments(results: Dict[uuid.UUID, str]) -> int:
+    """
+    Finish running deployments with the status, "success" or "failed", they
+    were observed to have in the cluster. Returns the number of deployments
+    updated, the others have finished already.
+    """
+    with transaction.atomic():
+        deployments = list(
+            Deployment.objects.select_for_update(of=("self",))
+            .select_related("app")
+            .filter(uuid__in=results, status="running")
+            .order_by("uuid")
+        )
+        for deployment in deployments:
+            deployment.status = results[deployment.uuid]
+        if deployments:
+            Deployment.objects.bulk_update(deployments, ["status"])
+            finished_apps = update_app_statuses(deployments)
+            messages = [
+                (f"deployment_{d.uuid}", {"log": "", "status": d.status})
+                for d in deployments
+            ]
+            transaction.on_commit(lambda: publish(messages, finished_apps))
+    return len(deployments)
+
+
+def update_app_statuses(deployments: List[Deployment]) -> List[App]:
+    """
+    Update the status of the apps of the finished ones of `deployments`.
+    """
+    finished_apps = []
+    for status, app_status in FINISHED_APP_STATUS.items():
+        apps = [d.app for d in deployments if d.status == status]
+        if apps:
+            App.objects.filter(pk__in=[app.pk for app in apps]).update(
+                status=app_status
+            )
+            for app in apps:
+                app.status = app_status
+            finished_apps.extend(apps)
+    return finished_apps
+
+
+def publish(messages, finished_apps):
+    channel_layer = get_channel_layer()
+
+    async def send():
+        for group, data in messages:
+            await channel_layer.group_send(group, {"type": "deploy_logs", "data": data})
+
+    try:
+        async_to_sync(send)()
+    except Exception as e:
+        # viewers get the rest of the log from the log endpoint
+        logger.warning(f"Unable to push deployment logs: {e}")
+    for app in finished_apps:
+        broadcast_app_status(app)
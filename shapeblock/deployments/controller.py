@@ -0,0 +1,152 @@
+"""
+Deployment and service status from the cluster, so a lost operator callback
+can't leave them running forever.
+
+`StatusController` watches Applications and HelmReleases with informers (see
+`shapeblock.utils.watch_cache`), which resume from the last resourceVersion.
+Every object listed, added or modified is reduced to its result, and the
+results are written in batches every `DEPLOY_STATUS_FLUSH_INTERVAL` seconds:
+running deployments are finished with their apps, and starting services become
+ready. The first list, and every resync, catches up on whatever was missed.
+
+An object has a result once its Ready condition is "True" (success) or "False"
+for a reason other than progressing (failed), for its current generation.
+Applications only have one once their status says which generation it is
+about, as the condition of the previous deployment stays until the operator
+picks up the new one.
+"""
+
+import logging
+import threading
+import uuid
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from shapeblock.services.models import Service
+from shapeblock.utils.kubernetes import custom_objects_api
+from shapeblock.utils.watch_cache import RESOURCES, Informer
+from .callbacks import finish_deployments
+
+logger = logging.getLogger("django")
+
+DEPLOYMENT_UUID_LABEL = "shapeblock.com/deployment-uuid"
+SERVICE_UUID_LABEL = "shapeblock.com/service-uuid"
+# Ready is "False" for these while a release is still being reconciled
+PROGRESSING_REASONS = {"Progressing", "DependencyNotReady", "Reconciling"}
+# uuids per query
+BATCH_SIZE = 500
+
+
+def _list_helmreleases(**kwargs):
+    return custom_objects_api().list_cluster_custom_object(
+        "helm.toolkit.fluxcd.io", "v2beta2", "helmreleases", **kwargs
+    )
+
+
+def observed_result(obj: Dict, require_generation: bool = False) -> Optional[str]:
+    """
+    "success" or "failed" once `obj` has been reconciled, None while it is in
+    progress. With `require_generation`, a status without an observedGeneration
+    counts as in progress.
+    """
+    status = obj.get("status") or {}
+    generation = obj["metadata"].get("generation")
+    for condition in status.get("conditions") or []:
+        if condition.get("type") != "Ready":
+            continue
+        observed = condition.get("observedGeneration", status.get("observedGeneration"))
+        if observed is None and require_generation:
+            return None
+        if generation is not None and observed is not None and observed < generation:
+            # about the previous spec
+            return None
+        if condition.get("status") == "True":
+            return "success"
+        if condition.get("status") == "False":
+            if condition.get("reason") in PROGRESSING_REASONS:
+                return None
+            return "failed"
+    return None
+
+
+def _label_uuid(obj: Dict, label: str) -> Optional[uuid.UUID]:
+    value = (obj["metadata"].get("labels") or {}).get(label)
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class StatusController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deployments: Dict[uuid.UUID, str] = {}
+        self._services: Dict[uuid.UUID, str] = {}
+        self.informers = [
+            Informer(
+                "applications", RESOURCES["applications"], self.observe_application
+            ),
+            Informer("helmreleases", _list_helmreleases, self.observe_helmrelease),
+        ]
+
+    def observe_application(self, obj: Dict):
+        deployment_uuid = _label_uuid(obj, DEPLOYMENT_UUID_LABEL)
+        result = observed_result(obj, require_generation=True)
+        if deployment_uuid is not None and result is not None:
+            with self._lock:
+                self._deployments[deployment_uuid] = result
+
+    def observe_helmrelease(self, obj: Dict):
+        service_uuid = _label_uuid(obj, SERVICE_UUID_LABEL)
+        result = observed_result(obj)
+        if service_uuid is not None and result is not None:
+            with self._lock:
+                self._services[service_uuid] = result
+
+    def flush(self) -> Dict[str, int]:
+        """
+        Write the results observed since the last flush. Returns the number of
+        deployments and services updated.
+        """
+        with self._lock:
+            deployments, self._deployments = self._deployments, {}
+            services, self._services = self._services, {}
+        updated = {"deployments": 0, "services": 0}
+        items = list(deployments.items())
+        for start in range(0, len(items), BATCH_SIZE):
+            updated["deployments"] += finish_deployments(
+                dict(items[start : start + BATCH_SIZE])
+            )
+        ready = [pk for pk, result in services.items() if result == "success"]
+        for start in range(0, len(ready), BATCH_SIZE):
+            updated["services"] += Service.objects.filter(
+                uuid__in=ready[start : start + BATCH_SIZE], status="starting"
+            ).update(status="ready")
+        if any(updated.values()):
+            logger.info(
+                f"Updated {updated['deployments']} deployments and "
+                f"{updated['services']} services from the cluster."
+            )
+        return updated
+
+    def run(self, stop: threading.Event, interval: Optional[float] = None):
+        """
+        Watch and flush every `interval` seconds until `stop` is set.
+        """
+        if interval is None:
+            interval = settings.DEPLOY_STATUS_FLUSH_INTERVAL
+        for informer in self.informers:
+            informer.start()
+        try:
+            while not stop.wait(interval):
+                close_old_connections()
+                try:
+                    self.flush()
+                except Exception:
+                    # the results are observed again on the next resync
+                    logger.exception("Unable to update statuses from the cluster.")
+        finally:
+            for informer in self.informers:
+                informer.stop()
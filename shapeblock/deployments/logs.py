@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Optional, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Deployment, DeploymentLogChunk
+
+logger = logging.getLogger("django")
+
+
+def append_log(deployment: Deployment, text: str) -> Optional[DeploymentLogChunk]:
+    """
+    Append `text` to the deployment's log as a new chunk.
+    Only the deployment's counters are updated, the existing log isn't read.
+    """
+    if not text:
+        return None
+    size = len(text.encode("utf-8"))
+    with transaction.atomic():
+        # the update locks the deployment row until the chunk is written,
+        # so concurrent appends get consecutive sequence numbers
+        Deployment.objects.filter(pk=deployment.pk).update(
+            log_seq=F("log_seq") + 1, log_size=F("log_size") + size
+        )
+        seq, log_size = Deployment.objects.filter(pk=deployment.pk).values_list(
+            "log_seq", "log_size"
+        )[0]
+        chunk = DeploymentLogChunk.objects.create(
+            deployment_id=deployment.pk,
+            seq=seq,
+            offset=log_size - size,
+            size=size,
+            data=text,
+        )
+    deployment.log_seq = seq
+    deployment.log_size = log_size
+    return chunk
+
+
+def get_log(deployment: Deployment) -> str:
+    chunks = DeploymentLogChunk.objects.filter(deployment_id=deployment.pk)
+    return "".join(chunks.order_by("seq").values_list("data", flat=True))
+
+
+def read_log(
+    deployment: Deployment, offset: int = 0, limit: Optional[int] = None
+) -> Tuple[str, int]:
+    """
+    Read up to `limit` bytes of the log starting at byte `offset`.
+    Returns the text and the offset to continue from. The range is narrowed to
+    whole characters, so the text never starts or ends inside one.
+    """
+    chunks = DeploymentLogChunk.objects.filter(deployment_id=deployment.pk)
+    chunks = chunks.annotate(end=F("offset") + F("size")).filter(end__gt=offset)
+    if limit is not None:
+        chunks = chunks.filter(offset__lt=offset + limit)
+    chunks = list(chunks.order_by("offset").values_list("offset", "data"))
+    if not chunks:
+        return "", offset
+
+    start = chunks[0][0]
+    data = "".join(data for _, data in chunks).encode("utf-8")
+    begin = offset - start
+    end = len(data) if limit is None else min(len(data), begin + limit)
+    # step over continuation bytes (0b10xxxxxx) at either end of the range
+    while begin < end and data[begin] & 0xC0 == 0x80:
+        begin += 1
+    while end < len(data) and end > begin and data[end] & 0xC0 == 0x80:
+        end -= 1
+    if end == begin < len(data) and limit:
+        # the limit is smaller than the character at `offset`, return it anyway
+        end += 1
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end += 1
+    return data[begin:end].decode("utf-8"), start + end
+
+
+def compact_log(deployment: Deployment, max_size: Optional[int] = None) -> int:
+    """
+    Merge consecutive chunks of a deployment's log into chunks of up to
+    `max_size` bytes. Merged chunks keep the sequence number of their last
+    chunk, so later appends still get higher ones. Returns the number of chunks
+    removed.
+    """
+    if max_size is None:
+        max_size = settings.DEPLOY_LOG_CHUNK_MAX_SIZE
+    with transaction.atomic():
+        # hold off appends while the chunks are replaced
+        list(
+            Deployment.objects.select_for_update()
+            .filter(pk=deployment.pk)
+            .values_list("pk", flat=True)
+        )
+        chunks = list(
+            DeploymentLogChunk.objects.filter(deployment_id=deployment.pk).order_by(
+                "seq"
+            )
+        )
+        merged = []
+        for chunk in chunks:
+            last = merged[-1] if merged else None
+            if last is not None and last.size + chunk.size <= max_size:
+                last.data += chunk.data
+                last.size += chunk.size
+                last.seq = chunk.seq
+            else:
+                merged.append(
+                    DeploymentLogChunk(
+                        deployment_id=deployment.pk,
+                        seq=chunk.seq,
+                        offset=chunk.offset,
+                        size=chunk.size,
+                        data=chunk.data,
+                    )
+                )
+        removed = len(chunks) - len(merged)
+        if removed:
+            DeploymentLogChunk.objects.filter(deployment_id=deployment.pk).delete()
+            DeploymentLogChunk.objects.bulk_create(merged)
+    return removed
+
+
+def seq_offset(deployment: Deployment, seq: int) -> int:
+    """
+    Byte offset right after chunk `seq`. After compaction this may be the end of
+    an earlier chunk, so a resume can repeat some of the log but never skips any.
+    """
+    chunk = (
+        DeploymentLogChunk.objects.filter(deployment_id=deployment.pk, seq__lte=seq)
+        .order_by("-seq")
+        .values_list("offset", "size")
+        .first()
+    )
+    return sum(chunk) if chunk else 0
+
+
+def sse_event(data: str, event: Optional[str] = None, id=None) -> str:
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def _log_state(deployment: Deployment) -> Tuple[str, int]:
+    return Deployment.objects.filter(pk=deployment.pk).values_list(
+        "status", "log_size"
+    )[0]
+
+
+async def stream_log(deployment: Deployment, offset: int = 0) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for the log from byte `offset` on. Every `log` event
+    carries the offset to resume from as its id. The stream ends with a `status`
+    event once the deployment has finished, or quietly after
+    DEPLOY_LOG_TAIL_TIMEOUT seconds, and the client reconnects with `Last-Event-ID`.
+
+    An async generator, so under ASGI every event is sent as soon as it is read
+    and a waiting tail holds no thread.
+    """
+    poll_interval = settings.DEPLOY_LOG_POLL_INTERVAL
+    deadline = time.monotonic() + settings.DEPLOY_LOG_TAIL_TIMEOUT
+    last_sent = time.monotonic()
+    yield f"retry: {int(poll_interval * 1000)}\n\n"
+    while True:
+        status, log_size = await database_sync_to_async(_log_state)(deployment)
+        if log_size > offset:
+            text, offset = await database_sync_to_async(read_log)(
+                deployment, offset, settings.DEPLOY_LOG_CHUNK_MAX_SIZE
+            )
+            yield sse_event(text, event="log", id=offset)
+            last_sent = time.monotonic()
+            continue
+        if status != "running":
+            yield sse_event(json.dumps({"status": status}), event="status", id=offset)
+            return
+        if time.monotonic() > deadline:
+            return
+        if time.monotonic() - last_sent > 15:
+            # keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from shapeblock.deployments.logs import compact_log
+from shapeblock.deployments.models import Deployment
+
+
+class Command(BaseCommand):
+    help = "Merge the log chunks of finished deployments"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.DEPLOY_LOG_COMPACT_AFTER,
+            help="Only compact deployments created at least this many seconds ago.",
+        )
+        parser.add_argument(
+            "--max-size",
+            type=int,
+            default=settings.DEPLOY_LOG_CHUNK_MAX_SIZE,
+            help="Maximum size of a merged chunk in bytes.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["older_than"])
+        deployments = (
+            Deployment.objects.exclude(status="running")
+            .filter(created_at__lt=cutoff)
+            .annotate(chunks=Count("log_chunks"))
+            .filter(chunks__gt=1)
+        )
+        compacted = removed = 0
+        for deployment in deployments.only("pk").iterator():
+            count = compact_log(deployment, options["max_size"])
+            if count:
+                compacted += 1
+                removed += count
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Compacted {compacted} deployment logs, removed {removed} chunks."
+            )
+        )
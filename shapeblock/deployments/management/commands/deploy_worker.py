@@ -0,0 +1,90 @@
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from shapeblock.deployments.queue import claim_next_job, requeue_stale_jobs, run_job
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "Run queued deployment jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.DEPLOY_WORKER_CONCURRENCY,
+            help="Number of jobs to run in parallel.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.DEPLOY_WORKER_POLL_INTERVAL,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            "--requeue-interval",
+            type=float,
+            default=settings.DEPLOY_JOB_REQUEUE_INTERVAL,
+            help="Seconds between sweeps for jobs abandoned by their worker.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue has no runnable jobs left.",
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        concurrency = options["concurrency"]
+        self.stdout.write(f"Starting {concurrency} deploy workers.")
+        self.requeue_interval = options["requeue_interval"]
+        self.next_requeue = 0
+        self.requeue_lock = threading.Lock()
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(options["poll_interval"], options["once"]),
+                name=f"deploy-worker-{i}",
+            )
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stdout.write(self.style.SUCCESS("Deploy workers stopped."))
+
+    def work(self, poll_interval, once):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                self.requeue_stale_jobs()
+                job = claim_next_job()
+                if job is None:
+                    if once:
+                        return
+                    self.stop.wait(poll_interval)
+                    continue
+                logger.info(f"Running deployment job {job.pk}, attempt {job.attempts}.")
+                run_job(job)
+        finally:
+            connection.close()
+
+    def requeue_stale_jobs(self):
+        # one worker sweeps at a time, every `requeue_interval` seconds
+        with self.requeue_lock:
+            now = time.monotonic()
+            if now < self.next_requeue:
+                return
+            self.next_requeue = now + self.requeue_interval
+        requeue_stale_jobs()
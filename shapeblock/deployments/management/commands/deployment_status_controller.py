@@ -0,0 +1,32 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shapeblock.deployments.controller import StatusController
+
+
+class Command(BaseCommand):
+    help = "Update deployment and service statuses from the cluster"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.DEPLOY_STATUS_FLUSH_INTERVAL,
+            help="Seconds between writes of the observed statuses.",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+        self.stdout.write("Watching Applications and HelmReleases.")
+        try:
+            StatusController().run(stop, options["interval"])
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS("Status controller stopped."))
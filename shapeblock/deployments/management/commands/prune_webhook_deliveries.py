@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shapeblock.deployments.models import WebhookDelivery
+
+
+class Command(BaseCommand):
+    help = "Remove the ids of old webhook deliveries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.WEBHOOK_DELIVERY_RETENTION,
+            help="Only remove deliveries received at least this many seconds ago.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["older_than"])
+        removed, _ = WebhookDelivery.objects.filter(received_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} webhook deliveries."))
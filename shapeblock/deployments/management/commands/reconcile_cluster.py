@@ -0,0 +1,45 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shapeblock.deployments.reconcile import Reconciler
+
+
+class Command(BaseCommand):
+    help = "Compare projects, apps and services with the cluster"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Recreate missing objects instead of only reporting them.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Sweep every this many seconds, by default only once.",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+        while True:
+            close_old_connections()
+            reconciler = Reconciler(repair=options["repair"])
+            drift = reconciler.run()
+            for item in drift:
+                self.stdout.write(str(item))
+            repaired = sum(item.repaired for item in drift)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Found {len(drift)} drifted objects, repaired {repaired}, "
+                    f"in {reconciler.requests} API requests."
+                )
+            )
+            if not options["interval"] or stop.wait(options["interval"]):
+                return
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0002_deploymentjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="log_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="deployment",
+            name="log_size",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="DeploymentLogChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seq", models.PositiveIntegerField()),
+                ("offset", models.BigIntegerField()),
+                ("size", models.PositiveIntegerField()),
+                ("data", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "deployment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="log_chunks",
+                        to="deployments.deployment",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["deployment", "offset"],
+                        name="deploylogchunk_offset_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="deploymentlogchunk",
+            constraint=models.UniqueConstraint(
+                fields=("deployment", "seq"), name="deploylogchunk_unique_seq"
+            ),
+        ),
+    ]
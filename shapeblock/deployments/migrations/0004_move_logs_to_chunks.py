@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:26
+
+from django.db import migrations
+
+
+def move_logs_to_chunks(apps, schema_editor):
+    Deployment = apps.get_model("deployments", "Deployment")
+    DeploymentLogChunk = apps.get_model("deployments", "DeploymentLogChunk")
+    deployments = Deployment.objects.exclude(log__isnull=True).exclude(log="")
+    for deployment in deployments.only("pk", "log").iterator(chunk_size=100):
+        size = len(deployment.log.encode("utf-8"))
+        DeploymentLogChunk.objects.create(
+            deployment=deployment, seq=1, offset=0, size=size, data=deployment.log
+        )
+        Deployment.objects.filter(pk=deployment.pk).update(log_seq=1, log_size=size)
+
+
+def move_chunks_to_logs(apps, schema_editor):
+    Deployment = apps.get_model("deployments", "Deployment")
+    DeploymentLogChunk = apps.get_model("deployments", "DeploymentLogChunk")
+    for deployment in Deployment.objects.filter(log_seq__gt=0).iterator():
+        chunks = DeploymentLogChunk.objects.filter(deployment=deployment)
+        log = "".join(chunks.order_by("seq").values_list("data", flat=True))
+        Deployment.objects.filter(pk=deployment.pk).update(log=log)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0003_deploymentlogchunk"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_logs_to_chunks, move_chunks_to_logs),
+    ]
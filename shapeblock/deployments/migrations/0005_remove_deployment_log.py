@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0004_move_logs_to_chunks"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="deployment",
+            name="log",
+        ),
+    ]
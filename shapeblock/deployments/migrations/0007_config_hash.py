@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+def scrub_secrets(apps, schema_editor):
+    Deployment = apps.get_model("deployments", "Deployment")
+    deployments = Deployment.objects.filter(params__has_key="secrets")
+    for deployment in deployments.only("pk", "params").iterator(chunk_size=100):
+        secrets = deployment.params["secrets"]
+        if isinstance(secrets, dict):
+            params = {**deployment.params, "secrets": sorted(secrets)}
+            Deployment.objects.filter(pk=deployment.pk).update(params=params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0006_webhookdelivery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="config_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.RunPython(scrub_secrets, migrations.RunPython.noop),
+    ]
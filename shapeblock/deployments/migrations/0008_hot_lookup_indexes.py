@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0005_hot_lookup_indexes"),
+        ("deployments", "0007_config_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="deployment",
+            index=models.Index(
+                fields=["app", "-created_at"], name="deployment_app_latest_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deployment",
+            index=models.Index(
+                condition=models.Q(("status", "success")),
+                fields=["app", "-created_at"],
+                name="deployment_app_success_idx",
+            ),
+        ),
+    ]
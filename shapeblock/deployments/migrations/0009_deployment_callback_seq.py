@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0008_hot_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="callback_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
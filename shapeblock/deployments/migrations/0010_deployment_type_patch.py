@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("deployments", "0009_deployment_callback_seq"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="deployment",
+            name="type",
+            field=models.CharField(
+                choices=[
+                    ("code", "Code Change"),
+                    ("config", "Config Change"),
+                    ("patch", "Patch"),
+                ],
+                default="code",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 
 from shapeblock.utils.models import OwnedModel
 
@@ -14,17 +15,126 @@ class Deployment(OwnedModel):
         ("success", "Success"),
         ("running", "Running"),
         ("failed", "Failed"),
+        # superseded by a deployment of a newer commit
+        ("cancelled", "Cancelled"),
     )
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="running")
-    log = models.TextField(blank=True, null=True)
+    # totals of the appended `DeploymentLogChunk`s, the log is kept in those
+    log_size = models.BigIntegerField(default=0)
+    log_seq = models.PositiveIntegerField(default=0)
     ref = models.CharField(null=True, max_length=256, blank=True)
+    # the app's config, with only the keys of its secrets
     params = models.JSONField(null=True, blank=True)
+    # `App.config_hash` when the deployment was created
+    config_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)
     TYPE_CHOICES = (
         ("code", "Code Change"),
         ("config", "Config Change"),
+        # a single field changed in place, see `shapeblock.apps.kubernetes.patch_app`
+        ("patch", "Patch"),
     )
     type = models.CharField(max_length=10, choices=TYPE_CHOICES, default="code")
     pod = models.CharField(max_length=100, blank=True, null=True)
+    # sequence number of the last operator callback event applied
+    callback_seq = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # an app's latest deployment
+            models.Index(
+                fields=["app", "-created_at"], name="deployment_app_latest_idx"
+            ),
+            # an app's latest successful deployment, to redeploy its ref
+            models.Index(
+                fields=["app", "-created_at"],
+                condition=models.Q(status="success"),
+                name="deployment_app_success_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"For {self.app.name}, on {self.created_at.strftime('%d-%m-%Y, %H:%M')}"
+
+
+class DeploymentJob(models.Model):
+    """
+    A queued run of the deploy pipeline for a deployment.
+    Jobs are drained by the `deploy_worker` management command.
+    """
+
+    deployment = models.OneToOneField(
+        Deployment, on_delete=models.CASCADE, related_name="job"
+    )
+    app = models.ForeignKey(
+        App, on_delete=models.CASCADE, related_name="deployment_jobs"
+    )
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "run_after"], name="deployjob_status_run_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.deployment} ({self.status})"
+
+
+class DeploymentLogChunk(models.Model):
+    """
+    An append-only piece of a deployment's build log.
+    `offset` is the position of the chunk's first byte in the UTF-8 encoded log.
+    """
+
+    deployment = models.ForeignKey(
+        Deployment, on_delete=models.CASCADE, related_name="log_chunks"
+    )
+    seq = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    size = models.PositiveIntegerField()
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["deployment", "seq"], name="deploylogchunk_unique_seq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["deployment", "offset"], name="deploylogchunk_offset_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.deployment} #{self.seq}"
+
+
+class WebhookDelivery(models.Model):
+    """
+    A processed GitHub webhook delivery, so redeliveries are dropped.
+    """
+
+    delivery_id = models.CharField(max_length=64, unique=True)
+    app = models.ForeignKey(
+        App, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.delivery_id
@@ -0,0 +1,230 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min
+from django.utils import timezone
+
+from shapeblock.apps.models import App
+from shapeblock.apps.kubernetes import run_deploy_pipeline
+from shapeblock.apps.status import broadcast_app_status
+from .logs import append_log
+from .models import Deployment, DeploymentJob
+
+logger = logging.getLogger("django")
+
+
+def enqueue_deployment(deployment: Deployment, run_after=None):
+    """
+    Queue the deploy pipeline for `deployment` instead of running it in the request.
+    The job is created once the current transaction commits, so a worker never
+    sees a deployment which is rolled back.
+    """
+    run_after = run_after or timezone.now()
+    transaction.on_commit(lambda: create_job(deployment, run_after))
+
+
+def create_job(deployment: Deployment, run_after):
+    with transaction.atomic():
+        # a newer push may have superseded it in the meantime
+        running = (
+            Deployment.objects.select_for_update()
+            .filter(pk=deployment.pk, status="running")
+            .exists()
+        )
+        if not running:
+            return
+        DeploymentJob.objects.create(
+            deployment=deployment, app_id=deployment.app_id, run_after=run_after
+        )
+    logger.info(f"Queued deployment {deployment.uuid} for app {deployment.app.name}.")
+
+
+def enqueue_push_deployment(deployment: Deployment):
+    """
+    Queue a code deployment of a pushed commit, debounced: its job waits
+    DEPLOY_WEBHOOK_DEBOUNCE seconds, and replaces the app's code deployments
+    of older commits which haven't finished. Of a burst of pushes only the
+    last one is built, starting at most DEPLOY_WEBHOOK_MAX_DELAY seconds after
+    the first.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # serialises pushes to the same app
+        list(
+            App.objects.select_for_update()
+            .filter(pk=deployment.app_id)
+            .values_list("pk", flat=True)
+        )
+        superseded = supersede_deployments(deployment)
+        run_after = now + timedelta(seconds=settings.DEPLOY_WEBHOOK_DEBOUNCE)
+        if superseded:
+            first_push = min(d.created_at for d in superseded)
+            max_delay = timedelta(seconds=settings.DEPLOY_WEBHOOK_MAX_DELAY)
+            run_after = max(now, min(run_after, first_push + max_delay))
+        enqueue_deployment(deployment, run_after=run_after)
+
+
+def supersede_deployments(deployment: Deployment):
+    """
+    Cancel the app's unfinished code deployments other than `deployment`.
+    Queued jobs are dropped. A build which has already started is left to the
+    cluster, the next patch of the application replaces it, and its callbacks
+    are ignored from now on. Returns the cancelled deployments which hadn't
+    been started yet.
+    """
+    older = list(
+        Deployment.objects.select_for_update(of=("self",))
+        .filter(app_id=deployment.app_id, type="code", status="running")
+        .exclude(pk=deployment.pk)
+        .select_related("job")
+    )
+    pending = []
+    for old in older:
+        job = getattr(old, "job", None)
+        if job is not None and job.status == "queued":
+            pending.append(old)
+            job.status = "cancelled"
+            job.finished_at = timezone.now()
+            job.save(update_fields=["status", "finished_at"])
+        old.status = "cancelled"
+        old.save(update_fields=["status"])
+        append_log(
+            old, f"Superseded by deployment {deployment.uuid} of {deployment.ref}.\n"
+        )
+    if older:
+        logger.info(
+            f"Deployment {deployment.uuid} superseded {len(older)} deployments "
+            f"of app {deployment.app_id}."
+        )
+    return pending
+
+
+def claim_next_job():
+    """
+    Mark the oldest runnable job as running and return it, or return None.
+    Jobs of an app which already has a running job are skipped, so deploys of
+    a single app never overlap.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        busy_apps = DeploymentJob.objects.filter(status="running").values("app")
+        candidates = (
+            DeploymentJob.objects.select_for_update(skip_locked=True)
+            .filter(status="queued", run_after__lte=now)
+            .exclude(app__in=busy_apps)
+            .order_by("run_after", "created_at")[:10]
+        )
+        for job in candidates:
+            # Lock the app row so that two workers can't both start a job for
+            # the same app, then check again now that we hold the lock.
+            locked = (
+                App.objects.select_for_update(skip_locked=True)
+                .filter(pk=job.app_id)
+                .values_list("pk", flat=True)
+            )
+            if not list(locked):
+                continue
+            if DeploymentJob.objects.filter(app=job.app_id, status="running").exists():
+                continue
+            job.status = "running"
+            job.attempts += 1
+            job.started_at = now
+            job.save(update_fields=["status", "attempts", "started_at"])
+            return job
+    return None
+
+
+def retry_delay(attempts: int) -> timedelta:
+    delay = settings.DEPLOY_JOB_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.DEPLOY_JOB_MAX_RETRY_DELAY))
+
+
+def run_job(job: DeploymentJob):
+    deployment = job.deployment
+    try:
+        response = run_deploy_pipeline(deployment)
+    except Exception as error:
+        logger.exception(f"Deploy pipeline failed for deployment {deployment.uuid}.")
+        job.last_error = str(error)
+        deployment.refresh_from_db(fields=["status"])
+        if deployment.status == "cancelled":
+            # a newer deployment has taken over, don't retry or fail the app
+            job.status = "cancelled"
+            job.finished_at = timezone.now()
+        elif job.attempts >= settings.DEPLOY_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.finished_at = timezone.now()
+            fail_deployment(deployment, f"Unable to start deployment: {error}\n")
+        else:
+            job.status = "queued"
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        job.save(update_fields=["status", "run_after", "finished_at", "last_error"])
+        return
+    job.status = "done"
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "finished_at"])
+    if response is None:
+        # the Application already had this manifest, the operator won't report back
+        finish_unchanged_deployment(deployment)
+
+
+def finish_unchanged_deployment(deployment: Deployment):
+    deployment.status = "success"
+    deployment.save(update_fields=["status"])
+    append_log(deployment, "Nothing changed since the last deployment.\n")
+    app = deployment.app
+    app.status = "ready"
+    app.save(update_fields=["status"])
+    broadcast_app_status(app)
+
+
+def fail_deployment(deployment: Deployment, message: str):
+    deployment.status = "failed"
+    deployment.save(update_fields=["status"])
+    append_log(deployment, message)
+    app = deployment.app
+    app.status = "created"
+    app.save(update_fields=["status"])
+    broadcast_app_status(app)
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Put jobs back on the queue whose worker went away while running them.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.DEPLOY_JOB_TIMEOUT)
+    count = DeploymentJob.objects.filter(
+        status="running", started_at__lt=cutoff
+    ).update(status="queued", run_after=timezone.now())
+    if count:
+        logger.warning(f"Requeued {count} stale deployment jobs.")
+    return count
+
+
+def queue_stats(window: timedelta = timedelta(hours=1)) -> dict:
+    """
+    Queue depth per status, plus wait and run times of jobs started in `window`.
+    """
+    now = timezone.now()
+    depth = {status: 0 for status, _ in DeploymentJob.STATUS_CHOICES}
+    for row in DeploymentJob.objects.values("status").annotate(count=Count("pk")):
+        depth[row["status"]] = row["count"]
+    oldest = DeploymentJob.objects.filter(status="queued").aggregate(
+        oldest=Min("created_at")
+    )["oldest"]
+    recent = DeploymentJob.objects.filter(started_at__gte=now - window).aggregate(
+        wait=Avg(F("started_at") - F("created_at")),
+        run=Avg(F("finished_at") - F("started_at")),
+    )
+    return {
+        "depth": depth,
+        "oldest_queued_seconds": (now - oldest).total_seconds() if oldest else None,
+        "avg_wait_seconds": _seconds(recent["wait"]),
+        "avg_run_seconds": _seconds(recent["run"]),
+    }
+
+
+def _seconds(value):
+    return value.total_seconds() if value is not None else None
@@ -0,0 +1,271 @@
+"""
+Sweep comparing the projects, apps and services in the database with the
+Projects, Applications and HelmReleases in the cluster.
+
+Every kind is listed once per namespace (Projects once, they are cluster
+scoped), page by page, and the lists are compared with the rows in memory, so
+a sweep makes a request per namespace and page instead of one per object and
+runs in time linear in the number of objects. API requests are rate limited by
+`KUBE_RECONCILE_RATE`.
+
+Drift is reported, and with `repair` the safe part of it is fixed:
+
+- a missing Project or HelmRelease is created again,
+- a missing Application of a built app is redeployed from its last successful
+  deployment,
+- a service whose HelmRelease is ready is marked ready.
+
+Objects without a row are only reported, deleting them is left to a human.
+"""
+
+import json
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from shapeblock.apps.config_hash import get_params
+from shapeblock.apps.models import App
+from shapeblock.projects.kubernetes import run_setup_project
+from shapeblock.projects.models import Project
+from shapeblock.services.kubernetes import create_service
+from shapeblock.services.models import Service
+from shapeblock.utils.kubernetes import custom_objects_api
+from .controller import SERVICE_UUID_LABEL, observed_result
+from .models import Deployment
+from .queue import enqueue_deployment
+
+logger = logging.getLogger("django")
+
+PROJECT_UUID_LABEL = "shapeblock.com/project-uuid"
+APP_UUID_LABEL = "shapeblock.com/app-uuid"
+# apps which have been deployed, so have an Application
+BUILT_APP_STATUSES = ("building", "ready")
+
+
+@dataclass(frozen=True)
+class Drift:
+    kind: str
+    namespace: str
+    name: str
+    problem: str
+    repaired: bool = False
+
+    def __str__(self):
+        name = f"{self.namespace}/{self.name}" if self.namespace else self.name
+        repaired = " (repaired)" if self.repaired else ""
+        return f"{self.kind} {name}: {self.problem}{repaired}"
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second, in bursts of up to `burst`.
+    A rate of 0 disables it.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens < 1:
+            delay = (1 - self._tokens) / self.rate
+            self._sleep(delay)
+            self._tokens = 1
+            self._last = now + delay
+        self._tokens -= 1
+
+
+def _labels(obj: Dict) -> Dict:
+    return obj["metadata"].get("labels") or {}
+
+
+class Reconciler:
+    def __init__(self, repair: bool = False, limiter: Optional[RateLimiter] = None):
+        self.repair = repair
+        self.limiter = limiter or RateLimiter(settings.KUBE_RECONCILE_RATE)
+        self.requests = 0
+
+    def list_objects(self, group, version, plural, namespace=None) -> Iterator[Dict]:
+        """
+        The objects of a kind, in pages of `KUBE_LIST_PAGE_SIZE`.
+        """
+        api = custom_objects_api()
+        token = None
+        while True:
+            self.limiter.wait()
+            self.requests += 1
+            kwargs = {"limit": settings.KUBE_LIST_PAGE_SIZE, "_preload_content": False}
+            if token:
+                kwargs["_continue"] = token
+            if namespace is None:
+                response = api.list_cluster_custom_object(
+                    group, version, plural, **kwargs
+                )
+            else:
+                response = api.list_namespaced_custom_object(
+                    group, version, namespace, plural, **kwargs
+                )
+            data = json.loads(response.data)
+            yield from data.get("items") or []
+            token = data["metadata"].get("continue")
+            if not token:
+                return
+
+    def call(self, func, *args):
+        self.limiter.wait()
+        self.requests += 1
+        return func(*args)
+
+    def run(self) -> List[Drift]:
+        projects = list(Project.objects.order_by("name"))
+        drift = self.reconcile_projects(projects)
+        apps = defaultdict(list)
+        for app in App.objects.only(
+            "uuid", "name", "status", "project_id", "user_id", "config_hash"
+        ).order_by("name"):
+            apps[app.project_id].append(app)
+        services = defaultdict(list)
+        for service in Service.objects.select_related("project").order_by("name"):
+            services[service.project_id].append(service)
+        for project in projects:
+            drift.extend(self.reconcile_apps(project, apps[project.pk]))
+            drift.extend(self.reconcile_services(project, services[project.pk]))
+        for item in drift:
+            logger.warning(f"Drift: {item}")
+        return drift
+
+    def reconcile_projects(self, projects: List[Project]) -> List[Drift]:
+        drift = []
+        found = {
+            obj["metadata"]["name"]: obj
+            for obj in self.list_objects("dev.shapeblock.com", "v1alpha1", "projects")
+        }
+        expected = {project.name for project in projects}
+        for project in projects:
+            if project.name not in found:
+                repaired = self.repair and self.repaired(run_setup_project, project)
+                drift.append(Drift("Project", "", project.name, "missing", repaired))
+            elif _labels(found[project.name]).get(PROJECT_UUID_LABEL) != str(
+                project.uuid
+            ):
+                drift.append(Drift("Project", "", project.name, "has another uuid"))
+        for name, obj in found.items():
+            if name not in expected and PROJECT_UUID_LABEL in _labels(obj):
+                drift.append(Drift("Project", "", name, "has no project"))
+        return drift
+
+    def reconcile_apps(self, project: Project, apps: List[App]) -> List[Drift]:
+        drift = []
+        namespace = project.name
+        found = {
+            obj["metadata"]["name"]: obj
+            for obj in self.list_objects(
+                "dev.shapeblock.com", "v1alpha1", "applications", namespace
+            )
+        }
+        for app in apps:
+            obj = found.pop(app.name, None)
+            if obj is None:
+                if app.status in BUILT_APP_STATUSES:
+                    repaired = self.repair and self.redeploy(app)
+                    drift.append(
+                        Drift("Application", namespace, app.name, "missing", repaired)
+                    )
+            elif _labels(obj).get(APP_UUID_LABEL) != str(app.uuid):
+                drift.append(
+                    Drift("Application", namespace, app.name, "has another uuid")
+                )
+        for name, obj in found.items():
+            if APP_UUID_LABEL in _labels(obj):
+                drift.append(Drift("Application", namespace, name, "has no app"))
+        return drift
+
+    def reconcile_services(
+        self, project: Project, services: List[Service]
+    ) -> List[Drift]:
+        drift = []
+        namespace = project.name
+        found = {
+            obj["metadata"]["name"]: obj
+            for obj in self.list_objects(
+                "helm.toolkit.fluxcd.io", "v2beta2", "helmreleases", namespace
+            )
+        }
+        for service in services:
+            obj = found.pop(service.name, None)
+            if obj is None:
+                repaired = self.repair and self.repaired(create_service, service)
+                drift.append(
+                    Drift("HelmRelease", namespace, service.name, "missing", repaired)
+                )
+            elif service.status == "starting" and observed_result(obj) == "success":
+                repaired = self.repair and bool(
+                    Service.objects.filter(pk=service.pk, status="starting").update(
+                        status="ready"
+                    )
+                )
+                drift.append(
+                    Drift("Service", namespace, service.name, "is ready", repaired)
+                )
+        for name, obj in found.items():
+            if SERVICE_UUID_LABEL in _labels(obj):
+                drift.append(Drift("HelmRelease", namespace, name, "has no service"))
+        return drift
+
+    def repaired(self, func, *args) -> bool:
+        try:
+            self.call(func, *args)
+        except Exception as e:
+            logger.error(f"Unable to repair {args[0]}: {e}")
+            return False
+        return True
+
+    def redeploy(self, app: App) -> bool:
+        """
+        Queue a deployment of the app's last successful ref, unless one is
+        running already.
+        """
+        with transaction.atomic():
+            if Deployment.objects.filter(app=app, status="running").exists():
+                return False
+            last = (
+                Deployment.objects.filter(
+                    app=app, type__in=["code", "config"], status="success"
+                )
+                .order_by("-created_at")
+                .only("ref")
+                .first()
+            )
+            if last is None:
+                return False
+            deployment = Deployment.objects.create(
+                user_id=app.user_id,
+                app=app,
+                type="config",
+                ref=last.ref,
+                params=get_params(app.pk),
+                config_hash=app.config_hash,
+            )
+            enqueue_deployment(deployment)
+            App.objects.filter(pk=app.pk).update(status="building")
+        return True
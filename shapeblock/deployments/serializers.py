@@ -1,7 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Deployment
-from shapeblock.apps.models import App, EnvVar, Secret, BuildVar, Volume
+from .models import Deployment, DeploymentLogChunk
+from shapeblock.apps.config_hash import get_params
 from shapeblock.apps.git.common import get_commit_sha
 from github import GithubException
 
@@ -18,18 +19,8 @@ class DeploymentSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data["user"] = self.context["request"].user
         app = validated_data["app"]
-        # create params
-        params = {
-            "env_vars": self.get_env_vars(app),
-            "secrets": self.get_secrets(app),
-            "build_vars": self.get_build_vars(app),
-            "volumes": self.get_volumes(app),
-        }
-        validated_data["params"] = params
-        # TODO:
-        # check if previous deployment failed
-        # check if params are same
-        # check if last commit is same
+        # kept current by the signals, see `shapeblock.apps.config_hash`
+        config_hash = app.config_hash
         try:
             new_ref = get_commit_sha(app.repo, app.ref, app.user, "github")
         except GithubException as e:
@@ -37,12 +28,15 @@ class DeploymentSerializer(serializers.ModelSerializer):
 
         validated_data["ref"] = new_ref
         last_deployment = (
-            Deployment.objects.filter(app=app).order_by("-created_at").first()
+            Deployment.objects.filter(app=app, type__in=["code", "config"])
+            .order_by("-created_at")
+            .only("status", "ref", "config_hash")
+            .first()
         )
         if last_deployment:
             conditions_met = (
-                last_deployment.status == "failed"
-                or not deep_dict_compare(last_deployment.params, params)
+                last_deployment.status in ("failed", "cancelled")
+                or last_deployment.config_hash != config_hash
                 or last_deployment.ref != new_ref
             )
         else:
@@ -50,60 +44,49 @@ class DeploymentSerializer(serializers.ModelSerializer):
             conditions_met = True
 
         if conditions_met:
-            print(validated_data)
             # If any condition is met, create and return the new Deployment instance
+            validated_data["params"] = get_params(app.pk)
+            validated_data["config_hash"] = config_hash
             return super().create(validated_data)
         else:
             raise serializers.ValidationError(
                 "Deployment conditions not met, deployment not created."
             )
-        return None
-
-    def get_env_vars(self, app):
-        env_vars = EnvVar.objects.filter(app=app)
-        return {env_var.key: env_var.value for env_var in env_vars}
-
-    def get_secrets(self, app):
-        secrets = Secret.objects.filter(app=app)
-        return {secret.key: secret.value for secret in secrets}
-
-    def get_build_vars(self, app):
-        build_vars = BuildVar.objects.filter(app=app)
-        return {build_var.key: build_var.value for build_var in build_vars}
-
-    def get_volumes(self, app):
-        volumes = Volume.objects.filter(app=app)
-        return [
-            {"name": volume.name, "mount_path": volume.mount_path, "size": volume.size}
-            for volume in volumes
-        ]
 
 
 class DeploymentReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Deployment
-        fields = ["uuid", "created_at", "status", "ref", "params", "user", "log"]
+        fields = ["uuid", "created_at", "status", "ref", "params", "user", "log_size"]
 
     user = serializers.PrimaryKeyRelatedField(
         read_only=True, default=serializers.CurrentUserDefault()
     )
 
 
-def deep_dict_compare(d1, d2):
-    """
-    Recursively compares two dictionaries to determine if they are equal,
-    accounting for nested structures and lists.
-    """
-    if isinstance(d1, dict) and isinstance(d2, dict):
-        if d1.keys() != d2.keys():
-            return False
-        for key in d1.keys():
-            if not deep_dict_compare(d1[key], d2[key]):
-                return False
-        return True
-    elif isinstance(d1, list) and isinstance(d2, list):
-        if len(d1) != len(d2):
-            return False
-        return all(deep_dict_compare(item1, item2) for item1, item2 in zip(d1, d2))
-    else:
-        return d1 == d2
+class DeploymentLogChunkSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeploymentLogChunk
+        fields = ["seq", "offset", "size", "data"]
+
+
+class DeploymentEventSerializer(serializers.Serializer):
+    deployment_uuid = serializers.UUIDField()
+    # increasing per deployment, redelivered events are skipped
+    seq = serializers.IntegerField(min_value=1, required=False)
+    status = serializers.ChoiceField(choices=["running", "success", "failed"])
+    logs = serializers.CharField(allow_blank=True, trim_whitespace=False, default="")
+    pod = serializers.CharField(
+        max_length=100, allow_blank=True, allow_null=True, required=False
+    )
+
+
+class DeploymentEventBatchSerializer(serializers.Serializer):
+    events = DeploymentEventSerializer(many=True, allow_empty=False)
+
+    def validate_events(self, value):
+        if len(value) > settings.DEPLOY_CALLBACK_MAX_EVENTS:
+            raise serializers.ValidationError(
+                f"At most {settings.DEPLOY_CALLBACK_MAX_EVENTS} events per request."
+            )
+        return value
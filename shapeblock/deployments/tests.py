@@ -1,3 +1,1172 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import hmac
+import json
+import threading
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from kubernetes.client.rest import ApiException
+
+from shapeblock.apps.kubernetes import MANIFEST_HASH_ANNOTATION, run_deploy_pipeline
+from shapeblock.apps.models import App, EnvVar
+from shapeblock.projects.models import Project
+from shapeblock.services.models import Service
+from shapeblock.utils import kubernetes, watch_cache
+from shapeblock.utils.testing import FakeAPIServer, make_app
+from .controller import (
+    DEPLOYMENT_UUID_LABEL,
+    SERVICE_UUID_LABEL,
+    StatusController,
+    observed_result,
+)
+from .logs import append_log, compact_log, get_log, read_log
+from .management.commands.deploy_worker import Command as DeployWorkerCommand
+from .models import Deployment, DeploymentJob, DeploymentLogChunk, WebhookDelivery
+from .queue import claim_next_job, enqueue_deployment, queue_stats, run_job
+from .reconcile import RateLimiter, Reconciler
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+WEBHOOK_SECRET = "hook-secret"
+
+
+def sign(body, secret=WEBHOOK_SECRET):
+    digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+@override_settings(
+    DEPLOY_JOB_MAX_ATTEMPTS=2,
+    DEPLOY_JOB_RETRY_DELAY=5,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+)
+class DeploymentQueueTestCase(TestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.other_app = make_app("api", user=self.app.user, project=self.app.project)
+
+    def deploy(self, app):
+        deployment = Deployment.objects.create(user=app.user, app=app, type="config")
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_deployment(deployment)
+        return DeploymentJob.objects.get(deployment=deployment)
+
+    @mock.patch("shapeblock.deployments.queue.run_deploy_pipeline")
+    def test_job_runs_pipeline(self, run_deploy_pipeline):
+        job = self.deploy(self.app)
+        claimed = claim_next_job()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.status, "running")
+        run_job(claimed)
+        run_deploy_pipeline.assert_called_once_with(job.deployment)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertIsNone(claim_next_job())
+
+    def test_jobs_of_one_app_are_serialised(self):
+        first = self.deploy(self.app)
+        self.deploy(self.app)
+        other = self.deploy(self.other_app)
+        self.assertEqual(claim_next_job(), first)
+        # the second job of `app` waits for the first one to finish
+        self.assertEqual(claim_next_job(), other)
+        self.assertIsNone(claim_next_job())
+
+    @mock.patch(
+        "shapeblock.deployments.queue.run_deploy_pipeline",
+        side_effect=Exception("API server unavailable"),
+    )
+    def test_failed_job_is_retried_with_backoff(self, run_deploy_pipeline):
+        job = self.deploy(self.app)
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "queued")
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=4))
+        self.assertIsNone(claim_next_job())
+
+        DeploymentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.deployment.status, "failed")
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.status, "created")
+
+    def test_job_is_created_on_commit(self):
+        deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="config"
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue_deployment(deployment)
+        self.assertFalse(DeploymentJob.objects.exists())
+        # superseded before its transaction committed
+        Deployment.objects.filter(pk=deployment.pk).update(status="cancelled")
+        callbacks[0]()
+        self.assertFalse(DeploymentJob.objects.exists())
+
+    @mock.patch(
+        "shapeblock.deployments.management.commands.deploy_worker.requeue_stale_jobs"
+    )
+    def test_worker_requeues_periodically(self, requeue_stale_jobs):
+        worker = DeployWorkerCommand()
+        worker.requeue_interval = 60
+        worker.next_requeue = 0
+        worker.requeue_lock = threading.Lock()
+        worker.requeue_stale_jobs()
+        worker.requeue_stale_jobs()
+        self.assertEqual(requeue_stale_jobs.call_count, 1)
+        worker.next_requeue = 0
+        worker.requeue_stale_jobs()
+        self.assertEqual(requeue_stale_jobs.call_count, 2)
+
+    def test_queue_stats(self):
+        self.deploy(self.app)
+        self.deploy(self.other_app)
+        claim_next_job()
+        stats = queue_stats()
+        self.assertEqual(stats["depth"]["queued"], 1)
+        self.assertEqual(stats["depth"]["running"], 1)
+        self.assertIsNotNone(stats["oldest_queued_seconds"])
+        self.assertIsNotNone(stats["avg_wait_seconds"])
+
+
+@override_settings(
+    DEPLOY_WEBHOOK_DEBOUNCE=10,
+    DEPLOY_WEBHOOK_MAX_DELAY=60,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+)
+class WebhookDeployTestCase(TestCase):
+    def setUp(self):
+        self.app = make_app(
+            "web",
+            webhook_id=42,
+            webhook_secret=WEBHOOK_SECRET,
+            autodeploy=True,
+            ref="main",
+        )
+        self.deliveries = 0
+
+    def push(self, sha, delivery_id=None, ref="refs/heads/main", signature=None):
+        self.deliveries += 1
+        body = json.dumps({"ref": ref, "after": sha})
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("webhook"),
+                body,
+                content_type="application/json",
+                HTTP_X_GITHUB_HOOK_ID="42",
+                HTTP_X_GITHUB_EVENT="push",
+                HTTP_X_GITHUB_DELIVERY=delivery_id or f"delivery-{self.deliveries}",
+                HTTP_X_HUB_SIGNATURE_256=signature or sign(body),
+            )
+
+    def deployments(self):
+        return {
+            d.ref: d.status
+            for d in Deployment.objects.filter(app=self.app).order_by("created_at")
+        }
+
+    def test_pushes_are_coalesced(self):
+        for sha in ("a" * 40, "b" * 40, "c" * 40):
+            self.assertEqual(self.push(sha).status_code, 202)
+        self.assertEqual(
+            self.deployments(),
+            {"a" * 40: "cancelled", "b" * 40: "cancelled", "c" * 40: "running"},
+        )
+        self.assertEqual(
+            list(DeploymentJob.objects.values_list("status", flat=True)),
+            ["cancelled", "cancelled", "queued"],
+        )
+        latest = Deployment.objects.get(ref="c" * 40)
+        self.assertIn(str(latest.uuid), get_log(Deployment.objects.get(ref="b" * 40)))
+        # nothing runs until the pushes have settled
+        self.assertIsNone(claim_next_job())
+        DeploymentJob.objects.update(run_after=timezone.now())
+        self.assertEqual(claim_next_job().deployment, latest)
+
+    def test_debounce_is_capped(self):
+        self.push("a" * 40)
+        first = Deployment.objects.get()
+        Deployment.objects.update(created_at=timezone.now() - timedelta(seconds=55))
+        self.push("b" * 40)
+        job = DeploymentJob.objects.get(status="queued")
+        self.assertLess(job.run_after, first.job.run_after)
+        self.assertLessEqual(job.run_after, timezone.now() + timedelta(seconds=5))
+
+    @mock.patch("shapeblock.deployments.queue.run_deploy_pipeline")
+    def test_started_build_is_superseded(self, run_deploy_pipeline):
+        self.push("a" * 40)
+        DeploymentJob.objects.update(run_after=timezone.now())
+        run_job(claim_next_job())
+        self.push("b" * 40)
+        old = Deployment.objects.get(ref="a" * 40)
+        self.assertEqual(old.status, "cancelled")
+        # its late callback doesn't touch the app
+        response = self.client.post(
+            reverse("deployments"),
+            json.dumps(
+                {"deployment_uuid": str(old.uuid), "status": "success", "logs": ""}
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 202)
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.status, "building")
+
+    def test_manual_deployments_are_kept(self):
+        manual = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="config"
+        )
+        enqueue_deployment(manual)
+        self.push("a" * 40)
+        manual.refresh_from_db()
+        self.assertEqual(manual.status, "running")
+
+    def test_redelivery_is_dropped(self):
+        self.push("a" * 40, delivery_id="abc")
+        self.push("a" * 40, delivery_id="abc")
+        self.assertEqual(Deployment.objects.count(), 1)
+        self.assertEqual(WebhookDelivery.objects.get().app, self.app)
+
+    def test_ignored_pushes(self):
+        self.push("0" * 40)
+        self.push("a" * 40, ref="refs/heads/other")
+        self.assertEqual(Deployment.objects.count(), 0)
+
+    def test_invalid_signature(self):
+        body = json.dumps({"ref": "refs/heads/main", "after": "a" * 40})
+        for signature in (sign(body, secret="guessed"), "sha1=abc"):
+            self.assertEqual(self.push("a" * 40, signature=signature).status_code, 202)
+        self.assertEqual(Deployment.objects.count(), 0)
+        # nor is the delivery id used up
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_failed_delivery_is_not_recorded(self):
+        with mock.patch(
+            "shapeblock.apps.utils.enqueue_push_deployment",
+            side_effect=RuntimeError("queue down"),
+        ):
+            with self.assertRaises(RuntimeError):
+                self.push("a" * 40, delivery_id="abc")
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertFalse(Deployment.objects.exists())
+        # GitHub's redelivery is deployed
+        self.push("a" * 40, delivery_id="abc")
+        self.assertEqual(Deployment.objects.count(), 1)
+
+    def test_old_deliveries_are_pruned(self):
+        self.push("a" * 40, delivery_id="abc")
+        WebhookDelivery.objects.update(
+            received_at=timezone.now() - timedelta(seconds=120)
+        )
+        self.push("b" * 40)
+        out = StringIO()
+        call_command("prune_webhook_deliveries", "--older-than", "60", stdout=out)
+        self.assertIn("Removed 1 webhook deliveries.", out.getvalue())
+        self.assertEqual(
+            list(WebhookDelivery.objects.values_list("delivery_id", flat=True)),
+            ["delivery-2"],
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MonorepoWebhookTestCase(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="dev", password="pw")
+        project = Project.objects.create(user=user, display_name="Mono", name="mono")
+        repo = "git@github.com:Shapeblock/Mono.git"
+        self.apps = {
+            name: make_app(
+                name,
+                user=user,
+                project=project,
+                repo=repo,
+                sub_path=sub_path,
+                webhook_id=hook_id,
+                webhook_secret=WEBHOOK_SECRET,
+                autodeploy=True,
+            )
+            for hook_id, (name, sub_path) in enumerate(
+                [("api", "services/api"), ("web", "services/web/"), ("root", None)],
+                start=1,
+            )
+        }
+
+    def push(self, hook_id, commits, delivery_id="delivery", **body):
+        body = json.dumps(
+            {
+                "ref": "refs/heads/main",
+                "after": "a" * 40,
+                "repository": {"full_name": "shapeblock/mono"},
+                "commits": commits,
+                **body,
+            }
+        )
+        return self.client.post(
+            reverse("webhook"),
+            body,
+            content_type="application/json",
+            HTTP_X_GITHUB_HOOK_ID=str(hook_id),
+            HTTP_X_GITHUB_EVENT="push",
+            HTTP_X_GITHUB_DELIVERY=delivery_id,
+            HTTP_X_HUB_SIGNATURE_256=sign(body),
+        )
+
+    def deployed(self):
+        return sorted(Deployment.objects.values_list("app__name", flat=True))
+
+    def test_repo_full_name(self):
+        self.assertEqual(self.apps["api"].repo_full_name, "shapeblock/mono")
+
+    def test_only_changed_apps_are_deployed(self):
+        commits = [
+            {"added": ["services/api/app.py"], "modified": [], "removed": []},
+            {"added": [], "modified": ["services/webhooks/x.py"], "removed": []},
+        ]
+        self.assertEqual(self.push(1, commits).status_code, 202)
+        self.assertEqual(self.deployed(), ["api", "root"])
+        self.apps["api"].refresh_from_db()
+        self.assertEqual(self.apps["api"].status, "building")
+
+    def test_every_hook_delivers_once(self):
+        commits = [{"modified": ["services/web/index.js", "services/api/a.py"]}]
+        for hook_id in range(1, 4):
+            self.push(hook_id, commits, delivery_id=f"delivery-{hook_id}")
+        self.assertEqual(self.deployed(), ["api", "root", "web"])
+
+    def test_unknown_changes_deploy_everything(self):
+        self.push(1, [], delivery_id="empty")
+        self.assertEqual(self.deployed(), ["api", "root", "web"])
+        Deployment.objects.all().delete()
+        self.push(1, [{"modified": ["README.md"]}], forced=True, after="b" * 40)
+        self.assertEqual(self.deployed(), ["api", "root", "web"])
+
+    def test_other_refs_and_manual_apps(self):
+        self.apps["root"].autodeploy = False
+        self.apps["root"].save()
+        self.apps["web"].ref = "develop"
+        self.apps["web"].save()
+        self.push(1, [])
+        self.assertEqual(self.deployed(), ["api"])
+
+    def test_only_the_hook_owners_apps(self):
+        other = get_user_model().objects.create_user(username="other", password="pw")
+        make_app(
+            "victim",
+            user=other,
+            repo="git@github.com:other/victim.git",
+            autodeploy=True,
+        )
+        make_app(
+            "fork",
+            user=other,
+            repo="git@github.com:Shapeblock/Mono.git",
+            autodeploy=True,
+        )
+        # the payload can't point the hook at another repo
+        self.push(1, [], repository={"full_name": "other/victim"})
+        self.assertEqual(self.deployed(), ["api", "root", "web"])
+
+    def test_unsigned_hook_deploys_its_app(self):
+        App.objects.update(webhook_secret="")
+        response = self.client.post(
+            reverse("webhook"),
+            json.dumps({"ref": "refs/heads/main", "after": "a" * 40}),
+            content_type="application/json",
+            HTTP_X_GITHUB_HOOK_ID="2",
+            HTTP_X_GITHUB_EVENT="push",
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.deployed(), ["web"])
+
+
+APPLICATIONS = "/apis/dev.shapeblock.com/v1alpha1/namespaces/project-web/applications"
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DeployPipelineTestCase(TestCase):
+    """
+    The deploy pipeline against a fake API server holding the Application.
+    """
+
+    def setUp(self):
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url, KUBE_TOKEN="fake-token"
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+        self.application = None
+        self.server.route("GET", f"{APPLICATIONS}/web", self.get_application)
+        self.server.route("POST", APPLICATIONS, self.create_application)
+        self.server.route("PATCH", f"{APPLICATIONS}/web", self.patch_application)
+        self.app = make_app("web", status="ready")
+
+    def tearDown(self):
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+
+    def get_application(self, request):
+        if self.application is None:
+            return 404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+        return 200, self.application
+
+    def create_application(self, request):
+        if self.application is not None:
+            return 409, {"kind": "Status", "code": 409, "reason": "AlreadyExists"}
+        self.application = request.json()
+        return 201, self.application
+
+    def patch_application(self, request):
+        if self.application is None:
+            return 404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+        self.application = request.json()
+        return 200, self.application
+
+    def deploy(self, deployment_type="config", status="success"):
+        deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type=deployment_type, ref="a" * 40
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_deployment(deployment)
+        run_job(claim_next_job())
+        deployment.refresh_from_db()
+        if deployment.status == "running":
+            # the operator's callback
+            Deployment.objects.filter(pk=deployment.pk).update(status=status)
+        return deployment
+
+    def writes(self):
+        return [r.method for r in self.server.requests if r.method != "GET"]
+
+    def test_unchanged_manifest_is_not_sent(self):
+        first = self.deploy()
+        self.assertEqual(self.writes(), ["POST"])
+        annotations = self.application["metadata"]["annotations"]
+        self.assertIn(MANIFEST_HASH_ANNOTATION, annotations)
+
+        second = self.deploy()
+        self.assertEqual(self.writes(), ["POST"])
+        self.assertEqual(second.status, "success")
+        self.assertIn("Nothing changed", get_log(second))
+        self.assertEqual(
+            self.application["metadata"]["labels"]["shapeblock.com/deployment-uuid"],
+            str(first.uuid),
+        )
+
+        EnvVar.objects.create(app=self.app, key="DEBUG", value="1")
+        self.deploy()
+        self.assertEqual(self.writes(), ["POST", "PATCH"])
+        self.assertNotEqual(self.application["metadata"]["annotations"], annotations)
+
+    def test_failed_deployment_is_sent_again(self):
+        self.deploy(status="failed")
+        self.deploy()
+        self.assertEqual(self.writes(), ["POST", "PATCH"])
+
+    def test_only_missing_application_is_created(self):
+        self.server.route(
+            "GET",
+            f"{APPLICATIONS}/web",
+            (500, {"kind": "Status", "code": 500, "reason": "InternalError"}),
+        )
+        deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="config"
+        )
+        with self.assertRaises(ApiException):
+            run_deploy_pipeline(deployment)
+        self.assertEqual(self.writes(), [])
+
+    def test_watch_cache(self):
+        self.deploy()
+        informer = watch_cache.Informer("applications", None)
+        informer.replace([self.application], "1")
+        requests = len(self.server.requests)
+        with mock.patch.object(watch_cache, "get_informer", return_value=informer):
+            self.deploy()
+        self.assertEqual(len(self.server.requests), requests)
+
+    def test_server_side_apply(self):
+        self.deploy()
+        EnvVar.objects.create(app=self.app, key="DEBUG", value="1")
+        with override_settings(KUBE_SERVER_SIDE_APPLY=True):
+            self.deploy()
+        request = self.server.requests[-1]
+        self.assertEqual(request.method, "PATCH")
+        self.assertEqual(
+            request.headers["Content-Type"], "application/apply-patch+yaml"
+        )
+        self.assertEqual(request.query, {"fieldManager": "shapeblock", "force": "true"})
+
+
+class DeploymentLogTestCase(APITestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="config"
+        )
+
+    def test_append_does_not_read_log(self):
+        append_log(self.deployment, "Building…\n")
+        with self.assertNumQueries(5):
+            # update counters, read them back and insert the chunk, in a savepoint
+            chunk = append_log(self.deployment, "Done.\n")
+        self.assertEqual((chunk.seq, chunk.offset), (2, len("Building…\n".encode())))
+        self.deployment.refresh_from_db()
+        self.assertEqual(self.deployment.log_seq, 2)
+        self.assertEqual(self.deployment.log_size, len("Building…\nDone.\n".encode()))
+        self.assertEqual(get_log(self.deployment), "Building…\nDone.\n")
+        self.assertIsNone(append_log(self.deployment, ""))
+
+    def test_read_log_ranges(self):
+        for text in ("ab", "c€d", "ef"):
+            append_log(self.deployment, text)
+        log = "abc€def".encode("utf-8")
+        self.assertEqual(read_log(self.deployment), ("abc€def", len(log)))
+        self.assertEqual(read_log(self.deployment, 1, 3), ("bc", 3))
+        # never split the three bytes of the euro sign
+        self.assertEqual(read_log(self.deployment, 3, 2), ("€", 6))
+        self.assertEqual(read_log(self.deployment, 4, 3), ("d", 7))
+        self.assertEqual(read_log(self.deployment, 6), ("def", len(log)))
+        self.assertEqual(read_log(self.deployment, len(log)), ("", len(log)))
+
+        offset, text = 0, ""
+        while offset < len(log):
+            chunk, offset = read_log(self.deployment, offset, 2)
+            text += chunk
+        self.assertEqual(text, "abc€def")
+
+    def test_compact(self):
+        for i in range(10):
+            append_log(self.deployment, f"line {i}\n")
+        log = get_log(self.deployment)
+        self.assertEqual(compact_log(self.deployment, max_size=30), 7)
+        chunks = list(self.deployment.log_chunks.order_by("seq"))
+        self.assertEqual([chunk.seq for chunk in chunks], [4, 8, 10])
+        self.assertEqual([chunk.offset for chunk in chunks], [0, 28, 56])
+        self.assertEqual(get_log(self.deployment), log)
+        self.assertEqual(read_log(self.deployment, 30, 10)[0], "ne 4\nline ")
+        # appends carry on after the compacted chunks
+        self.assertEqual(append_log(self.deployment, "end\n").seq, 11)
+
+    def test_compact_command(self):
+        running = Deployment.objects.create(user=self.app.user, app=self.app)
+        for deployment in (self.deployment, running):
+            append_log(deployment, "one\n")
+            append_log(deployment, "two\n")
+        self.deployment.status = "success"
+        self.deployment.save()
+        out = StringIO()
+        call_command("compact_deployment_logs", "--older-than", "0", stdout=out)
+        self.assertIn("Compacted 1 deployment logs, removed 1 chunks.", out.getvalue())
+        self.assertEqual(self.deployment.log_chunks.count(), 1)
+        self.assertEqual(running.log_chunks.count(), 2)
+
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_status_callback_appends(self):
+        for logs in ("step 1\n", "step 2\n"):
+            response = self.client.post(
+                reverse("deployments"),
+                json.dumps(
+                    {
+                        "deployment_uuid": str(self.deployment.uuid),
+                        "status": "running",
+                        "logs": logs,
+                    }
+                ),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_log(self.deployment), "step 1\nstep 2\n")
+
+    def test_log_endpoint(self):
+        for i in range(5):
+            append_log(self.deployment, f"line {i}\n")
+        self.client.force_authenticate(self.app.user)
+        response = self.client.get(
+            reverse("deployment-list-create", kwargs={"app_uuid": self.app.uuid})
+        )
+        self.assertNotIn("log", response.json()[0])
+        self.assertEqual(response.json()[0]["log_size"], 35)
+
+        url = reverse(
+            "deployment-log",
+            kwargs={"app_uuid": self.app.uuid, "deployment_uuid": self.deployment.uuid},
+        )
+        page = self.client.get(url, {"page_size": 2}).json()
+        chunks = page["results"]
+        while page["next"]:
+            page = self.client.get(page["next"]).json()
+            chunks += page["results"]
+        self.assertEqual([chunk["seq"] for chunk in chunks], [1, 2, 3, 4, 5])
+        self.assertEqual(
+            chunks[4], {"seq": 5, "offset": 28, "size": 7, "data": "line 4\n"}
+        )
+
+        other = make_app("other")
+        self.client.force_authenticate(other.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class DeploymentLogStreamTestCase(APITestCase):
+    def setUp(self):
+        self.app = make_app("web")
+        self.deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="config"
+        )
+        for i in range(3):
+            append_log(self.deployment, f"line {i}\n")
+        self.client.force_authenticate(self.app.user)
+        self.url = reverse(
+            "deployment-log",
+            kwargs={"app_uuid": self.app.uuid, "deployment_uuid": self.deployment.uuid},
+        )
+
+    def tail(self, **kwargs):
+        response = self.client.get(self.url, HTTP_ACCEPT="text/event-stream", **kwargs)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        async def read():
+            return [chunk async for chunk in response.streaming_content]
+
+        return b"".join(async_to_sync(read)()).decode()
+
+    def test_range(self):
+        response = self.client.get(self.url, {"offset": 7, "limit": 10})
+        self.assertEqual(
+            response.json(),
+            {
+                "offset": 7,
+                "next_offset": 17,
+                "log_size": 21,
+                "status": "running",
+                "data": "line 1\nlin",
+            },
+        )
+        response = self.client.get(self.url, {"offset": 17})
+        self.assertEqual(response.json()["data"], "e 2\n")
+        self.assertEqual(response.json()["next_offset"], 21)
+        response = self.client.get(self.url, {"offset": "-1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_gzip(self):
+        append_log(self.deployment, "x" * 1000)
+        response = self.client.get(self.url, {"offset": 0}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data["log_size"], 1021)
+
+    def test_tail_finished_deployment(self):
+        Deployment.objects.filter(pk=self.deployment.pk).update(status="success")
+        body = self.tail()
+        self.assertEqual(
+            body,
+            "retry: 1000\n\n"
+            "id: 21\nevent: log\ndata: line 0\ndata: line 1\ndata: line 2\ndata: \n\n"
+            'id: 21\nevent: status\ndata: {"status": "success"}\n\n',
+        )
+
+    @override_settings(DEPLOY_LOG_POLL_INTERVAL=0.01, DEPLOY_LOG_TAIL_TIMEOUT=0)
+    def test_tail_resumes(self):
+        body = self.tail(HTTP_LAST_EVENT_ID="14")
+        self.assertIn("id: 21\nevent: log\ndata: line 2\n", body)
+        self.assertNotIn("line 1", body)
+        # the deployment is still running, the stream ends at the timeout
+        self.assertNotIn("event: status", body)
+
+        body = self.tail(data={"seq": 1})
+        self.assertIn("data: line 1\ndata: line 2\n", body)
+        self.assertNotIn("line 0", body)
+
+    def test_tail_is_not_gzipped(self):
+        Deployment.objects.filter(pk=self.deployment.pk).update(status="failed")
+        response = self.client.get(
+            self.url, HTTP_ACCEPT="text/event-stream", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertTrue(response.is_async)
+
+    @override_settings(DEPLOY_LOG_POLL_INTERVAL=0.01)
+    def test_tail_streams_while_running(self):
+        response = self.client.get(self.url, HTTP_ACCEPT="text/event-stream")
+        deployment = self.deployment
+
+        async def read():
+            events = aiter(response.streaming_content)
+            self.assertEqual(await anext(events), b"retry: 10\n\n")
+            # sent before the deployment has finished
+            self.assertIn(b"data: line 2\n", await anext(events))
+            await database_sync_to_async(append_log)(deployment, "line 3\n")
+            self.assertIn(b"id: 28\nevent: log\ndata: line 3\n", await anext(events))
+            await database_sync_to_async(
+                Deployment.objects.filter(pk=deployment.pk).update
+            )(status="success")
+            self.assertIn(b'"success"', await anext(events))
+
+        async_to_sync(read)()
+
+
+@override_settings(OPERATOR_CALLBACK_TOKEN="operator-token")
+@mock.patch("shapeblock.deployments.callbacks.broadcast_app_status")
+@mock.patch("shapeblock.deployments.callbacks.get_channel_layer")
+class DeploymentEventsTestCase(APITestCase):
+    def setUp(self):
+        self.web = make_app("web", status="building")
+        self.api = make_app("api", status="building")
+        self.deployments = [
+            Deployment.objects.create(user=app.user, app=app, type="code")
+            for app in (self.web, self.api)
+        ]
+        self.url = reverse("deployment-events")
+
+    def post(self, events, token="operator-token"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                self.url,
+                {"events": events},
+                format="json",
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+
+    def events(self, deployment, count, first_seq=1, status="running"):
+        return [
+            {
+                "deployment_uuid": str(deployment.uuid),
+                "seq": seq,
+                "status": status,
+                "logs": f"step {seq}\n",
+                "pod": "build-pod",
+            }
+            for seq in range(first_seq, first_seq + count)
+        ]
+
+    def test_batch(self, get_channel_layer, broadcast_app_status):
+        group_send = get_channel_layer.return_value.group_send = mock.AsyncMock()
+        web, api = self.deployments
+        events = self.events(web, 3) + self.events(api, 2)
+        events[2]["status"] = "success"
+        # the lock, the deployments, the chunks and the app, in a savepoint
+        with self.assertNumQueries(6):
+            response = self.post(list(reversed(events)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"applied": 5, "skipped": 0})
+
+        web.refresh_from_db()
+        self.assertEqual(
+            (web.status, web.pod, web.callback_seq), ("success", "build-pod", 3)
+        )
+        self.assertEqual(get_log(web), "step 1\nstep 2\nstep 3\n")
+        self.assertEqual(web.log_chunks.count(), 1)
+        self.assertEqual(get_log(api), "step 1\nstep 2\n")
+        self.web.refresh_from_db()
+        self.api.refresh_from_db()
+        self.assertEqual((self.web.status, self.api.status), ("ready", "building"))
+
+        # one message per deployment
+        self.assertEqual(group_send.await_count, 2)
+        group_send.assert_any_await(
+            f"deployment_{web.uuid}",
+            {
+                "type": "deploy_logs",
+                "data": {"log": "step 1\nstep 2\nstep 3\n", "status": "success"},
+            },
+        )
+        broadcast_app_status.assert_called_once()
+
+    def test_redelivery(self, get_channel_layer, broadcast_app_status):
+        get_channel_layer.return_value.group_send = mock.AsyncMock()
+        web, _ = self.deployments
+        self.post(self.events(web, 2))
+        response = self.post(self.events(web, 3))
+        self.assertEqual(response.json(), {"applied": 1, "skipped": 2})
+        self.assertEqual(get_log(web), "step 1\nstep 2\nstep 3\n")
+
+        # events after the deployment has finished are dropped
+        events = self.events(web, 2, first_seq=4)
+        events[0]["status"] = "failed"
+        response = self.post(events)
+        self.assertEqual(response.json(), {"applied": 1, "skipped": 1})
+        web.refresh_from_db()
+        self.assertEqual(web.status, "failed")
+        self.assertNotIn("step 5", get_log(web))
+        self.web.refresh_from_db()
+        self.assertEqual(self.web.status, "created")
+
+    def test_unknown_deployment(self, get_channel_layer, broadcast_app_status):
+        event = {"deployment_uuid": str(uuid.uuid4()), "status": "running"}
+        self.assertEqual(self.post([event]).json(), {"applied": 0, "skipped": 1})
+        get_channel_layer.assert_not_called()
+
+    def test_validation(self, get_channel_layer, broadcast_app_status):
+        web, _ = self.deployments
+        event = self.events(web, 1)[0]
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([{**event, "status": "done"}]).status_code, 400)
+        self.assertEqual(self.post([{**event, "seq": 0}]).status_code, 400)
+        with override_settings(DEPLOY_CALLBACK_MAX_EVENTS=2):
+            self.assertEqual(self.post(self.events(web, 3)).status_code, 400)
+
+    def test_authentication(self, get_channel_layer, broadcast_app_status):
+        web, _ = self.deployments
+        self.assertEqual(self.post(self.events(web, 1), token="wrong").status_code, 403)
+        response = self.client.post(
+            self.url, {"events": self.events(web, 1)}, format="json"
+        )
+        self.assertEqual(response.status_code, 403)
+        with override_settings(OPERATOR_CALLBACK_TOKEN=""):
+            self.assertEqual(self.post(self.events(web, 1), token="").status_code, 403)
+
+        # the single event endpoint checks the token once it is set
+        event = {"deployment_uuid": str(web.uuid), "status": "running", "logs": "x"}
+        response = self.client.post(
+            reverse("deployments"), json.dumps(event), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(get_log(web), "")
+
+
+@mock.patch("shapeblock.deployments.callbacks.broadcast_app_status")
+@mock.patch("shapeblock.deployments.callbacks.get_channel_layer")
+class StatusControllerTestCase(TestCase):
+    """
+    Statuses observed by the controller's informers, fed without a cluster.
+    """
+
+    def setUp(self):
+        self.app = make_app("web", status="building")
+        self.deployment = Deployment.objects.create(
+            user=self.app.user, app=self.app, type="code"
+        )
+        self.service = Service.objects.create(
+            user=self.app.user, project=self.app.project, name="db", type="postgres"
+        )
+        self.controller = StatusController()
+        self.applications, self.helmreleases = self.controller.informers
+
+    def resource(self, name, label, uuid, ready=None, reason="", generation=2):
+        obj = {
+            "metadata": {
+                "name": name,
+                "namespace": "project-web",
+                "labels": {label: str(uuid)},
+                "generation": generation,
+                "resourceVersion": "1",
+            },
+            "status": {"observedGeneration": 2, "conditions": []},
+        }
+        if ready is not None:
+            obj["status"]["conditions"].append(
+                {"type": "Ready", "status": ready, "reason": reason}
+            )
+        return obj
+
+    def application(self, **kwargs):
+        return self.resource(
+            "web", DEPLOYMENT_UUID_LABEL, self.deployment.uuid, **kwargs
+        )
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.controller.flush()
+
+    def test_observed_result(self, get_channel_layer, broadcast_app_status):
+        self.assertIsNone(observed_result(self.application()))
+        self.assertIsNone(observed_result(self.application(ready="Unknown")))
+        self.assertEqual(observed_result(self.application(ready="True")), "success")
+        self.assertEqual(
+            observed_result(self.application(ready="False", reason="InstallFailed")),
+            "failed",
+        )
+        self.assertIsNone(
+            observed_result(self.application(ready="False", reason="Progressing"))
+        )
+        # the status is about the previous spec
+        self.assertIsNone(observed_result(self.application(ready="True", generation=3)))
+
+    def test_application_without_observed_generation(
+        self, get_channel_layer, broadcast_app_status
+    ):
+        # the Ready condition left by the previous deployment
+        obj = self.application(ready="True")
+        del obj["status"]["observedGeneration"]
+        self.assertIsNone(observed_result(obj, require_generation=True))
+        self.applications.replace([obj], "1")
+        self.assertEqual(self.flush(), {"deployments": 0, "services": 0})
+        self.deployment.refresh_from_db()
+        self.app.refresh_from_db()
+        self.assertEqual(
+            (self.deployment.status, self.app.status), ("running", "building")
+        )
+
+        obj["status"]["conditions"][0]["observedGeneration"] = 2
+        self.applications.replace([obj], "2")
+        self.assertEqual(self.flush(), {"deployments": 1, "services": 0})
+
+    def test_deployment_finished(self, get_channel_layer, broadcast_app_status):
+        group_send = get_channel_layer.return_value.group_send = mock.AsyncMock()
+        self.applications.replace([self.application(ready="Unknown")], "1")
+        self.assertEqual(self.flush(), {"deployments": 0, "services": 0})
+
+        event = {"type": "MODIFIED", "object": self.application(ready="True")}
+        self.applications.apply(event)
+        self.assertEqual(self.flush(), {"deployments": 1, "services": 0})
+        self.deployment.refresh_from_db()
+        self.app.refresh_from_db()
+        self.assertEqual(
+            (self.deployment.status, self.app.status), ("success", "ready")
+        )
+        group_send.assert_awaited_once_with(
+            f"deployment_{self.deployment.uuid}",
+            {"type": "deploy_logs", "data": {"log": "", "status": "success"}},
+        )
+        broadcast_app_status.assert_called_once()
+
+        # a resync doesn't touch a finished deployment
+        self.applications.replace([self.application(ready="False", reason="X")], "2")
+        self.assertEqual(self.flush(), {"deployments": 0, "services": 0})
+        self.deployment.refresh_from_db()
+        self.assertEqual(self.deployment.status, "success")
+
+    def test_batches(self, get_channel_layer, broadcast_app_status):
+        get_channel_layer.return_value.group_send = mock.AsyncMock()
+        deployments = [self.deployment] + [
+            Deployment.objects.create(user=self.app.user, app=self.app, type="code")
+            for _ in range(9)
+        ]
+        self.applications.replace(
+            [
+                self.resource(
+                    f"web-{i}", DEPLOYMENT_UUID_LABEL, d.uuid, ready="False", reason="X"
+                )
+                for i, d in enumerate(deployments)
+            ]
+            # not labelled by shapeblock
+            + [self.resource("other", DEPLOYMENT_UUID_LABEL, "x", ready="True")],
+            "1",
+        )
+        # the lock, the deployments and the app, in a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(self.flush(), {"deployments": 10, "services": 0})
+        self.assertEqual(Deployment.objects.filter(status="failed").count(), 10)
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.status, "created")
+
+    def test_service_ready(self, get_channel_layer, broadcast_app_status):
+        release = self.resource("db", SERVICE_UUID_LABEL, self.service.uuid)
+        self.helmreleases.replace([release], "1")
+        self.assertEqual(self.flush(), {"deployments": 0, "services": 0})
+        release = self.resource(
+            "db", SERVICE_UUID_LABEL, self.service.uuid, ready="True"
+        )
+        self.helmreleases.apply({"type": "MODIFIED", "object": release})
+        self.assertEqual(self.flush(), {"deployments": 0, "services": 1})
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.status, "ready")
+        get_channel_layer.assert_not_called()
+
+
+class ReconcileTestCase(TestCase):
+    """
+    Sweeps against a fake API server serving paginated lists.
+    """
+
+    def setUp(self):
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url,
+            KUBE_TOKEN="fake-token",
+            KUBE_RECONCILE_RATE=0,
+            KUBE_LIST_PAGE_SIZE=30,
+            TEST_RUN=False,
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+        self.cluster = defaultdict(list)
+        shapeblock = "/apis/dev.shapeblock.com/v1alpha1"
+        helm = "/apis/helm.toolkit.fluxcd.io/v2beta2/namespaces/(?P<namespace>[^/]+)"
+        self.server.route("GET", f"{shapeblock}/projects", self.list_objects)
+        self.server.route("POST", f"{shapeblock}/projects", self.create_object)
+        self.server.route(
+            "GET",
+            f"{shapeblock}/namespaces/(?P<namespace>[^/]+)/applications",
+            self.list_objects,
+        )
+        self.server.route("GET", f"{helm}/helmreleases", self.list_objects)
+        self.server.route("POST", f"{helm}/helmreleases", self.create_object)
+        self.user = get_user_model().objects.create_user(username="owner")
+
+    def tearDown(self):
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+
+    def list_objects(self, request, namespace=""):
+        items = self.cluster[(namespace, request.path.rsplit("/", 1)[1])]
+        start = int(request.query.get("continue") or 0)
+        end = start + int(request.query["limit"])
+        metadata = {"continue": str(end) if end < len(items) else ""}
+        return 200, {"metadata": metadata, "items": items[start:end]}
+
+    def create_object(self, request, namespace=""):
+        self.cluster[(namespace, request.path.rsplit("/", 1)[1])].append(request.json())
+        return 201, request.json()
+
+    def add(self, namespace, plural, name, label=None, uuid=None, ready=None):
+        obj = {
+            "metadata": {"name": name, "labels": {label: str(uuid)} if label else {}}
+        }
+        if ready:
+            obj["status"] = {"conditions": [{"type": "Ready", "status": "True"}]}
+        self.cluster[(namespace, plural)].append(obj)
+
+    def add_project(self, name):
+        project = Project.objects.create(user=self.user, name=name, display_name=name)
+        self.add("", "projects", name, "shapeblock.com/project-uuid", project.uuid)
+        return project
+
+    def test_in_sync(self):
+        projects = [self.add_project(f"project-{i}") for i in range(20)]
+        apps = App.objects.bulk_create(
+            App(
+                name=f"app-{i}",
+                user=self.user,
+                project=project,
+                stack="php",
+                repo=f"https://github.com/shapeblock/app-{i}.git",
+                sb_yml={},
+                status="ready",
+            )
+            for project in projects
+            for i in range(100)
+        )
+        for app in apps:
+            self.add(
+                app.project.name,
+                "applications",
+                app.name,
+                "shapeblock.com/app-uuid",
+                app.uuid,
+            )
+        for project in projects:
+            service = Service.objects.create(
+                user=self.user, project=project, name="db", type="postgres"
+            )
+            self.add(
+                project.name, "helmreleases", "db", SERVICE_UUID_LABEL, service.uuid
+            )
+
+        reconciler = Reconciler(repair=True)
+        # projects, apps and services
+        with self.assertNumQueries(3):
+            self.assertEqual(reconciler.run(), [])
+        # one request per page: a page of projects, 4 of apps and one of
+        # services per namespace
+        self.assertEqual(reconciler.requests, 1 + 20 * 4 + 20)
+        self.assertEqual(len(self.server.requests), reconciler.requests)
+        self.assertEqual({r.method for r in self.server.requests}, {"GET"})
+
+    def test_drift(self):
+        self.add_project("demo")
+        missing = Project.objects.create(
+            user=self.user, name="missing", display_name="Missing"
+        )
+        self.add("", "projects", "gone", "shapeblock.com/project-uuid", "x")
+
+        web = make_app("web", user=self.user, project=missing, status="ready")
+        Deployment.objects.create(
+            user=self.user, app=web, type="code", ref="a" * 40, status="success"
+        )
+        make_app("new", user=self.user, project=missing, status="created")
+        make_app("api", user=self.user, project=missing, status="ready")
+        self.add("missing", "applications", "api", "shapeblock.com/app-uuid", "x")
+        self.add("missing", "applications", "old", "shapeblock.com/app-uuid", "y")
+        # not managed by shapeblock
+        self.add("missing", "applications", "manual")
+
+        db = Service.objects.create(
+            user=self.user, project=missing, name="db", type="postgres"
+        )
+        cache = Service.objects.create(
+            user=self.user, project=missing, name="cache", type="redis"
+        )
+        self.add(
+            "missing", "helmreleases", "cache", SERVICE_UUID_LABEL, cache.uuid, True
+        )
+        self.add("missing", "helmreleases", "other", SERVICE_UUID_LABEL, "z")
+
+        expected = {
+            "Project missing: missing",
+            "Project gone: has no project",
+            "Application missing/web: missing",
+            "Application missing/api: has another uuid",
+            "Application missing/old: has no app",
+            "HelmRelease missing/db: missing",
+            "Service missing/cache: is ready",
+            "HelmRelease missing/other: has no service",
+        }
+        drift = Reconciler().run()
+        self.assertEqual({str(item) for item in drift}, expected)
+        self.assertEqual({r.method for r in self.server.requests}, {"GET"})
+        self.assertEqual(Deployment.objects.count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            drift = Reconciler(repair=True).run()
+        repaired = {str(item) for item in drift if item.repaired}
+        self.assertEqual(
+            repaired,
+            {
+                "Project missing: missing (repaired)",
+                "Application missing/web: missing (repaired)",
+                "HelmRelease missing/db: missing (repaired)",
+                "Service missing/cache: is ready (repaired)",
+            },
+        )
+        deployment = Deployment.objects.exclude(status="success").get()
+        self.assertEqual((deployment.app, deployment.ref), (web, "a" * 40))
+        self.assertTrue(DeploymentJob.objects.filter(deployment=deployment).exists())
+        cache.refresh_from_db()
+        self.assertEqual(cache.status, "ready")
+
+        drift = Reconciler(repair=True).run()
+        self.assertEqual(
+            {str(item) for item in drift},
+            {
+                "Project gone: has no project",
+                "Application missing/web: missing",
+                "Application missing/api: has another uuid",
+                "Application missing/old: has no app",
+                "HelmRelease missing/other: has no service",
+            },
+        )
+
+    def test_rate_limit(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(2, burst=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(6):
+            limiter.wait()
+        self.assertEqual(sleeps, [0.5, 0.5, 0.5, 0.5])
+        now[0] += 10
+        limiter.wait()
+        self.assertEqual(len(sleeps), 4)
@@ -1,24 +1,36 @@
 import logging
 import json
 import base64
+import hmac
+import uuid
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from django.views import View
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.utils.decorators import method_decorator
+from django.middleware.gzip import GZipMiddleware
+from django.utils.decorators import decorator_from_middleware, method_decorator
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import BasePermission, IsAuthenticated, IsAdminUser
 
-from rest_framework.generics import ListCreateAPIView
+from rest_framework.generics import ListAPIView, ListCreateAPIView
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
 from .models import Deployment, App
-from .serializers import DeploymentSerializer, DeploymentReadSerializer
-from shapeblock.apps.kubernetes import run_deploy_pipeline
+from .serializers import (
+    DeploymentSerializer,
+    DeploymentReadSerializer,
+    DeploymentLogChunkSerializer,
+    DeploymentEventBatchSerializer,
+)
 from shapeblock.apps.utils import get_kubeconfig
+from .callbacks import apply_events
+from .logs import read_log, seq_offset, stream_log
+from .queue import enqueue_deployment, queue_stats
 
 logger = logging.getLogger("django")
 
@@ -44,8 +56,7 @@ class DeploymentListCreateAPIView(ListCreateAPIView):
         deployment = serializer.save(app=app)
         # TODO: check for same ref deploy
         # TODO: do a diff between previous and current deploy variables
-        # TODO: check for deployment pipeline creation status
-        run_deploy_pipeline(deployment)
+        enqueue_deployment(deployment)
         app.status = "building"
         app.save()
 
@@ -54,7 +65,7 @@ class DeploymentListCreateAPIView(ListCreateAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
         return Response(
-            {"uuid": serializer.instance.uuid}, status=status.HTTP_201_CREATED
+            {"uuid": serializer.instance.uuid}, status=status.HTTP_202_ACCEPTED
         )
 
     def list(self, request, *args, **kwargs):
@@ -63,63 +74,170 @@ class DeploymentListCreateAPIView(ListCreateAPIView):
         return Response(serializer.data)
 
 
+def has_operator_token(request) -> bool:
+    token = settings.OPERATOR_CALLBACK_TOKEN
+    scheme, _, value = request.headers.get("Authorization", "").partition(" ")
+    return bool(token) and (
+        scheme.lower() == "bearer"
+        and hmac.compare_digest(value.encode("utf-8"), token.encode("utf-8"))
+    )
+
+
+class IsOperator(BasePermission):
+    def has_permission(self, request, view):
+        return has_operator_token(request)
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class UpdateDeploymentView(View):
+    """
+    A single event from the operator, see `DeploymentEventsView` for batches.
+    """
+
     def post(self, request, **kwargs):
-        decoded_body = request.body.decode("utf-8")
-        data = json.loads(decoded_body)
-        logger.debug(decoded_body)
-        deployment = Deployment.objects.get(uuid=data["deployment_uuid"])
-        if deployment.status != "running":
+        if settings.OPERATOR_CALLBACK_TOKEN and not has_operator_token(request):
+            return JsonResponse({}, status=403)
+        data = json.loads(request.body)
+        logger.debug(data)
+        event = {
+            "deployment_uuid": uuid.UUID(data["deployment_uuid"]),
+            "status": data["status"],
+            "logs": data.get("logs") or "",
+            "pod": data.get("pod"),
+        }
+        if not apply_events([event])["applied"]:
             # Don't update the status if deployment isn't running.
-            return JsonResponse(
-                {},
-                status=202,
-            )
-        pod_name = data.get("pod")
-        if pod_name:
-            deployment.pod = pod_name
-        deployment.status = data["status"]
-        if deployment.log:
-            deployment.log += data["logs"]
-        else:
-            deployment.log = data["logs"]
-        deployment.save()
-        if deployment.status == "failed":
-            # TODO: fetch app previous status
-            deployment.app.status = "created"
-            deployment.app.save()
-        if deployment.status == "success":
-            deployment.app.status = "ready"
-            deployment.app.save()
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"deployment_{deployment.uuid}",
+            return JsonResponse({}, status=202)
+        return JsonResponse({}, status=200)
+
+
+class DeploymentEventsView(APIView):
+    """
+    Batches of status and log events from the operator, for any number of
+    deployments. Events are applied once per their `seq`, so a failed request
+    can be sent again as it is.
+    """
+
+    authentication_classes = []
+    permission_classes = [IsOperator]
+
+    def post(self, request, *args, **kwargs):
+        serializer = DeploymentEventBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(apply_events(serializer.validated_data["events"]))
+
+
+class DeploymentLogPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = "seq"
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only used to negotiate the tail mode, and for errors
+        return json.dumps(data)
+
+
+class BufferedGZipMiddleware(GZipMiddleware):
+    """
+    Leaves streamed responses alone: gzip doesn't flush every event of a
+    Server-Sent Events tail, so the client would get them late and in bursts.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        return super().process_response(request, response)
+
+
+gzip_unless_streaming = decorator_from_middleware(BufferedGZipMiddleware)
+
+
+@method_decorator(gzip_unless_streaming, name="dispatch")
+class DeploymentLogView(ListAPIView):
+    """
+    The log of a deployment, in one of three ways:
+
+    - a paginated list of chunks in append order,
+    - a byte range with `?offset=` and/or `?limit=`,
+    - a Server-Sent Events tail when requested with `Accept: text/event-stream`,
+      starting at `?offset=`, `?seq=` or the `Last-Event-ID` header.
+
+    The list and ranges are gzip compressed, the tail isn't.
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = DeploymentLogChunkSerializer
+    pagination_class = DeploymentLogPagination
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, EventStreamRenderer]
+    max_range = 1024 * 1024
+
+    def get_deployment(self):
+        return get_object_or_404(
+            Deployment,
+            uuid=self.kwargs["deployment_uuid"],
+            app__uuid=self.kwargs["app_uuid"],
+            app__user=self.request.user,
+        )
+
+    def get_queryset(self):
+        return self.get_deployment().log_chunks.all()
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        if request.accepted_renderer.format == "sse":
+            return self.tail(request)
+        if "offset" in params or "limit" in params:
+            return self.range(request)
+        return super().get(request, *args, **kwargs)
+
+    def get_int(self, value, name):
+        if value is None or value == "":
+            return None
+        if not str(value).isdigit():
+            raise ValidationError({name: "A non-negative integer is required."})
+        return int(value)
+
+    def range(self, request):
+        deployment = self.get_deployment()
+        offset = self.get_int(request.query_params.get("offset"), "offset") or 0
+        limit = self.get_int(request.query_params.get("limit"), "limit")
+        limit = min(limit or self.max_range, self.max_range)
+        text, next_offset = read_log(deployment, offset, limit)
+        return Response(
             {
-                "type": "deploy_logs",
-                "data": {"log": data["logs"], "status": data["status"]},
-            },
+                "offset": offset,
+                "next_offset": next_offset,
+                "log_size": deployment.log_size,
+                "status": deployment.status,
+                "data": text,
+            }
         )
 
-        # Update websocket inf deployment is finished
-        if deployment.status in ["failed", "success"]:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"apps",
-                {
-                    "type": "app_status_message",
-                    "data": {
-                        "uuid": str(deployment.app.uuid),
-                        "status": deployment.app.status,
-                    },
-                },
-            )
-
-        return JsonResponse(
-            {},
-            status=200,
+    def tail(self, request):
+        deployment = self.get_deployment()
+        offset = self.get_int(request.query_params.get("offset"), "offset")
+        seq = self.get_int(request.query_params.get("seq"), "seq")
+        last_event_id = self.get_int(
+            request.headers.get("Last-Event-ID"), "Last-Event-ID"
         )
+        if last_event_id is not None:
+            # event ids are byte offsets
+            offset = last_event_id
+        elif offset is None and seq is not None:
+            offset = seq_offset(deployment, seq)
+        response = StreamingHttpResponse(
+            stream_log(deployment, offset or 0), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 
 class PodInfoView(APIView):
@@ -136,3 +254,10 @@ class PodInfoView(APIView):
         }
         logger.debug(response_data)
         return Response(response_data)
+
+
+class DeploymentQueueView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(queue_stats())
@@ -1,9 +1,9 @@
 import logging
 import yaml
-from kubernetes import client, config
 
 from django.template.loader import render_to_string
 from django.conf import settings
+from shapeblock.utils.kubernetes import custom_objects_api
 from .models import Project
 
 logger = logging.getLogger("django")
@@ -15,13 +15,12 @@ def run_setup_project(project: Project):
         logger.debug("--- TEST RUN ---")
         return
     try:
-        config.load_incluster_config()
+        api = custom_objects_api()
     # TODO: show we throw the exception instead of handling it
     except Exception as error:
         logger.error(error)
         logger.error(f"Unable to get cluster config for {project.name}.")
         return
-    api = client.CustomObjectsApi()
     data = {
         "project_uuid": project.uuid,
         "project_name": project.name,
@@ -43,8 +42,7 @@ def run_delete_project(project: Project):
     if settings.TEST_RUN:
         logger.debug("--- TEST RUN ---")
         return
-    config.load_incluster_config()
-    api = client.CustomObjectsApi()
+    api = custom_objects_api()
     try:
         response = api.delete_cluster_custom_object(
             group="dev.shapeblock.com",
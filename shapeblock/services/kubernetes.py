@@ -1,11 +1,13 @@
 import logging
 import yaml
 
-from kubernetes import client, config
+from kubernetes import client
 from kubernetes.client.rest import ApiException
 
 from django.template.loader import render_to_string
 
+from shapeblock.utils import watch_cache
+from shapeblock.utils.kubernetes import apps_v1_api, custom_objects_api
 from .models import Service
 
 logger = logging.getLogger("django")
@@ -13,8 +15,7 @@ logger = logging.getLogger("django")
 
 def create_service(service: Service):
     logger.info(f"Creating service {service.name} of type {service.type}.")
-    config.load_incluster_config()
-    api = client.CustomObjectsApi()
+    api = custom_objects_api()
     sb_config = {
         "service_uuid": str(service.uuid),
         "name": service.name,
@@ -52,8 +53,7 @@ def create_service(service: Service):
 
 def delete_service(service: Service):
     logger.info(f"Deleting service {service.name} of type {service.type}.")
-    config.load_incluster_config()
-    api = client.CustomObjectsApi()
+    api = custom_objects_api()
     try:
         response = api.delete_namespaced_custom_object(
             group="helm.toolkit.fluxcd.io",
@@ -77,11 +77,19 @@ def is_statefulset_ready(service: Service):
     Check if a StatefulSet in the given namespace is ready.
     :return: bool, True if the StatefulSet is ready, False otherwise
     """
-    # Load the kube config
-    config.load_incluster_config()
     namespace = service.project.name
-    # Create an API instance
-    api_instance = client.AppsV1Api()
+    informer = watch_cache.get_informer("statefulsets")
+    if informer is not None:
+        statefulset = informer.get(namespace, service.service_statefulset)
+        if statefulset is None:
+            return False
+        desired_replicas = statefulset["spec"].get("replicas")
+        current_ready_replicas = statefulset.get("status", {}).get("readyReplicas")
+        if desired_replicas is None or current_ready_replicas is None:
+            return False
+        return desired_replicas == current_ready_replicas
+
+    api_instance = apps_v1_api()
 
     try:
         # Get the specified StatefulSet
@@ -15,7 +15,6 @@ from pathlib import Path
 import os
 import environ
 
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent
 
@@ -110,6 +109,8 @@ AUTHENTICATION_BACKENDS = (
 
 DATABASES = {"default": env.db()}
 
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -216,6 +217,16 @@ GITHUB_TOKEN = env("GITHUB_TOKEN")
 GITHUB_CLIENT_KEY = env("GITHUB_CLIENT_KEY", default="")
 GITHUB_CLIENT_SECRET = env("GITHUB_CLIENT_SECRET", default="")
 
+# GitHub API clients, one per token, and their shared response cache
+GITHUB_API_URL = env("GITHUB_API_URL", default="https://api.github.com")
+GITHUB_CACHE_TTL = env.float("GITHUB_CACHE_TTL", default=60)
+GITHUB_CACHE_MAX_ENTRIES = env.int("GITHUB_CACHE_MAX_ENTRIES", default=1024)
+GITHUB_CLIENT_POOL_SIZE = env.int("GITHUB_CLIENT_POOL_SIZE", default=64)
+# concurrent repository searches per request, one per org
+GITHUB_SEARCH_WORKERS = env.int("GITHUB_SEARCH_WORKERS", default=4)
+# parsed `.sb.yml` files are cached per commit
+SB_YML_CACHE_TIMEOUT = env.int("SB_YML_CACHE_TIMEOUT", default=7 * 24 * 3600)
+
 CHART_VERSION = env("CHART_VERSION", default="0.2.0")
 
 # DRF spectacular
@@ -239,6 +250,15 @@ CHANNEL_LAYERS = {
     }
 }
 
+# app status updates arriving within this many seconds are sent as one frame
+APP_STATUS_COALESCE_WINDOW = env.float("APP_STATUS_COALESCE_WINDOW", default=0.25)
+# pod log lines arriving within POD_LOG_BATCH_INTERVAL seconds are sent as one
+# frame of up to POD_LOG_BATCH_MAX_LINES lines. Every viewer buffers up to
+# POD_LOG_VIEWER_QUEUE_SIZE frames, slow viewers lose the oldest.
+POD_LOG_BATCH_INTERVAL = env.float("POD_LOG_BATCH_INTERVAL", default=0.1)
+POD_LOG_BATCH_MAX_LINES = env.int("POD_LOG_BATCH_MAX_LINES", default=500)
+POD_LOG_VIEWER_QUEUE_SIZE = env.int("POD_LOG_VIEWER_QUEUE_SIZE", default=100)
+
 ADMIN_URL = env("ADMIN_URL", default="admin/")
 
 if DEBUG:
@@ -260,6 +280,63 @@ else:
 
 CLUSTER_DOMAIN = env("CLUSTER_DOMAIN", default="example.com")
 
+# Kubernetes API client
+# Leave KUBE_SERVER empty to use the in-cluster service account.
+KUBE_SERVER = env("KUBE_SERVER", default="")
+KUBE_TOKEN = env("KUBE_TOKEN", default="")
+KUBE_VERIFY_SSL = env.bool("KUBE_VERIFY_SSL", default=True)
+KUBE_POOL_MAXSIZE = env.int("KUBE_POOL_MAXSIZE", default=10)
+KUBE_TCP_KEEPALIVE = env.bool("KUBE_TCP_KEEPALIVE", default=True)
+# In-memory cache of pods, StatefulSets and Applications kept current by watches,
+# see `shapeblock.utils.watch_cache`. Watch requests last KUBE_WATCH_TIMEOUT
+# seconds, everything is listed again every KUBE_WATCH_RESYNC seconds.
+KUBE_WATCH_CACHE = env.bool("KUBE_WATCH_CACHE", default=True)
+KUBE_WATCH_TIMEOUT = env.int("KUBE_WATCH_TIMEOUT", default=300)
+KUBE_WATCH_RESYNC = env.int("KUBE_WATCH_RESYNC", default=900)
+KUBE_WATCH_RETRY_DELAY = env.int("KUBE_WATCH_RETRY_DELAY", default=5)
+# Update Applications with server-side apply instead of a merge patch
+KUBE_SERVER_SIDE_APPLY = env.bool("KUBE_SERVER_SIDE_APPLY", default=False)
+# `manage.py reconcile_cluster` lists objects in pages of KUBE_LIST_PAGE_SIZE
+# and makes at most KUBE_RECONCILE_RATE API requests per second (0 for no limit)
+KUBE_LIST_PAGE_SIZE = env.int("KUBE_LIST_PAGE_SIZE", default=500)
+KUBE_RECONCILE_RATE = env.float("KUBE_RECONCILE_RATE", default=10)
+
+# Deployment job queue, drained by `manage.py deploy_worker`
+DEPLOY_WORKER_CONCURRENCY = env.int("DEPLOY_WORKER_CONCURRENCY", default=4)
+DEPLOY_WORKER_POLL_INTERVAL = env.float("DEPLOY_WORKER_POLL_INTERVAL", default=1.0)
+DEPLOY_JOB_MAX_ATTEMPTS = env.int("DEPLOY_JOB_MAX_ATTEMPTS", default=5)
+# seconds, doubled on every retry
+DEPLOY_JOB_RETRY_DELAY = env.int("DEPLOY_JOB_RETRY_DELAY", default=5)
+DEPLOY_JOB_MAX_RETRY_DELAY = env.int("DEPLOY_JOB_MAX_RETRY_DELAY", default=300)
+# running jobs older than this are considered abandoned by their worker, and
+# requeued by the workers every DEPLOY_JOB_REQUEUE_INTERVAL seconds
+DEPLOY_JOB_TIMEOUT = env.int("DEPLOY_JOB_TIMEOUT", default=600)
+DEPLOY_JOB_REQUEUE_INTERVAL = env.int("DEPLOY_JOB_REQUEUE_INTERVAL", default=60)
+# `manage.py deployment_status_controller` writes the statuses it observed in
+# the cluster every DEPLOY_STATUS_FLUSH_INTERVAL seconds
+DEPLOY_STATUS_FLUSH_INTERVAL = env.float("DEPLOY_STATUS_FLUSH_INTERVAL", default=1.0)
+# `manage.py compact_deployment_logs` merges the log chunks of finished
+# deployments older than DEPLOY_LOG_COMPACT_AFTER seconds into chunks of up to
+# DEPLOY_LOG_CHUNK_MAX_SIZE bytes.
+DEPLOY_LOG_CHUNK_MAX_SIZE = env.int("DEPLOY_LOG_CHUNK_MAX_SIZE", default=1024 * 1024)
+DEPLOY_LOG_COMPACT_AFTER = env.int("DEPLOY_LOG_COMPACT_AFTER", default=3600)
+# Log tails (Server-Sent Events) poll for new chunks every DEPLOY_LOG_POLL_INTERVAL
+# seconds and are closed after DEPLOY_LOG_TAIL_TIMEOUT seconds, clients resume
+# with `Last-Event-ID`.
+DEPLOY_LOG_POLL_INTERVAL = env.float("DEPLOY_LOG_POLL_INTERVAL", default=1.0)
+DEPLOY_LOG_TAIL_TIMEOUT = env.int("DEPLOY_LOG_TAIL_TIMEOUT", default=300)
+# Pushes start their deployment after DEPLOY_WEBHOOK_DEBOUNCE seconds without a
+# newer push to the app, but no later than DEPLOY_WEBHOOK_MAX_DELAY seconds after
+# the first of them. `manage.py prune_webhook_deliveries` removes delivery ids
+# older than WEBHOOK_DELIVERY_RETENTION seconds.
+DEPLOY_WEBHOOK_DEBOUNCE = env.int("DEPLOY_WEBHOOK_DEBOUNCE", default=10)
+DEPLOY_WEBHOOK_MAX_DELAY = env.int("DEPLOY_WEBHOOK_MAX_DELAY", default=60)
+WEBHOOK_DELIVERY_RETENTION = env.int("WEBHOOK_DELIVERY_RETENTION", default=7 * 86400)
+# The operator reports deployment events with `Authorization: Bearer <token>`.
+# Required by the batch endpoint, and by the single event one once set.
+OPERATOR_CALLBACK_TOKEN = env("OPERATOR_CALLBACK_TOKEN", default="")
+DEPLOY_CALLBACK_MAX_EVENTS = env.int("DEPLOY_CALLBACK_MAX_EVENTS", default=1000)
+
 
 FERNET_KEYS = env.list("FERNET_KEYS")
 CONTROL_PLANE_IP = env("CONTROL_PLANE_IP")
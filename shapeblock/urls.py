@@ -2,9 +2,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.urls import path, include
-from shapeblock.deployments.views import UpdateDeploymentView, PodInfoView
+from shapeblock.deployments.views import (
+    UpdateDeploymentView,
+    DeploymentEventsView,
+    PodInfoView,
+    DeploymentQueueView,
+)
 from shapeblock.services.views import UpdateServiceDeploymentView
-from shapeblock.apps.views import ShellInfoView, webhook_view
+from shapeblock.apps.views import GithubCacheView, ShellInfoView, webhook_view
 from rest_framework.authtoken import views
 from shapeblock.authentication.views import (
     AddUserGithubTokenAPIView,
@@ -23,6 +28,16 @@ urlpatterns = [
         name="service-deployments",
     ),
     path("deployments/", UpdateDeploymentView.as_view(), name="deployments"),
+    path(
+        "deployments/events/",
+        DeploymentEventsView.as_view(),
+        name="deployment-events",
+    ),
+    path(
+        "api/deployment-queue/",
+        DeploymentQueueView.as_view(),
+        name="deployment-queue",
+    ),
     path(
         "deployments/<uuid:deployment_uuid>/pod-info/",
         PodInfoView.as_view(),
@@ -38,5 +53,6 @@ urlpatterns = [
         GithubClientInfoAPIView.as_view(),
         name="github-client-info",
     ),
+    path("api/github-cache/", GithubCacheView.as_view(), name="github-cache"),
     path("webhook/", webhook_view, name="webhook"),
 ]
@@ -0,0 +1,98 @@
+import logging
+import socket
+import threading
+
+from kubernetes import client, config
+from urllib3.connection import HTTPConnection
+
+from django.conf import settings
+
+logger = logging.getLogger("django")
+
+_lock = threading.Lock()
+_api_client = None
+_apis = {}
+
+
+def get_configuration() -> client.Configuration:
+    """
+    Build the client configuration, either for an explicitly configured API server
+    (local development, fake servers in tests) or from the pod's service account.
+    """
+    configuration = client.Configuration()
+    if settings.KUBE_SERVER:
+        configuration.host = settings.KUBE_SERVER
+        configuration.verify_ssl = settings.KUBE_VERIFY_SSL
+        if settings.KUBE_TOKEN:
+            configuration.api_key["authorization"] = settings.KUBE_TOKEN
+            configuration.api_key_prefix["authorization"] = "Bearer"
+    else:
+        # The loader installs a refresh hook which re-reads the projected
+        # service account token once a minute, so rotated tokens get picked up.
+        config.load_incluster_config(
+            client_configuration=configuration, try_refresh_token=True
+        )
+    configuration.connection_pool_maxsize = settings.KUBE_POOL_MAXSIZE
+    return configuration
+
+
+def _enable_keepalive(api_client: client.ApiClient):
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    # Applied to every connection pool the manager creates from now on.
+    api_client.rest_client.pool_manager.connection_pool_kw["socket_options"] = (
+        socket_options
+    )
+
+
+def get_api_client() -> client.ApiClient:
+    """
+    Return the process wide API client, creating it on first use.
+    All API objects share its urllib3 pool, so connections are reused across requests.
+    """
+    global _api_client
+    if _api_client is not None:
+        return _api_client
+    with _lock:
+        if _api_client is None:
+            logger.info("Initialising kubernetes API client.")
+            api_client = client.ApiClient(configuration=get_configuration())
+            if settings.KUBE_TCP_KEEPALIVE:
+                _enable_keepalive(api_client)
+            _api_client = api_client
+    return _api_client
+
+
+def _get_api(api_class):
+    api = _apis.get(api_class)
+    if api is None:
+        api_client = get_api_client()
+        with _lock:
+            api = _apis.setdefault(api_class, api_class(api_client))
+    return api
+
+
+def core_v1_api() -> client.CoreV1Api:
+    return _get_api(client.CoreV1Api)
+
+
+def apps_v1_api() -> client.AppsV1Api:
+    return _get_api(client.AppsV1Api)
+
+
+def custom_objects_api() -> client.CustomObjectsApi:
+    return _get_api(client.CustomObjectsApi)
+
+
+def reset_api_client():
+    """
+    Drop the shared client and its pooled connections.
+    The next API call builds a fresh one from the current settings.
+    """
+    global _api_client
+    with _lock:
+        if _api_client is not None:
+            _api_client.rest_client.pool_manager.clear()
+        _api_client = None
+        _apis.clear()
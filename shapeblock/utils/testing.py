@@ -0,0 +1,144 @@
+import json
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeRequest:
+    def __init__(self, method, path, query, headers, body, client_address):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.client_address = client_address
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class FakeAPIServer:
+    """
+    A small threaded HTTP/1.1 server for exercising API clients in tests.
+
+    Routes map a method and a path regex to either a static response or a callable
+    taking the `FakeRequest` and returning `(status, body)` or `(status, body, headers)`.
+    Dict and list bodies are sent as JSON. Every request is recorded in `requests`.
+
+        with FakeAPIServer() as server:
+            server.route("GET", r"/api/v1/namespaces/(?P<ns>[^/]+)/pods", (200, {...}))
+            requests.get(f"{server.url}/api/v1/namespaces/default/pods")
+    """
+
+    def __init__(self):
+        self.routes = []
+        self.requests = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def route(self, method, path, response):
+        self.routes.insert(0, (method, re.compile(path), response))
+
+    def dispatch(self, request):
+        for method, pattern, response in self.routes:
+            match = pattern.fullmatch(request.path)
+            if method != request.method or not match:
+                continue
+            if callable(response):
+                response = response(request, **match.groupdict())
+            return response
+        return 404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients going away mid-response, e.g. a cancelled stream
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _handler_for(fake_server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def handle_request(self):
+            parsed = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            request = FakeRequest(
+                self.command,
+                parsed.path,
+                {k: v[-1] for k, v in parse_qs(parsed.query).items()},
+                self.headers,
+                body,
+                self.client_address,
+            )
+            fake_server.requests.append(request)
+            status, payload, *rest = fake_server.dispatch(request)
+            headers = dict(rest[0]) if rest else {}
+            if isinstance(payload, (dict, list)):
+                payload = json.dumps(payload)
+                headers.setdefault("Content-Type", "application/json")
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            payload = payload or b""
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = handle_request
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_app(name="web", user=None, project=None, **fields):
+    """
+    Create an app (and its owner and project when not given) without touching GitHub.
+    """
+    from django.contrib.auth import get_user_model
+    from shapeblock.apps.models import App
+    from shapeblock.projects.models import Project
+
+    if user is None:
+        user = get_user_model().objects.create_user(
+            username=f"user-{name}", password="password"
+        )
+    if project is None:
+        project = Project.objects.create(
+            user=user, display_name=f"Project {name}", name=f"project-{name}"
+        )
+    fields.setdefault("stack", "php")
+    fields.setdefault("repo", f"https://github.com/shapeblock/{name}.git")
+    fields.setdefault("sb_yml", {"name": name, "type": fields["stack"]})
+    return App.objects.create(name=name, user=user, project=project, **fields)
@@ -0,0 +1,251 @@
+import json
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from shapeblock.apps.kubernetes import get_app_pod
+from shapeblock.apps.pod_logs import list_app_pods
+from shapeblock.utils import kubernetes, watch_cache
+from shapeblock.utils.testing import FakeAPIServer, make_app
+
+POD_LIST = {
+    "kind": "PodList",
+    "apiVersion": "v1",
+    "metadata": {},
+    "items": [{"metadata": {"name": "web-0", "namespace": "demo"}}],
+}
+
+
+class KubernetesClientPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeAPIServer().start()
+        self.server.route("GET", r"/api/v1/namespaces/demo/pods", (200, POD_LIST))
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url, KUBE_TOKEN="fake-token"
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+
+    def tearDown(self):
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+
+    def test_client_is_shared(self):
+        clients = []
+        threads = [
+            threading.Thread(target=lambda: clients.append(kubernetes.get_api_client()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(c) for c in clients}), 1)
+        self.assertIs(kubernetes.core_v1_api(), kubernetes.core_v1_api())
+        self.assertIs(
+            kubernetes.core_v1_api().api_client,
+            kubernetes.custom_objects_api().api_client,
+        )
+
+    def test_connections_are_reused(self):
+        v1 = kubernetes.core_v1_api()
+        for _ in range(3):
+            pods = v1.list_namespaced_pod("demo")
+            self.assertEqual(pods.items[0].metadata.name, "web-0")
+        self.assertEqual(len(self.server.requests), 3)
+        # a single keep-alive connection served all the calls
+        self.assertEqual(len({r.client_address for r in self.server.requests}), 1)
+        self.assertEqual(
+            self.server.requests[0].headers["Authorization"], "Bearer fake-token"
+        )
+
+    def test_reset_picks_up_new_settings(self):
+        first = kubernetes.get_api_client()
+        with FakeAPIServer() as other:
+            with override_settings(KUBE_SERVER=other.url):
+                kubernetes.reset_api_client()
+                second = kubernetes.get_api_client()
+                self.assertIsNot(first, second)
+                self.assertEqual(second.configuration.host, other.url)
+
+
+class FakeWatchMixin:
+    """
+    A fake API server listing and watching pods. Events put on `self.events`
+    are streamed to the current watch request, which ends after
+    `watch_duration` seconds like a server side timeout.
+    """
+
+    watch_duration = 0.2
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeAPIServer().start()
+        self.settings_override = override_settings(
+            KUBE_SERVER=self.server.url,
+            KUBE_TOKEN="fake-token",
+            KUBE_WATCH_CACHE=True,
+            KUBE_WATCH_RETRY_DELAY=0,
+        )
+        self.settings_override.enable()
+        kubernetes.reset_api_client()
+        self.pods = [self.pod("web-1", "1"), self.pod("api-0", "2", app="api")]
+        self.resource_version = 10
+        self.events = queue.Queue()
+        self.server.route("GET", r"/api/v1/pods", self.pod_requests)
+
+    def tearDown(self):
+        watch_cache.stop(wait=5)
+        kubernetes.reset_api_client()
+        self.settings_override.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def pod(self, name, resource_version, app="web", namespace="demo"):
+        return {
+            "metadata": {
+                "name": name,
+                "namespace": namespace,
+                "labels": {"appUuid": app},
+                "resourceVersion": resource_version,
+            }
+        }
+
+    def pod_requests(self, request):
+        if request.query.get("watch", "").lower() != "true":
+            body = {
+                "kind": "PodList",
+                "metadata": {"resourceVersion": str(self.resource_version)},
+                "items": self.pods,
+            }
+            return 200, body
+        lines = []
+        deadline = time.monotonic() + self.watch_duration
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            lines.append(json.dumps(event))
+            if event["type"] == "ERROR":
+                break
+        return 200, "".join(f"{line}\n" for line in lines)
+
+    def list_requests(self):
+        return [
+            r
+            for r in self.server.requests
+            if r.query.get("watch", "").lower() != "true"
+        ]
+
+    def watch_requests(self):
+        return [
+            r
+            for r in self.server.requests
+            if r.query.get("watch", "").lower() == "true"
+        ]
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the watch cache.")
+            time.sleep(0.01)
+
+
+class WatchCacheTestCase(FakeWatchMixin, SimpleTestCase):
+    def test_list_and_watch(self):
+        self.assertIsNone(watch_cache.get_informer("pods"))
+        watch_cache.start(["pods"])
+        self.wait_for(lambda: watch_cache.get_informer("pods") is not None)
+        informer = watch_cache.get_informer("pods")
+        self.assertEqual(
+            [pod["metadata"]["name"] for pod in informer.by_app("demo", "web")],
+            ["web-1"],
+        )
+        self.assertIsNone(informer.get("other", "web-1"))
+
+        self.events.put({"type": "ADDED", "object": self.pod("web-0", "11")})
+        self.events.put({"type": "DELETED", "object": self.pod("web-1", "12")})
+        self.events.put(
+            {"type": "MODIFIED", "object": self.pod("api-0", "13", app="web")}
+        )
+        self.wait_for(lambda: informer.resource_version == "13")
+        self.assertEqual(
+            [pod["metadata"]["name"] for pod in informer.by_app("demo", "web")],
+            ["api-0", "web-0"],
+        )
+        self.assertEqual(informer.by_app("demo", "api"), [])
+
+        # later watches resume from the last event, and bookmarks
+        self.events.put(
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "20"}}}
+        )
+        self.wait_for(lambda: informer.resource_version == "20")
+        self.wait_for(
+            lambda: self.watch_requests()[-1].query.get("resourceVersion") == "20"
+        )
+        self.assertEqual(self.watch_requests()[0].query["resourceVersion"], "10")
+        self.assertEqual(len(self.list_requests()), 1)
+
+    def test_expired_watch_lists_again(self):
+        watch_cache.start(["pods"])
+        self.wait_for(lambda: watch_cache.get_informer("pods") is not None)
+        self.pods = [self.pod("web-2", "30")]
+        self.resource_version = 30
+        self.events.put(
+            {
+                "type": "ERROR",
+                "object": {"kind": "Status", "code": 410, "message": "too old"},
+            }
+        )
+        self.wait_for(lambda: len(self.list_requests()) == 2)
+        self.wait_for(lambda: watch_cache.get_informer("pods") is not None)
+        informer = watch_cache.get_informer("pods")
+        self.assertEqual(
+            [pod["metadata"]["name"] for pod in informer.by_app("demo", "web")],
+            ["web-2"],
+        )
+
+    @override_settings(KUBE_WATCH_RESYNC=0)
+    def test_resync(self):
+        watch_cache.start(["pods"])
+        self.wait_for(lambda: len(self.list_requests()) >= 3)
+
+    def test_disabled(self):
+        with override_settings(KUBE_WATCH_CACHE=False):
+            watch_cache.start()
+        time.sleep(0.1)
+        self.assertIsNone(watch_cache.get_informer("pods"))
+        self.assertEqual(self.server.requests, [])
+
+
+class WatchCacheReadsTestCase(FakeWatchMixin, TestCase):
+    def test_app_pod(self):
+        app = make_app("web")
+        self.pods = [self.pod("web-1", "1", app=str(app.uuid), namespace="project-web")]
+        watch_cache.start(["pods"])
+        self.wait_for(lambda: watch_cache.get_informer("pods") is not None)
+        self.assertEqual(get_app_pod(app), "web-1")
+        self.assertEqual(
+            async_to_sync(list_app_pods)("project-web", str(app.uuid)), ["web-1"]
+        )
+        # only the informer's list and watches reached the API server
+        self.assertEqual({r.path for r in self.server.requests}, {"/api/v1/pods"})
+        self.assertEqual(len(self.list_requests()), 1)
+
+    def test_fallback(self):
+        app = make_app("web")
+        self.server.route(
+            "GET",
+            r"/api/v1/namespaces/project-web/pods",
+            (
+                200,
+                {"kind": "PodList", "metadata": {}, "items": [self.pod("live", "1")]},
+            ),
+        )
+        self.assertEqual(get_app_pod(app), "live")
@@ -0,0 +1,266 @@
+"""
+Watch based, in-memory cache of the cluster objects read on hot paths.
+
+Every cached resource has an `Informer`: a background thread which lists the
+objects once, then watches for changes from the list's resourceVersion and
+resumes from the last seen one whenever a watch times out. A watch which can't
+be resumed (410 Gone), or any error, leads to a fresh list, as does every
+`KUBE_WATCH_RESYNC` seconds.
+
+Objects are kept as the API's JSON, indexed by namespace and name and by
+namespace and `appUuid` label. Readers use `get_informer()`, which returns None
+until the informer is in sync, and fall back to a live API call then:
+
+    informer = watch_cache.get_informer("pods")
+    if informer is not None:
+        pods = informer.by_app(namespace, app_uuid)
+
+The informers are started by `start()` in the ASGI application.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from kubernetes.client.rest import ApiException
+from kubernetes.watch.watch import iter_resp_lines
+
+from .kubernetes import apps_v1_api, core_v1_api, custom_objects_api
+
+logger = logging.getLogger("django")
+
+APP_UUID_LABEL = "appUuid"
+
+
+class WatchExpired(Exception):
+    pass
+
+
+def _list_pods(**kwargs):
+    return core_v1_api().list_pod_for_all_namespaces(
+        label_selector=APP_UUID_LABEL, **kwargs
+    )
+
+
+def _list_statefulsets(**kwargs):
+    return apps_v1_api().list_stateful_set_for_all_namespaces(**kwargs)
+
+
+def _list_applications(**kwargs):
+    return custom_objects_api().list_cluster_custom_object(
+        "dev.shapeblock.com", "v1alpha1", "applications", **kwargs
+    )
+
+
+RESOURCES: Dict[str, Callable] = {
+    "pods": _list_pods,
+    "statefulsets": _list_statefulsets,
+    "applications": _list_applications,
+}
+
+
+def _key(obj: Dict) -> Tuple[str, str]:
+    metadata = obj["metadata"]
+    return metadata.get("namespace", ""), metadata["name"]
+
+
+def _app_uuid(obj: Dict) -> Optional[str]:
+    return (obj["metadata"].get("labels") or {}).get(APP_UUID_LABEL)
+
+
+class Informer:
+    """
+    `on_change`, if given, is called with every listed, added or modified
+    object, from the informer's thread.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        list_objects: Callable,
+        on_change: Optional[Callable[[Dict], None]] = None,
+    ):
+        self.name = name
+        self._list_objects = list_objects
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._objects: Dict[Tuple[str, str], Dict] = {}
+        self._by_app: Dict[Tuple[str, str], Set[str]] = {}
+        self.resource_version: Optional[str] = None
+        self.synced = threading.Event()
+        self.last_list = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # reads
+
+    def get(self, namespace: str, name: str) -> Optional[Dict]:
+        with self._lock:
+            return self._objects.get((namespace, name))
+
+    def by_app(self, namespace: str, app_uuid: str) -> List[Dict]:
+        """
+        The objects labelled with `app_uuid` in `namespace`, sorted by name.
+        """
+        with self._lock:
+            names = sorted(self._by_app.get((namespace, app_uuid), ()))
+            return [self._objects[(namespace, name)] for name in names]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._objects)
+
+    # the store
+
+    def _index(self, obj: Dict):
+        app_uuid = _app_uuid(obj)
+        if app_uuid:
+            namespace, name = _key(obj)
+            self._by_app.setdefault((namespace, app_uuid), set()).add(name)
+
+    def _unindex(self, obj: Dict):
+        app_uuid = _app_uuid(obj)
+        if app_uuid:
+            namespace, name = _key(obj)
+            names = self._by_app.get((namespace, app_uuid))
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._by_app[(namespace, app_uuid)]
+
+    def replace(self, objects: List[Dict], resource_version: str):
+        with self._lock:
+            self._objects = {}
+            self._by_app = {}
+            for obj in objects:
+                self._objects[_key(obj)] = obj
+                self._index(obj)
+            self.resource_version = resource_version
+        if self.on_change is not None:
+            for obj in objects:
+                self.on_change(obj)
+
+    def apply(self, event: Dict):
+        event_type, obj = event["type"], event["object"]
+        if event_type == "ERROR":
+            if obj.get("code") == 410:
+                raise WatchExpired(obj.get("message"))
+            raise ApiException(status=obj.get("code"), reason=obj.get("message"))
+        with self._lock:
+            if event_type in ("ADDED", "MODIFIED", "DELETED"):
+                key = _key(obj)
+                previous = self._objects.pop(key, None)
+                if previous is not None:
+                    self._unindex(previous)
+                if event_type != "DELETED":
+                    self._objects[key] = obj
+                    self._index(obj)
+            # bookmarks only carry the resourceVersion
+            self.resource_version = obj["metadata"]["resourceVersion"]
+        if self.on_change is not None and event_type in ("ADDED", "MODIFIED"):
+            self.on_change(obj)
+
+    # the watch loop
+
+    def list(self):
+        response = self._list_objects(_preload_content=False)
+        data = json.loads(response.data)
+        self.replace(data.get("items") or [], data["metadata"]["resourceVersion"])
+        self.last_list = time.monotonic()
+        self.synced.set()
+
+    def watch(self):
+        """
+        Apply the events of one watch request, which the API server ends after
+        `KUBE_WATCH_TIMEOUT` seconds.
+        """
+        timeout = settings.KUBE_WATCH_TIMEOUT
+        response = self._list_objects(
+            watch=True,
+            resource_version=self.resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=timeout,
+            _preload_content=False,
+            _request_timeout=timeout + 10,
+        )
+        try:
+            for line in iter_resp_lines(response):
+                self.apply(json.loads(line))
+                if self._stopped.is_set():
+                    return
+        finally:
+            response.close()
+            response.release_conn()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                resync = time.monotonic() - self.last_list > settings.KUBE_WATCH_RESYNC
+                if not self.synced.is_set() or resync:
+                    self.list()
+                self.watch()
+            except WatchExpired:
+                logger.info(f"Watch of {self.name} expired, listing again.")
+                self.synced.clear()
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info(f"Watch of {self.name} expired, listing again.")
+                else:
+                    logger.warning(f"Watch of {self.name} failed: {e.reason}")
+                    self._stopped.wait(settings.KUBE_WATCH_RETRY_DELAY)
+                self.synced.clear()
+            except Exception as e:
+                # stale until listed again, readers go to the API meanwhile
+                logger.warning(f"Watch of {self.name} failed: {e}")
+                self.synced.clear()
+                self._stopped.wait(settings.KUBE_WATCH_RETRY_DELAY)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name=f"watch-{self.name}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, wait: Optional[float] = None):
+        self._stopped.set()
+        self.synced.clear()
+        if wait is not None and self._thread is not None:
+            self._thread.join(wait)
+
+
+_informers: Dict[str, Informer] = {}
+_lock = threading.Lock()
+
+
+def start(names=None):
+    """
+    Start the informers of `names`, by default of every resource, unless the
+    cache is disabled with `KUBE_WATCH_CACHE`.
+    """
+    if not settings.KUBE_WATCH_CACHE:
+        return
+    with _lock:
+        for name in names or RESOURCES:
+            if name not in _informers:
+                _informers[name] = Informer(name, RESOURCES[name]).start()
+
+
+def get_informer(name: str) -> Optional[Informer]:
+    informer = _informers.get(name)
+    if informer is None or not informer.synced.is_set():
+        return None
+    return informer
+
+
+def stop(wait: Optional[float] = None):
+    """
+    Stop the informers, waiting up to `wait` seconds for each of them to finish.
+    """
+    with _lock:
+        for informer in _informers.values():
+            informer.stop(wait)
+        _informers.clear()